@@ -1,26 +1,92 @@
 """FastAPI application factory and route handlers."""
 
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 
 from models import (
-    ClassifyRequest, ClassifyResponse,
-    FolderRequest, ImageInfo,
-    UndoRequest, UndoResponse
+    ClassifyJobStatus, ClassifyRequest, ClassifyResponse, ColumnarImageList,
+    FolderPageRequest, FolderRequest, ImageInfo, ImagePage, JournalBatchSummary,
+    ManifestUndoRequest, ManifestUndoResponse, MaterializeRequest, MemoryReport,
+    PrefetchRequest, PrefetchResponse, SuggestRequest, ThumbnailFormat, TileInfo,
+    UndoError, UndoRequest, UndoResponse
 )
+from utils.app_data import get_app_data_dir
+from utils.classification import LabelFolderRegistry, classify_batch
+from utils.dataset import stream_dataset_ndjson, walk_images
+from utils.encoding import resolve_path, resolve_paths
 from utils.file_operations import (
+    etag_matches,
+    file_etag,
     get_images_from_folder,
-    move_image_to_label_folder,
-    restore_file
+    get_images_page,
+    resolve_folder_path,
+    resolve_image_path,
+    resolve_target_folder,
+    restore_file,
+    stream_images_ndjson
+)
+from utils.folder_index import FolderIndex
+from utils.image_hashing import ImageHasher
+from utils.jobs import JobManager
+from utils.journal import MoveJournal
+from utils.manifest import (
+    DEFAULT_MANIFEST_NAME,
+    LabelManifest,
+    ManifestRegistry,
+    effective_labels,
+    record_labels
 )
+from utils.memory import MemoryBudget, budget_from_env
+from utils.metadata import MetadataReader, needs_listing_options
+from utils.metrics import METRICS, InstrumentationMiddleware
+from utils.prefetch import ThumbnailPrefetcher
+from utils.suggestions import SUGGESTION_MODEL_NAME, LabelSuggester
+from utils.thumbnails import DEFAULT_THUMBNAIL_SIZE, THUMBNAIL_FORMATS, ThumbnailCache
+from utils.tiles import DEFAULT_TILE_CACHE_MAX_BYTES, TileRenderer
+from utils.watcher import FolderWatcher
+from utils.wire import columnar_images, dumps
+
+# 変更がない間もプロキシや接続を維持するためのSSEコメント送出間隔（秒）
+WATCH_KEEPALIVE_SECONDS = 15.0
+logger = logging.getLogger(__name__)
+
+# "1" のとき X-Profile: 1 ヘッダ付きのリクエストをcProfileで計測する
+PROFILING_ENV = "IMAGE_SORTER_PROFILING"
+# 元画像のHTTPキャッシュ期間。期限切れ後もETagで再検証されるため本体は再送されない
+IMAGE_CACHE_CONTROL = "private, max-age=86400"
+# 分類ジョブの進捗をSSEで送る間隔（秒）
+JOB_PROGRESS_INTERVAL_SECONDS = 0.5
 
 
 def create_app() -> FastAPI:
     """Create and configure FastAPI application."""
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        yield
+        app.state.job_manager.shutdown()
+        app.state.prefetcher.shutdown()
+        app.state.tile_renderer.shutdown()
+        app.state.image_hasher.shutdown()
+        app.state.label_suggester.shutdown()
+        app.state.folder_index.close()
+        app.state.journal.close()
+        app.state.manifests.close()
+
     app = FastAPI(
         title="Image Sorter API",
         description="FastAPI backend for image classification and sorting",
         version="1.0.0",
+        lifespan=lifespan,
     )
 
     app.add_middleware(
@@ -31,17 +97,160 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
 
+    data_dir = get_app_data_dir()
+    profile_dir = data_dir / "profiles" if os.environ.get(PROFILING_ENV) == "1" else None
+    app.add_middleware(InstrumentationMiddleware, profile_dir=profile_dir)
+
+    # メモリ上のキャッシュ全体で共有する予算（超えると全キャッシュで最も古いものから追い出す）
+    memory_budget = MemoryBudget(budget_from_env())
+    folder_index = FolderIndex(data_dir / "folder_index.sqlite3")
+    thumbnail_cache = ThumbnailCache(data_dir / "thumbnails", budget=memory_budget)
+    prefetcher = ThumbnailPrefetcher(thumbnail_cache)
+    tile_renderer = TileRenderer(
+        ThumbnailCache(data_dir / "tiles", DEFAULT_TILE_CACHE_MAX_BYTES, budget=memory_budget)
+    )
+    image_hasher = ImageHasher(folder_index)
+    metadata_reader = MetadataReader(folder_index)
+    label_suggester = LabelSuggester(data_dir / SUGGESTION_MODEL_NAME, folder_index)
+    label_registry = LabelFolderRegistry(budget=memory_budget)
+    # 起動時に前回異常終了したバッチの復旧も行う
+    journal = MoveJournal(data_dir / "journal.jsonl", budget=memory_budget)
+    job_manager = JobManager(
+        label_registry, journal,
+        on_finished=lambda job: label_suggester.learn_batch(
+            job.image_paths, job.labels, job.moved_files, job.errors
+        ),
+        budget=memory_budget
+    )
+    memory_budget.register("label_folders", label_registry)
+    memory_budget.register("classify_jobs", job_manager)
+    memory_budget.register("journal", journal)
+    memory_budget.register("thumbnail_index", thumbnail_cache)
+    memory_budget.register("tile_index", tile_renderer.cache)
+    manifests = ManifestRegistry()
+    app.state.journal = journal
+    app.state.manifests = manifests
+    app.state.label_registry = label_registry
+    app.state.job_manager = job_manager
+    app.state.folder_index = folder_index
+    app.state.thumbnail_cache = thumbnail_cache
+    app.state.prefetcher = prefetcher
+    app.state.tile_renderer = tile_renderer
+    app.state.image_hasher = image_hasher
+    app.state.label_suggester = label_suggester
+    app.state.memory_budget = memory_budget
+
     @app.get("/")
     async def root() -> dict[str, str]:
         """Root endpoint returning API information."""
         return {"message": "Image Sorter API", "version": "1.0.0"}
 
-    @app.post("/get-images")
-    async def get_images(request: FolderRequest) -> list[ImageInfo]:
-        """Get image files from specified folder."""
+    @app.get("/metrics")
+    def metrics() -> PlainTextResponse:
+        """Expose request timings, per-phase move timings and counters in Prometheus format."""
+        prefetch = prefetcher.status()
+        extra = [
+            ("thumbnail_cache_hits_total", "counter", "Thumbnail cache hits", thumbnail_cache.hits),
+            ("thumbnail_cache_misses_total", "counter", "Thumbnail cache misses", thumbnail_cache.misses),
+            ("thumbnail_cache_bytes", "gauge", "Bytes held by the thumbnail cache", thumbnail_cache.total_bytes),
+            ("tile_cache_hits_total", "counter", "Tile cache hits", tile_renderer.cache.hits),
+            ("tile_cache_misses_total", "counter", "Tile cache misses", tile_renderer.cache.misses),
+            ("folder_index_hits_total", "counter", "Folder listings served from the index", folder_index.hits),
+            ("folder_index_rescans_total", "counter", "Folder listings that needed a rescan", folder_index.rescans),
+            ("prefetch_pending", "gauge", "Thumbnails waiting to be prefetched", prefetch["pending"]),
+            ("prefetch_completed_total", "counter", "Thumbnails generated by the prefetcher", prefetch["completed"]),
+            ("memory_budget_used_bytes", "gauge", "Bytes held by caches under the memory budget",
+             memory_budget.used_bytes()),
+            ("memory_budget_evictions_total", "counter", "Cache entries evicted to stay within the memory budget",
+             memory_budget.evictions),
+        ]
+        return PlainTextResponse(
+            METRICS.render(extra), media_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+    @app.get("/debug/memory")
+    def debug_memory() -> MemoryReport:
+        """Report the shared cache budget, the size of each in-memory cache and process memory."""
+        return MemoryReport(**memory_budget.report())
+
+    def suggest_images(
+        images: list[ImageInfo],
+        candidates: list[str] | None = None,
+        min_confidence: float = 0.0
+    ) -> list[ImageInfo]:
+        """画像一覧に提案ラベルと確信度を付与する（ハッシュ未計算の画像はプロセスプールで計算する）"""
+        hashes = image_hasher.path_hashes([image.path for image in images])
+        result = []
+        for image, suggestion in zip(images, label_suggester.predict(hashes, candidates)):
+            if suggestion is not None and suggestion.confidence >= min_confidence:
+                image = image.model_copy(update={
+                    "suggested_label": suggestion.label,
+                    "suggestion_confidence": suggestion.confidence,
+                })
+            result.append(image)
+        return result
+
+    def columnar_response(listing: dict) -> Response:
+        # Pydanticでの検証・シリアライズを経ずにそのままエンコードする
+        return Response(content=dumps(listing), media_type="application/json")
+
+    @app.post("/get-images", response_model_exclude_none=True)
+    async def get_images(request: FolderRequest) -> list[ImageInfo] | ColumnarImageList:
+        """Get image files from specified folder.
+
+        Optionally sorted and filtered by metadata, with metadata fields, and
+        grouped into near-duplicate clusters, or with suggested labels. With
+        ``response_format`` set to ``columnar`` the listing is returned as a
+        ColumnarImageList.
+        """
+        columnar = request.response_format == "columnar"
         try:
-            print(f"[DEBUG] Original folder_path: {request.folder_path}")
-            return get_images_from_folder(request.folder_path)
+            logger.debug("get-images folder_path=%s", request.folder_path)
+            if request.recursive:
+                if request.group_duplicates or request.suggest_labels or needs_listing_options(request):
+                    raise HTTPException(
+                        status_code=400,
+                        detail="再帰モードではソート・フィルタ・重複グループ・ラベルの提案は使用できません"
+                    )
+
+                def list_recursive() -> list[ImageInfo] | Response:
+                    folder_path = resolve_folder_path(request.folder_path)
+                    images = [
+                        image
+                        for batch in walk_images(folder_path, request.include, request.exclude)
+                        for image in batch
+                    ]
+                    # 並列走査の完了順は不定のため、相対パス順に並べ替える
+                    images.sort(key=lambda image: (image.subpath, image.filename))
+                    if columnar:
+                        return columnar_response(columnar_images(str(folder_path), images))
+                    return images
+
+                return await run_in_threadpool(list_recursive)
+
+            if not request.group_duplicates and not request.suggest_labels and not needs_listing_options(request):
+                # 画像ごとのモデルを作らず、ファイル名のリストから少しずつエンコードして送る
+                listing = await run_in_threadpool(get_images_from_folder, request.folder_path, folder_index)
+                return StreamingResponse(
+                    listing.iter_json(request.response_format), media_type="application/json"
+                )
+
+            # ヘッダ読み込みとハッシュ計算はブロッキング処理のため、イベントループの外で実行する
+            def list_images() -> list[ImageInfo] | Response:
+                folder_path = resolve_folder_path(request.folder_path)
+                images = metadata_reader.list_images(folder_path, request)
+                if request.group_duplicates:
+                    images = image_hasher.group_images(
+                        folder_path, images,
+                        request.duplicate_distance, request.representatives_only
+                    )
+                if request.suggest_labels:
+                    images = suggest_images(images)
+                if columnar:
+                    return columnar_response(columnar_images(str(folder_path), images))
+                return images
+
+            return await run_in_threadpool(list_images)
         except FileNotFoundError:
             raise HTTPException(status_code=404, detail="指定されたフォルダが存在しません")
         except NotADirectoryError:
@@ -50,35 +259,315 @@ def create_app() -> FastAPI:
             raise HTTPException(status_code=403, detail="フォルダへのアクセス権限がありません")
         except UnicodeError as e:
             raise HTTPException(status_code=400, detail=f"文字エンコーディングエラー: {str(e)}")
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"フォルダ読み込み中にエラーが発生しました: {str(e)}")
 
+    @app.post("/get-images/page")
+    def get_images_page_endpoint(request: FolderPageRequest) -> ImagePage:
+        """Get a single page of image files from specified folder."""
+        try:
+            return get_images_page(
+                request.folder_path, request.offset, request.limit, request.cursor
+            )
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="指定されたフォルダが存在しません")
+        except NotADirectoryError:
+            raise HTTPException(status_code=400, detail="指定されたパスはフォルダではありません")
+        except PermissionError:
+            raise HTTPException(status_code=403, detail="フォルダへのアクセス権限がありません")
+        except UnicodeError as e:
+            raise HTTPException(status_code=400, detail=f"文字エンコーディングエラー: {str(e)}")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"フォルダ読み込み中にエラーが発生しました: {str(e)}")
+
+    @app.post("/get-images/stream")
+    def stream_images(request: FolderRequest) -> StreamingResponse:
+        """Stream image files of specified folder, or of its whole tree, as NDJSON while scanning."""
+        try:
+            folder_path = resolve_folder_path(request.folder_path)
+            if request.recursive:
+                chunks = stream_dataset_ndjson(folder_path, request.include, request.exclude)
+            else:
+                chunks = stream_images_ndjson(folder_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="指定されたフォルダが存在しません")
+        except NotADirectoryError:
+            raise HTTPException(status_code=400, detail="指定されたパスはフォルダではありません")
+        except PermissionError:
+            raise HTTPException(status_code=403, detail="フォルダへのアクセス権限がありません")
+        except UnicodeError as e:
+            raise HTTPException(status_code=400, detail=f"文字エンコーディングエラー: {str(e)}")
+
+        return StreamingResponse(chunks, media_type="application/x-ndjson")
+
+    @app.get("/tiles/info")
+    def get_tile_info(
+        path: str,
+        format: ThumbnailFormat = Query("jpeg"),
+    ) -> TileInfo:
+        """Return the DeepZoom pyramid geometry of an image for a zooming viewer."""
+        try:
+            info = tile_renderer.info(resolve_image_path(path))
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="指定された画像が存在しません")
+        except PermissionError:
+            raise HTTPException(status_code=403, detail="画像へのアクセス権限がありません")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return TileInfo(**info._asdict(), format=format)
+
+    @app.get("/tiles/{level}/{col}/{row}")
+    def get_tile(
+        level: int,
+        col: int,
+        row: int,
+        path: str,
+        format: ThumbnailFormat = Query("jpeg"),
+    ) -> FileResponse:
+        """Return one pyramid tile, rendering its level on first access."""
+        try:
+            tile_path = tile_renderer.get_tile(resolve_image_path(path), level, col, row, format)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="指定された画像が存在しません")
+        except IndexError:
+            raise HTTPException(status_code=404, detail="指定されたタイルが存在しません")
+        except PermissionError:
+            raise HTTPException(status_code=403, detail="画像へのアクセス権限がありません")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"タイル生成中にエラーが発生しました: {str(e)}")
+
+        return FileResponse(
+            tile_path,
+            media_type=THUMBNAIL_FORMATS[format][1],
+            headers={"Cache-Control": "private, max-age=86400"},
+        )
+
+    @app.get("/watch")
+    async def watch_folders(
+        request: Request,
+        folder_path: list[str] = Query([]),
+        target_folder: str | None = None,
+        interval: float = Query(1.0, ge=0.1, le=30.0),
+    ) -> StreamingResponse:
+        """Stream add/remove/rename deltas of image and label folders as Server-Sent Events."""
+        try:
+            folders = [resolve_folder_path(path) for path in folder_path]
+            target = resolve_folder_path(target_folder) if target_folder else None
+            watcher = await run_in_threadpool(FolderWatcher, folders, target)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="指定されたフォルダが存在しません")
+        except NotADirectoryError:
+            raise HTTPException(status_code=400, detail="指定されたパスはフォルダではありません")
+        except PermissionError:
+            raise HTTPException(status_code=403, detail="フォルダへのアクセス権限がありません")
+        except UnicodeError as e:
+            raise HTTPException(status_code=400, detail=f"文字エンコーディングエラー: {str(e)}")
+
+        async def event_stream():
+            try:
+                yield "event: ready\ndata: {}\n\n"
+                idle = 0.0
+                while not await request.is_disconnected():
+                    events = await run_in_threadpool(watcher.wait_and_poll, interval)
+                    if events:
+                        idle = 0.0
+                        payload = json.dumps({"events": events}, ensure_ascii=False)
+                        yield f"event: delta\ndata: {payload}\n\n"
+                    else:
+                        idle += interval
+                        if idle >= WATCH_KEEPALIVE_SECONDS:
+                            idle = 0.0
+                            yield ": keep-alive\n\n"
+            finally:
+                watcher.close()
+
+        return StreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    @app.get("/thumbnail")
+    def get_thumbnail(
+        path: str,
+        thumbnail_size: int = Query(DEFAULT_THUMBNAIL_SIZE, ge=16, le=2048),
+        format: ThumbnailFormat = Query("jpeg"),
+    ) -> FileResponse:
+        """Return a cached, resized thumbnail of the specified image."""
+        try:
+            image_path = resolve_image_path(path)
+            # 先読み中であれば二重にデコードせず完了を待つ
+            prefetcher.wait_for(thumbnail_cache.path_for(image_path, thumbnail_size, format))
+            thumbnail_path = thumbnail_cache.get_or_create(image_path, thumbnail_size, format)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="指定された画像が存在しません")
+        except PermissionError:
+            raise HTTPException(status_code=403, detail="画像へのアクセス権限がありません")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"サムネイル生成中にエラーが発生しました: {str(e)}")
+
+        return FileResponse(
+            thumbnail_path,
+            media_type=THUMBNAIL_FORMATS[format][1],
+            headers={"Cache-Control": "private, max-age=86400"},
+        )
+
+    @app.get("/image")
+    def get_image(path: str, request: Request) -> Response:
+        """Serve an original image with Range, ETag and Cache-Control support."""
+        try:
+            image_path = resolve_image_path(path)
+            st = image_path.stat()
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="指定された画像が存在しません")
+        except PermissionError:
+            raise HTTPException(status_code=403, detail="画像へのアクセス権限がありません")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        etag = file_etag(st)
+        headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        # FileResponse はRangeリクエスト（206/416）を処理し、対応サーバーではsendfileで送出する
+        return FileResponse(image_path, stat_result=st, headers=headers)
+
+    @app.post("/thumbnail/prefetch")
+    def prefetch_thumbnails(request: PrefetchRequest) -> PrefetchResponse:
+        """Queue thumbnails of the next pages for background generation."""
+        image_paths: list[Path] = []
+        for image_path in request.image_paths:
+            try:
+                image_paths.append(resolve_image_path(image_path))
+            except (FileNotFoundError, ValueError):
+                continue
+
+        if request.folder_path and request.count > 0:
+            try:
+                listing = get_images_from_folder(request.folder_path, folder_index)
+            except FileNotFoundError:
+                raise HTTPException(status_code=404, detail="指定されたフォルダが存在しません")
+            except NotADirectoryError:
+                raise HTTPException(status_code=400, detail="指定されたパスはフォルダではありません")
+            except PermissionError:
+                raise HTTPException(status_code=403, detail="フォルダへのアクセス権限がありません")
+            image_paths.extend(
+                Path(path) for path in listing.paths(request.offset, request.offset + request.count)
+            )
+
+        queued = prefetcher.submit(image_paths, request.thumbnail_size, request.format)
+        return PrefetchResponse(queued=queued)
+
+    @app.delete("/thumbnail/prefetch")
+    def cancel_prefetch() -> dict[str, int]:
+        """Cancel pending thumbnail generation, e.g. after switching folders."""
+        return {"cancelled": prefetcher.cancel()}
+
+    @app.post("/suggestions", response_model_exclude_none=True)
+    def suggest_labels(request: SuggestRequest) -> list[ImageInfo]:
+        """Suggest labels, with confidences, for the given images in request order.
+
+        The model learns from every classification. Calling this for the
+        next page in advance also computes and stores the hashes it needs.
+        """
+        images = []
+        for image_path_str, resolved in zip(request.image_paths, resolve_paths(request.image_paths)):
+            images.append(ImageInfo(path=image_path_str, filename=resolved.name))
+        return suggest_images(images, request.labels, request.min_confidence)
+
+    def request_labels(request: ClassifyRequest) -> list[str]:
+        """
+        分類リクエストの各画像のラベル名を取り出し、件数を検証する
+
+        Raises:
+            HTTPException: ラベル・サブフォルダの指定が画像パスと対応しない（400）
+        """
+        if request.label_indices is None:
+            labels = request.labels
+        else:
+            table = request.label_table or []
+            if any(not 0 <= index < len(table) for index in request.label_indices):
+                raise HTTPException(status_code=400, detail="ラベル番号がラベル表の範囲外です")
+            # 表の文字列を共有するため、画像ごとのラベル名の複製は作られない
+            labels = [table[index] for index in request.label_indices]
+
+        if len(request.image_paths) != len(labels):
+            raise HTTPException(status_code=400, detail="画像パスとラベルの数が一致しません")
+        if request.subpaths is not None and len(request.subpaths) != len(request.image_paths):
+            raise HTTPException(status_code=400, detail="画像パスとサブフォルダの数が一致しません")
+        return labels
+
+    def open_manifest(manifest_path: str | None, target_folder: str | None = None) -> LabelManifest:
+        """
+        マニフェストのパスを解決して追記先を返す（省略時は対象フォルダの labels.jsonl）
+
+        Raises:
+            FileNotFoundError: 対象フォルダ・マニフェストの親フォルダが存在しない
+            ValueError: 対応していない形式
+        """
+        if manifest_path is None:
+            path = resolve_target_folder(target_folder) / DEFAULT_MANIFEST_NAME
+        else:
+            path = Path(resolve_path(manifest_path).path)
+            if not path.parent.is_dir():
+                raise FileNotFoundError(manifest_path)
+        return manifests.get(path)
+
     @app.post("/classify")
     async def classify_images(request: ClassifyRequest) -> ClassifyResponse:
-        """Classify images and move them to label-specific folders."""
-        print(f"[DEBUG] Classify request - image_paths: {len(request.image_paths)} items")
-        print(f"[DEBUG] Classify request - labels: {request.labels}")
-        print(f"[DEBUG] Classify request - target_folder: {request.target_folder}")
-        
-        if len(request.image_paths) != len(request.labels):
-            raise HTTPException(status_code=400, detail="画像パスとラベルの数が一致しません")
+        """Classify images and move them to label-specific folders.
+
+        Labels are given either per image in ``labels`` or as ``label_indices``
+        into ``label_table``. In ``manifest`` mode nothing is moved: the
+        labels are appended to a manifest as one batch.
+        """
+        labels = request_labels(request)
+        if logger.isEnabledFor(logging.DEBUG):
+            # ラベルの種類数はデバッグ出力時だけ数える
+            logger.debug(
+                "classify images=%d labels=%d target_folder=%s",
+                len(request.image_paths), len(set(labels)), request.target_folder
+            )
 
         try:
-            moved_files = []
-            for i, (image_path, label) in enumerate(zip(request.image_paths, request.labels)):
-                print(f"[DEBUG] Processing image {i+1}: {image_path} -> {label}")
-                
-                move_result = move_image_to_label_folder(
-                    image_path, label, request.target_folder
+            image_paths, subpaths = request.image_paths, request.subpaths
+            if request.apply_to_duplicates:
+                image_paths, origins = await run_in_threadpool(
+                    image_hasher.expand_to_clusters, image_paths, request.duplicate_distance
                 )
-                
-                if move_result:
-                    moved_files.append(move_result)
-                    print(f"[DEBUG] Added to moved_files: {move_result['source']} -> {move_result['destination']}")
-                else:
-                    print(f"[DEBUG] Skipping file: {image_path}")
+                labels = [labels[i] for i in origins]
+                if subpaths is not None:
+                    subpaths = [subpaths[i] for i in origins]
+            if request.mode == "manifest":
+                manifest = open_manifest(request.manifest_path, request.target_folder)
+                batch_id, recorded, errors = await run_in_threadpool(
+                    record_labels, manifest, image_paths, labels, subpaths, folder_index
+                )
+                label_suggester.learn_batch(image_paths, labels, None, errors)
+                return ClassifyResponse(
+                    success=True, moved_files=[], errors=errors, batch_id=batch_id, recorded=recorded
+                )
+            # ファイル移動はブロッキングI/Oのため、イベントループの外で実行する
+            moved_files, errors, batch_id = await run_in_threadpool(
+                classify_batch, image_paths, labels, request.target_folder,
+                registry=label_registry, journal=journal, subpaths=subpaths,
+                mode=request.mode, verify=request.verify,
+                resume_batch_id=request.resume_batch_id
+            )
+            label_suggester.learn_batch(image_paths, labels, moved_files, errors)
+            if errors and logger.isEnabledFor(logging.DEBUG):
+                for error in errors:
+                    logger.debug("classify skipped source=%s detail=%s", error["source"], error["detail"])
 
-            return ClassifyResponse(success=True, moved_files=moved_files)
+            return ClassifyResponse(
+                success=True, moved_files=moved_files, errors=errors, batch_id=batch_id
+            )
 
         except FileNotFoundError:
             raise HTTPException(status_code=404, detail="対象フォルダが存在しません")
@@ -86,23 +575,98 @@ def create_app() -> FastAPI:
             raise HTTPException(status_code=403, detail="ファイル操作の権限がありません")
         except UnicodeError as e:
             raise HTTPException(status_code=400, detail=f"文字エンコーディングエラー: {str(e)}")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"分類処理中にエラーが発生しました: {str(e)}")
 
+    @app.post("/classify/jobs")
+    def create_classify_job(request: ClassifyRequest) -> ClassifyJobStatus:
+        """Start classifying images in the background and return the job id."""
+        labels = request_labels(request)
+        if request.mode == "manifest":
+            raise HTTPException(status_code=400, detail="マニフェストモードは /classify で使用してください")
+
+        try:
+            job = job_manager.create(
+                request.image_paths, labels, request.target_folder, request.subpaths,
+                mode=request.mode, verify=request.verify,
+                resume_batch_id=request.resume_batch_id
+            )
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="対象フォルダが存在しません")
+        except UnicodeError as e:
+            raise HTTPException(status_code=400, detail=f"文字エンコーディングエラー: {str(e)}")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return ClassifyJobStatus(**job.snapshot(include_results=False))
+
+    @app.get("/classify/jobs/{job_id}")
+    def get_classify_job(job_id: str) -> ClassifyJobStatus:
+        """Return progress, and results once finished, of a classification job."""
+        job = job_manager.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="指定されたジョブが存在しません")
+        return ClassifyJobStatus(**job.snapshot(include_results=job.finished))
+
+    @app.get("/classify/jobs/{job_id}/events")
+    async def stream_classify_job(job_id: str, request: Request) -> StreamingResponse:
+        """Stream progress of a classification job as Server-Sent Events until it finishes."""
+        job = job_manager.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="指定されたジョブが存在しません")
+
+        async def event_stream():
+            while not await request.is_disconnected():
+                finished = job.finished
+                payload = json.dumps(job.snapshot(include_results=finished), ensure_ascii=False)
+                if finished:
+                    yield f"event: finished\ndata: {payload}\n\n"
+                    return
+                yield f"event: progress\ndata: {payload}\n\n"
+                await asyncio.sleep(JOB_PROGRESS_INTERVAL_SECONDS)
+
+        return StreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    @app.delete("/classify/jobs/{job_id}")
+    def cancel_classify_job(job_id: str) -> ClassifyJobStatus:
+        """Cancel a classification job; files already moved stay moved."""
+        job = job_manager.cancel(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="指定されたジョブが存在しません")
+        return ClassifyJobStatus(**job.snapshot(include_results=job.finished))
+
     @app.post("/undo")
     async def undo_classification(request: UndoRequest) -> UndoResponse:
         """Undo previous file moves by restoring files to their original locations."""
+        if request.batch_id is not None:
+            return await run_in_threadpool(undo_journal_batch, request.batch_id)
+
         try:
             restored_files = []
+            errors = []
             for file_info in request.moved_files:
-                restore_result = restore_file(
-                    file_info["destination"], 
-                    file_info["source"]
-                )
+                try:
+                    restore_result = restore_file(
+                        file_info["destination"], 
+                        file_info["source"]
+                    )
+                except FileExistsError as e:
+                    # 元の場所に後から作られたファイルは上書きせず、このファイルだけ戻さない
+                    errors.append(UndoError(
+                        source=file_info["destination"], destination=file_info["source"], detail=e.strerror
+                    ))
+                    continue
                 if restore_result:
                     restored_files.append(restore_result)
+                    label_registry.release(Path(restore_result["from"]))
+                    journal.mark_undone(restore_result["from"])
             
-            return UndoResponse(success=True, restored_files=restored_files)
+            return UndoResponse(success=True, restored_files=restored_files, errors=errors)
             
         except PermissionError:
             raise HTTPException(status_code=403, detail="ファイル操作の権限がありません")
@@ -111,4 +675,71 @@ def create_app() -> FastAPI:
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"取り消し処理中にエラーが発生しました: {str(e)}")
 
+    @app.get("/journal/batches")
+    def list_journal_batches(limit: int = Query(50, ge=1, le=1000)) -> list[JournalBatchSummary]:
+        """List journaled classification batches, newest first."""
+        return [JournalBatchSummary(**summary) for summary in journal.list_batches(limit)]
+
+    @app.post("/journal/batches/{batch_id}/undo")
+    def undo_journal_batch(batch_id: str) -> UndoResponse:
+        """Undo every move of a journaled batch without a client round-trip."""
+        errors: list[dict[str, str]] = []
+        try:
+            restored_files = journal.undo(batch_id, errors=errors)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"取り消し処理中にエラーが発生しました: {str(e)}")
+        if restored_files is None:
+            raise HTTPException(status_code=404, detail="指定された分類履歴が存在しません")
+        for restored in restored_files:
+            label_registry.release(Path(restored["from"]))
+        return UndoResponse(
+            success=True, restored_files=restored_files, errors=[UndoError(**error) for error in errors]
+        )
+
+    @app.post("/journal/batches/{batch_id}/redo")
+    def redo_journal_batch(batch_id: str) -> ClassifyResponse:
+        """Re-apply the undone moves of a journaled batch."""
+        try:
+            moved_files = journal.redo(batch_id, registry=label_registry)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"やり直し処理中にエラーが発生しました: {str(e)}")
+        if moved_files is None:
+            raise HTTPException(status_code=404, detail="指定された分類履歴が存在しません")
+        return ClassifyResponse(success=True, moved_files=moved_files, batch_id=batch_id)
+
+    @app.post("/manifest/undo")
+    def undo_manifest(request: ManifestUndoRequest) -> ManifestUndoResponse:
+        """Undo manifest-mode labels by appending tombstones."""
+        try:
+            manifest = open_manifest(request.manifest_path)
+            tombstones = manifest.tombstone(request.batch_id, request.image_paths)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="マニフェストが存在しません")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return ManifestUndoResponse(success=True, tombstones=tombstones)
+
+    @app.post("/manifest/materialize")
+    def materialize_manifest(request: MaterializeRequest) -> ClassifyJobStatus:
+        """Apply the effective labels of a manifest as one background classification job."""
+        try:
+            manifest = open_manifest(request.manifest_path)
+            if not manifest.manifest_path.exists():
+                raise FileNotFoundError(request.manifest_path)
+            entries = list(effective_labels(manifest.read()).values())
+            subpaths = None
+            if any(entry.get("subpath") for entry in entries):
+                subpaths = [entry.get("subpath") or "" for entry in entries]
+            job = job_manager.create(
+                [entry["path"] for entry in entries],
+                [entry["label"] for entry in entries],
+                request.target_folder, subpaths,
+                mode=request.mode, verify=request.verify
+            )
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="マニフェストまたは対象フォルダが存在しません")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return ClassifyJobStatus(**job.snapshot(include_results=False))
+
     return app
\ No newline at end of file
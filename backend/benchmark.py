@@ -0,0 +1,286 @@
+"""Benchmark harness for listing, paging, thumbnailing, classifying and undo.
+
+Generates a synthetic dataset and drives the real ASGI app in-process,
+reporting throughput and p50/p99 latency per scenario as JSON so results
+can be compared between releases::
+
+    python benchmark.py --files 100000 --dir /dev/shm --output bench.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+DEFAULT_FILES = 10_000
+DEFAULT_WIDTH = 640
+DEFAULT_HEIGHT = 480
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_REPEAT = 5
+DEFAULT_THUMBNAIL_COUNT = 200
+DEFAULT_LABELS = 4
+SCENARIOS = ("list", "page", "thumbnail", "classify", "undo")
+
+
+def generate_dataset(folder: Path, count: int, width: int, height: int, empty: bool = False) -> None:
+    """
+    ベンチマーク用の画像フォルダを作成する
+
+    画像は1枚だけエンコードし、同じ内容を全ファイルに書き込む
+
+    Args:
+        folder: 作成先フォルダ
+        count: ファイル数
+        width: 画像の幅
+        height: 画像の高さ
+        empty: Trueの場合は空ファイルにする（一覧・移動のみ計測する場合）
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    if empty:
+        content = b""
+    else:
+        buffer = io.BytesIO()
+        Image.effect_mandelbrot((width, height), (-2.0, -1.2, 1.0, 1.2), 64).convert("RGB").save(
+            buffer, format="JPEG", quality=85
+        )
+        content = buffer.getvalue()
+    for i in range(count):
+        with open(folder / f"img_{i:07d}.jpg", "wb") as f:
+            f.write(content)
+
+
+def summarize(latencies: list[float], items: int) -> dict:
+    """
+    リクエストごとの所要時間を集計する
+
+    Args:
+        latencies: 各リクエストの所要時間（秒）
+        items: 処理した件数（ファイル数など）
+
+    Returns:
+        スループットとパーセンタイル（最近傍順位法）の辞書
+    """
+    ordered = sorted(latencies)
+    total = sum(ordered)
+
+    def percentile(p: float) -> float:
+        if not ordered:
+            return 0.0
+        rank = max(1, -(-len(ordered) * p // 100))
+        return ordered[int(rank) - 1] * 1000
+
+    return {
+        "requests": len(ordered),
+        "items": items,
+        "total_seconds": total,
+        "items_per_second": items / total if total > 0 else 0.0,
+        "mean_ms": total / len(ordered) * 1000 if ordered else 0.0,
+        "p50_ms": percentile(50),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+    }
+
+
+def _timed(call) -> tuple[float, object]:
+    start = time.perf_counter()
+    response = call()
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    return elapsed, response
+
+
+def run_benchmark(
+    work_dir: Path,
+    files: int = DEFAULT_FILES,
+    width: int = DEFAULT_WIDTH,
+    height: int = DEFAULT_HEIGHT,
+    empty: bool = False,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    repeat: int = DEFAULT_REPEAT,
+    thumbnail_count: int = DEFAULT_THUMBNAIL_COUNT,
+    labels: int = DEFAULT_LABELS,
+    scenarios: tuple[str, ...] = SCENARIOS
+) -> dict:
+    """
+    データセットを生成し、各シナリオをASGIアプリ経由で計測する
+
+    Args:
+        work_dir: データセットとアプリデータを作成する空のフォルダ
+        files: ファイル数
+        width: 画像の幅
+        height: 画像の高さ
+        empty: 空ファイルで計測する（thumbnail シナリオは実行しない）
+        batch_size: /classify 1回あたりのファイル数
+        page_size: /get-images/page の1ページの件数
+        repeat: キャッシュ済みの一覧取得を繰り返す回数
+        thumbnail_count: サムネイルを生成する画像数
+        labels: 振り分けるラベル数
+        scenarios: 実行するシナリオ（SCENARIOS の部分集合）
+
+    Returns:
+        パラメータと結果の辞書（JSONに変換可能）
+    """
+    # キャッシュを使用者の環境と分け、毎回コールドな状態から計測する
+    os.environ["IMAGE_SORTER_DATA_DIR"] = str(work_dir / "app-data")
+    from fastapi.testclient import TestClient
+    from app import create_app
+
+    source = work_dir / "source"
+    target = work_dir / "target"
+    target.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    generate_dataset(source, files, width, height, empty)
+    generate_seconds = time.perf_counter() - start
+
+    results: dict[str, dict] = {}
+    with TestClient(create_app()) as client:
+        app_version = client.get("/").json()["version"]
+
+        if "list" in scenarios:
+            body = {"folder_path": str(source)}
+            cold, _ = _timed(lambda: client.post("/get-images", json=body))
+            results["list_cold"] = summarize([cold], files)
+            warm = [_timed(lambda: client.post("/get-images", json=body))[0] for _ in range(repeat)]
+            results["list_warm"] = summarize(warm, files * repeat)
+
+        if "page" in scenarios:
+            latencies = []
+            listed = 0
+            cursor = ""
+            while cursor is not None:
+                elapsed, response = _timed(lambda: client.post("/get-images/page", json={
+                    "folder_path": str(source), "limit": page_size, "cursor": cursor,
+                }))
+                latencies.append(elapsed)
+                page = response.json()
+                listed += len(page["images"])
+                cursor = page["next_cursor"]
+            results["page"] = summarize(latencies, listed)
+
+        paths = [str(source / f"img_{i:07d}.jpg") for i in range(files)]
+
+        if "thumbnail" in scenarios and not empty:
+            sample = paths[:thumbnail_count]
+            for name in ("thumbnail_cold", "thumbnail_warm"):
+                latencies = [
+                    _timed(lambda: client.get("/thumbnail", params={"path": path}))[0]
+                    for path in sample
+                ]
+                results[name] = summarize(latencies, len(sample))
+
+        batch_ids = []
+        if "classify" in scenarios:
+            latencies = []
+            moved = 0
+            for offset in range(0, files, batch_size):
+                batch = paths[offset:offset + batch_size]
+                elapsed, response = _timed(lambda: client.post("/classify", json={
+                    "image_paths": batch,
+                    "labels": [f"label_{i % labels}" for i in range(len(batch))],
+                    "target_folder": str(target),
+                }))
+                latencies.append(elapsed)
+                data = response.json()
+                moved += len(data["moved_files"])
+                batch_ids.append(data["batch_id"])
+            results["classify"] = summarize(latencies, moved)
+
+        if "undo" in scenarios and batch_ids:
+            latencies = []
+            restored = 0
+            for batch_id in reversed(batch_ids):
+                elapsed, response = _timed(lambda: client.post("/undo", json={"batch_id": batch_id}))
+                latencies.append(elapsed)
+                restored += len(response.json()["restored_files"])
+            results["undo"] = summarize(latencies, restored)
+
+    return {
+        "app_version": app_version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": {
+            "files": files,
+            "width": width,
+            "height": height,
+            "empty": empty,
+            "batch_size": batch_size,
+            "page_size": page_size,
+            "repeat": repeat,
+            "thumbnail_count": thumbnail_count,
+            "labels": labels,
+            "work_dir": str(work_dir),
+        },
+        "generate_seconds": generate_seconds,
+        "results": results,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    """コマンドラインから実行する"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=DEFAULT_FILES)
+    parser.add_argument("--width", type=int, default=DEFAULT_WIDTH)
+    parser.add_argument("--height", type=int, default=DEFAULT_HEIGHT)
+    parser.add_argument("--empty-files", action="store_true",
+                        help="create empty files (skips the thumbnail scenario)")
+    parser.add_argument("--dir", type=Path, default=None,
+                        help="where to create the dataset, e.g. /dev/shm for tmpfs")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--thumbnail-count", type=int, default=DEFAULT_THUMBNAIL_COUNT)
+    parser.add_argument("--labels", type=int, default=DEFAULT_LABELS)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--output", type=Path, default=None, help="JSON file (default: stdout)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated dataset")
+    args = parser.parse_args(argv)
+
+    scenarios = tuple(name for name in args.scenarios.split(",") if name)
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    work_dir = Path(tempfile.mkdtemp(prefix="image-sorter-bench-", dir=args.dir))
+    # 標準出力はJSON専用とし、アプリのログ出力は標準エラーに回す
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            report = run_benchmark(
+                work_dir,
+                files=args.files,
+                width=args.width,
+                height=args.height,
+                empty=args.empty_files,
+                batch_size=args.batch_size,
+                page_size=args.page_size,
+                repeat=args.repeat,
+                thumbnail_count=args.thumbnail_count,
+                labels=args.labels,
+                scenarios=scenarios,
+            )
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
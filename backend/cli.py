@@ -0,0 +1,277 @@
+"""Headless bulk classification from a label file, with journaled undo.
+
+Streams a CSV or JSONL file of ``path,label[,subpath]`` rows (or a manifest
+written by manifest mode) through the same classification engine as the
+API, in chunks, and records every move in a journal so a run can be
+undone or resumed::
+
+    python cli.py apply labels.csv --target /data/sorted --workers 16
+    python cli.py apply labels.jsonl --target /data/sorted --resume <batch_id>
+    python cli.py undo <batch_id>
+    python cli.py batches
+
+The whole run is a single journal batch; the summary (with its batch id)
+is printed to stdout as JSON and progress goes to stderr. The CLI keeps
+its own journal (``cli-journal.jsonl`` in the app data directory) so it
+can run while the app is open.
+"""
+
+import argparse
+import json
+import logging
+import signal
+import sys
+import threading
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Iterator
+
+from utils.app_data import get_app_data_dir
+from utils.classification import LabelFolderRegistry, classify_batch
+from utils.journal import MoveJournal
+from utils.manifest import OP_TOMBSTONE, effective_labels, read_manifest
+from utils.transfer import TRANSFER_COPY, TRANSFER_MOVE
+
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_WORKERS = 16
+DEFAULT_JOURNAL_NAME = "cli-journal.jsonl"
+PROGRESS_INTERVAL_SECONDS = 1.0
+
+
+def iter_label_chunks(label_file: Path, chunk_size: int, manifest: bool = False) -> Iterator[list[dict]]:
+    """
+    ラベルファイルを chunk_size 行ずつ読み込む
+
+    Args:
+        label_file: CSV・JSONL（Parquetは pyarrow がある場合のみ）のラベルファイル
+        chunk_size: 1回に返す行数
+        manifest: 墓標を含むマニフェストとして最新のラベルを求めてから返す（全体を読み込む）
+
+    Returns:
+        path・label・subpath を持つ記録のリストのイテレータ
+
+    Raises:
+        ValueError: manifest を指定せずに墓標を含むファイルを読んだ
+    """
+    if manifest:
+        records = iter(effective_labels(read_manifest(label_file)).values())
+    else:
+        records = _label_records(label_file)
+    while chunk := list(islice(records, chunk_size)):
+        yield chunk
+
+
+def _label_records(label_file: Path) -> Iterator[dict]:
+    for record in read_manifest(label_file):
+        if record["op"] == OP_TOMBSTONE:
+            raise ValueError("取り消しを含むマニフェストです。--manifest を指定してください")
+        yield record
+
+
+class Progress:
+    """Counts classified files and prints a throttled progress line."""
+
+    def __init__(self, stream=sys.stderr):
+        self.stream = stream
+        self.processed = 0
+        self.moved = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self._last_print = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, moved: bool, nbytes: int) -> None:
+        """classify_batch の進捗コールバック"""
+        with self._lock:
+            self.processed += 1
+            if moved:
+                self.moved += 1
+                self.bytes += nbytes
+            else:
+                self.failed += 1
+            now = time.monotonic()
+            if now - self._last_print >= PROGRESS_INTERVAL_SECONDS:
+                self._last_print = now
+                self.print()
+
+    def print(self, final: bool = False) -> None:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        line = (
+            f"processed {self.processed}  moved {self.moved}  errors {self.failed}  "
+            f"{self.bytes / 1024 / 1024:.1f} MiB  {self.processed / elapsed:.0f} files/s"
+        )
+        if self.stream.isatty():
+            self.stream.write("\r" + line + ("\n" if final else ""))
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+
+def apply_labels(
+    label_file: Path,
+    target_folder: str,
+    journal: MoveJournal,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    workers: int = DEFAULT_WORKERS,
+    mode: str = TRANSFER_MOVE,
+    verify: bool = False,
+    resume_batch_id: str | None = None,
+    manifest: bool = False,
+    errors_file=None,
+    progress: Progress | None = None,
+    cancel_event: threading.Event | None = None
+) -> dict:
+    """
+    ラベルファイルの画像をラベルフォルダに振り分ける
+
+    チャンクごとに classify_batch を呼び、すべてのチャンクを1つのジャーナルバッチに記録する
+
+    Args:
+        label_file: ラベルファイル
+        target_folder: 対象フォルダ
+        journal: 移動を記録するジャーナル
+        chunk_size: 1回の classify_batch に渡す行数
+        workers: 並列に移動する最大数
+        mode: TRANSFER_MOVE または TRANSFER_COPY
+        verify: デバイスをまたぐ移動・コピーで内容を検証する
+        resume_batch_id: 中断したバッチの続きとして実行する
+        manifest: 墓標を含むマニフェストとして読む
+        errors_file: 指定した場合はエラーを1行1件のJSONで書き出す
+        progress: 進捗の表示先
+        cancel_event: セットされると未着手のファイルを処理せずに終了する
+
+    Returns:
+        バッチID・件数・所要時間の辞書
+
+    Raises:
+        FileNotFoundError: 対象フォルダが存在しない
+        ValueError: ラベルファイルの形式・サブフォルダ・再開するバッチが不正
+    """
+    progress = progress or Progress()
+    registry = LabelFolderRegistry()
+    batch_id = resume_batch_id
+    for chunk in iter_label_chunks(label_file, chunk_size, manifest):
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        subpaths = None
+        if any(record.get("subpath") for record in chunk):
+            subpaths = [record.get("subpath") or "" for record in chunk]
+        result = classify_batch(
+            [record["path"] for record in chunk],
+            [record["label"] for record in chunk],
+            target_folder,
+            max_workers=workers,
+            registry=registry,
+            on_progress=progress.record,
+            cancel_event=cancel_event,
+            journal=journal,
+            subpaths=subpaths,
+            mode=mode,
+            verify=verify,
+            resume_batch_id=batch_id,
+        )
+        # 2チャンク目以降は同じバッチに続けて記録する
+        batch_id = result.batch_id
+        if errors_file is not None:
+            for error in result.errors:
+                errors_file.write(json.dumps(error, ensure_ascii=False) + "\n")
+    progress.print(final=True)
+
+    return {
+        "batch_id": batch_id,
+        "processed": progress.processed,
+        "moved": progress.moved,
+        "errors": progress.failed,
+        "bytes": progress.bytes,
+        "seconds": time.monotonic() - progress.started,
+        "cancelled": cancel_event is not None and cancel_event.is_set(),
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    """コマンドラインから実行する"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--journal", type=Path, default=None,
+                        help=f"journal file (default: {DEFAULT_JOURNAL_NAME} in the app data directory)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    apply_parser = commands.add_parser("apply", help="classify the images listed in a label file")
+    apply_parser.add_argument("label_file", type=Path, help="CSV/JSONL with path,label[,subpath]")
+    apply_parser.add_argument("--target", required=True, help="folder that receives the label folders")
+    apply_parser.add_argument("--mode", choices=(TRANSFER_MOVE, TRANSFER_COPY), default=TRANSFER_MOVE)
+    apply_parser.add_argument("--verify", action="store_true",
+                              help="verify copies with BLAKE2b before removing sources")
+    apply_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    apply_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    apply_parser.add_argument("--resume", metavar="BATCH_ID", default=None,
+                              help="continue an interrupted run, skipping files it already moved")
+    apply_parser.add_argument("--manifest", action="store_true",
+                              help="apply the latest labels of a manifest with tombstones (loads it fully)")
+    apply_parser.add_argument("--errors", type=Path, default=None, help="write errors as JSONL")
+
+    undo_parser = commands.add_parser("undo", help="undo every move of a batch")
+    undo_parser.add_argument("batch_id")
+    undo_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+
+    batches_parser = commands.add_parser("batches", help="list journaled batches, newest first")
+    batches_parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s %(message)s")
+    journal = MoveJournal(args.journal or get_app_data_dir() / DEFAULT_JOURNAL_NAME)
+    try:
+        if args.command == "batches":
+            print(json.dumps(journal.list_batches(args.limit), ensure_ascii=False, indent=2))
+            return 0
+
+        if args.command == "undo":
+            errors: list[dict[str, str]] = []
+            restored = journal.undo(args.batch_id, max_workers=args.workers, errors=errors)
+            if restored is None:
+                print(f"batch not found: {args.batch_id}", file=sys.stderr)
+                return 1
+            for error in errors:
+                print(f"not restored: {error['source']}: {error['detail']}", file=sys.stderr)
+            print(json.dumps({"batch_id": args.batch_id, "restored": len(restored), "errors": len(errors)}))
+            return 0
+
+        # Ctrl+C では実行中の移動を完了させてから止め、再開用のバッチIDを出力する
+        cancel_event = threading.Event()
+        previous_handler = None
+        if threading.current_thread() is threading.main_thread():
+            previous_handler = signal.signal(signal.SIGINT, lambda signum, frame: cancel_event.set())
+        errors_file = open(args.errors, "w", encoding="utf-8") if args.errors else None
+        try:
+            summary = apply_labels(
+                args.label_file,
+                args.target,
+                journal,
+                chunk_size=args.chunk_size,
+                workers=args.workers,
+                mode=args.mode,
+                verify=args.verify,
+                resume_batch_id=args.resume,
+                manifest=args.manifest,
+                errors_file=errors_file,
+                cancel_event=cancel_event,
+            )
+        except (FileNotFoundError, ValueError) as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 2
+        finally:
+            if previous_handler is not None:
+                signal.signal(signal.SIGINT, previous_handler)
+            if errors_file is not None:
+                errors_file.close()
+        if summary["cancelled"]:
+            print(f"interrupted; resume with: --resume {summary['batch_id']}", file=sys.stderr)
+        print(json.dumps(summary))
+        return 130 if summary["cancelled"] else 0
+    finally:
+        journal.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,101 @@
-"""Image Sorter API - FastAPI backend for image classification."""
+"""Image Sorter API - FastAPI backend for image classification.
+
+Startup is kept short for the bundled executable: Pillow and the other
+image subsystems are imported on first use, and once the socket is
+listening a single ``IMAGE_SORTER_READY <url>`` line is written so the
+Electron main process does not have to poll the port. The line goes to the
+pipe whose descriptor is passed in IMAGE_SORTER_READY_FD, which works in the
+packaged build that has no console, and to stdout when there is one.
+
+Import-time budget: ``import main`` (which also creates the app) should
+stay under IMPORT_TIME_BUDGET_MS as reported by ``python -X importtime``,
+and must not import Pillow. test_api.py checks both.
+"""
+
+import logging
+import multiprocessing
+import os
+import sys
+
+if __name__ == "__main__":
+    # PyInstallerでビルドした実行ファイルからワーカープロセスを起動するために必要
+    multiprocessing.freeze_support()
 
 from app import create_app
 from utils.encoding import setup_locale
 
+# ログレベル（DEBUG/INFO/WARNING...）。DEBUGではリクエストごとの詳細を出力する
+LOG_LEVEL_ENV = "IMAGE_SORTER_LOG_LEVEL"
+# 起動完了を知らせる行の先頭（Electron側の main.ts と一致させる）
+READY_PREFIX = "IMAGE_SORTER_READY"
+# 起動完了の行を書き込むパイプのファイル記述子番号を渡す環境変数
+READY_FD_ENV = "IMAGE_SORTER_READY_FD"
+IMPORT_TIME_BUDGET_MS = 1500
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+
+logging.basicConfig(
+    level=os.environ.get(LOG_LEVEL_ENV, "WARNING").upper(),
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+logger = logging.getLogger(__name__)
 setup_locale()
-app = create_app()
+# spawnで起動したワーカープロセスもこのモジュールを読み込むが、アプリは親プロセスだけで作る
+if multiprocessing.parent_process() is None:
+    app = create_app()
 
 
+def signal_ready(line: str) -> None:
+    """
+    準備完了の行を READY_FD_ENV のパイプと標準出力に書き込む
 
+    コンソールなしでビルドした実行ファイルには標準出力がないため、
+    パイプへは print を使わず os.write で直接書き込む
 
+    Args:
+        line: 改行を含まない準備完了の行
+    """
+    data = f"{line}\n".encode("utf-8")
+    ready_fd = os.environ.get(READY_FD_ENV)
+    if ready_fd:
+        try:
+            fd = int(ready_fd)
+            os.write(fd, data)
+            os.close(fd)
+        except (ValueError, OSError) as e:
+            # 親プロセスがパイプを渡していない場合でも起動は続ける
+            logger.warning("準備完了を通知できませんでした: %s", e)
+    # 単独起動した場合は標準出力がない
+    if sys.stdout is not None:
+        print(line, flush=True)
 
 
-if __name__ == "__main__":
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+    """
+    サーバーを起動し、待ち受けを開始した時点で準備完了の行を出力する
+
+    Args:
+        host: 待ち受けるアドレス
+        port: 待ち受けるポート（0の場合は空きポートを使い、準備完了の行で知らせる）
+    """
     import uvicorn
 
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    class ReadySignallingServer(uvicorn.Server):
+        async def startup(self, sockets=None) -> None:
+            await super().startup(sockets=sockets)
+            if self.started:
+                bound_port = self.servers[0].sockets[0].getsockname()[1]
+                signal_ready(f"{READY_PREFIX} http://{host}:{bound_port}")
+
+    config = uvicorn.Config(app, host=host, port=port, access_log=False)
+    ReadySignallingServer(config).run()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Image Sorter API server")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    serve(args.host, args.port)
@@ -1,20 +1,79 @@
 """Request and response models for the Image Sorter API."""
 
-from pydantic import BaseModel
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+SortKey = Literal[
+    "name", "size", "modified", "width", "height", "pixels", "aspect_ratio", "taken_at"
+]
+ListingFormat = Literal["objects", "columnar"]
+TransferMode = Literal["move", "copy"]
+ClassifyMode = Literal["move", "copy", "manifest"]
+# utils.thumbnails.THUMBNAIL_FORMATS のキー
+ThumbnailFormat = Literal["jpeg", "webp"]
 
 
 class ClassifyRequest(BaseModel):
     """Request model for image classification."""
 
     image_paths: list[str]
-    labels: list[str]
+    # 各画像のラベル名。label_table と label_indices で指定する場合は省略する
+    labels: list[str] = []
     target_folder: str
+    # ラベル名の表と、各画像のラベルの表中の位置（同じラベル名を繰り返し送らない）
+    label_table: list[str] | None = None
+    label_indices: list[int] | None = None
+    # 指定した場合は各画像をラベルフォルダ下の同じ相対フォルダ（ImageInfo.subpath）に移動する
+    subpaths: list[str] | None = None
+    # 指定した画像の重複（知覚ハッシュが近い画像）にも同じラベルを適用する
+    apply_to_duplicates: bool = False
+    # 上限は utils.image_hashing.MAX_DUPLICATE_DISTANCE（これを超えると重複検出がほぼ総当たりになる）
+    duplicate_distance: int = Field(4, ge=0, le=8)
+    # "copy" は元ファイルを残してラベルフォルダにコピーする（データセット作成向け）
+    # "manifest" はファイルを動かさず、画像とラベルの対応をマニフェストに追記する
+    mode: ClassifyMode = "move"
+    # マニフェストのパス（.jsonl / .csv / .parquet）。省略時は対象フォルダの labels.jsonl
+    manifest_path: str | None = None
+    # デバイスをまたぐ移動・コピーでコピー先を読み直して検証する
+    verify: bool = False
+    # 中断・キャンセルしたバッチの続きとして実行し、移動済みのファイルは処理しない
+    resume_batch_id: str | None = None
 
 
 class FolderRequest(BaseModel):
-    """Request model for folder path."""
+    """Request model for folder path.
+
+    Images missing a value used by a filter (e.g. no EXIF date) are
+    excluded by that filter and sorted last by that key.
+    """
 
     folder_path: str
+    # サブフォルダも再帰的に走査する（include/exclude はグロブ）
+    recursive: bool = False
+    include: list[str] = []
+    exclude: list[str] = []
+    group_duplicates: bool = False
+    # 上限は utils.image_hashing.MAX_DUPLICATE_DISTANCE
+    duplicate_distance: int = Field(4, ge=0, le=8)
+    representatives_only: bool = False
+    include_metadata: bool = False
+    sort_by: SortKey | None = None
+    descending: bool = False
+    min_width: int | None = None
+    max_width: int | None = None
+    min_height: int | None = None
+    max_height: int | None = None
+    min_file_size: int | None = None
+    max_file_size: int | None = None
+    min_aspect_ratio: float | None = None
+    max_aspect_ratio: float | None = None
+    taken_after: str | None = None
+    taken_before: str | None = None
+    # "columnar" の場合は ColumnarImageList 形式で返す（大きなフォルダ向け）
+    response_format: ListingFormat = "objects"
+    # 学習済みモデルによるラベルの提案を付ける
+    suggest_labels: bool = False
 
 
 class ImageInfo(BaseModel):
@@ -22,6 +81,65 @@ class ImageInfo(BaseModel):
 
     path: str
     filename: str
+    subpath: str | None = None
+    cluster_id: int | None = None
+    cluster_size: int | None = None
+    size: int | None = None
+    modified_at: float | None = None
+    width: int | None = None
+    height: int | None = None
+    aspect_ratio: float | None = None
+    taken_at: str | None = None
+    suggested_label: str | None = None
+    suggestion_confidence: float | None = None
+
+
+class ColumnarImageList(BaseModel):
+    """Compact listing: a shared folder, the file names and optional value columns.
+
+    The path of image ``i`` is ``folder / columns["subpath"][i] / filenames[i]``
+    (without the subpath part when that column is absent or empty). Only
+    ImageInfo fields that are set for at least one image appear in
+    ``columns``; every column has one entry per file name.
+    """
+
+    folder: str
+    filenames: list[str]
+    columns: dict[str, list] = {}
+
+
+class FolderPageRequest(BaseModel):
+    """Request model for a single page of a folder listing."""
+
+    folder_path: str
+    offset: int = Field(0, ge=0)
+    limit: int = Field(100, ge=1, le=10000)
+    cursor: str | None = None
+
+
+class SuggestRequest(BaseModel):
+    """Request model for label suggestions of the images shown next."""
+
+    image_paths: list[str]
+    # 提案するラベルの候補（省略時は学習済みのすべてのラベル）
+    labels: list[str] | None = None
+    min_confidence: float = Field(0.0, ge=0.0, le=1.0)
+
+
+class ImagePage(BaseModel):
+    """Response model for a single page of a folder listing."""
+
+    images: list[ImageInfo]
+    next_offset: int | None = None
+    next_cursor: str | None = None
+
+
+class ClassifyError(BaseModel):
+    """Per-file error of a classification batch."""
+
+    source: str
+    label: str
+    detail: str
 
 
 class ClassifyResponse(BaseModel):
@@ -29,16 +147,150 @@ class ClassifyResponse(BaseModel):
 
     success: bool
     moved_files: list[dict[str, str]]
+    errors: list[ClassifyError] = []
+    batch_id: str | None = None
+    # マニフェストモードで記録した件数
+    recorded: int | None = None
+
+
+class ClassifyJobStatus(BaseModel):
+    """Progress of a background classification job."""
+
+    job_id: str
+    status: str
+    total: int
+    done: int
+    failed: int
+    bytes_moved: int
+    elapsed_seconds: float
+    files_per_second: float
+    bytes_per_second: float
+    eta_seconds: float | None
+    detail: str | None = None
+    batch_id: str | None = None
+    moved_files: list[dict[str, str]] = []
+    errors: list[ClassifyError] = []
 
 
 class UndoRequest(BaseModel):
-    """Request model for undo operation."""
+    """Request model for undo operation.
+
+    Either the ``moved_files`` returned by /classify, or the ``batch_id`` of
+    a journaled batch to undo entirely on the server.
+    """
+
+    moved_files: list[dict[str, str]] = []
+    batch_id: str | None = None
+
+
+class ManifestUndoRequest(BaseModel):
+    """Request model for tombstoning manifest records.
+
+    With only ``batch_id`` the whole batch is undone; with ``image_paths``
+    only those images (restricted to ``batch_id`` when it is given).
+    """
+
+    manifest_path: str
+    batch_id: str | None = None
+    image_paths: list[str] = []
 
-    moved_files: list[dict[str, str]]
+
+class ManifestUndoResponse(BaseModel):
+    """Response model for manifest undo."""
+
+    success: bool
+    tombstones: int
+
+
+class MaterializeRequest(BaseModel):
+    """Request model for applying the effective labels of a manifest."""
+
+    manifest_path: str
+    target_folder: str
+    mode: TransferMode = "move"
+    verify: bool = False
+
+
+class UndoError(BaseModel):
+    """Per-file error of an undo: the file stays at ``source``."""
+
+    source: str
+    destination: str
+    detail: str
 
 
 class UndoResponse(BaseModel):
     """Response model for undo result."""
 
     success: bool
-    restored_files: list[dict[str, str]]
\ No newline at end of file
+    restored_files: list[dict[str, str]]
+    # 元の場所に別のファイルがあるなどで戻さなかったファイル
+    errors: list[UndoError] = []
+
+
+class PrefetchRequest(BaseModel):
+    """Request model for thumbnail pre-generation.
+
+    ``image_paths`` come first in priority order, followed by up to
+    ``count`` images of ``folder_path`` starting at ``offset``.
+    """
+
+    image_paths: list[str] = []
+    folder_path: str | None = None
+    offset: int = Field(0, ge=0)
+    count: int = Field(0, ge=0)
+    thumbnail_size: int = Field(150, ge=16, le=2048)
+    format: ThumbnailFormat = "jpeg"
+
+
+class PrefetchResponse(BaseModel):
+    """Response model for thumbnail pre-generation."""
+
+    queued: int
+
+
+class JournalBatchSummary(BaseModel):
+    """Summary of a batch recorded in the move journal."""
+
+    batch_id: str
+    target_folder: str
+    created_at: float
+    committed: bool
+    total: int
+    moved: int
+    failed: int
+    undone: int
+
+
+class TileInfo(BaseModel):
+    """DeepZoom geometry of the tile pyramid of an image."""
+
+    width: int
+    height: int
+    tile_size: int
+    overlap: int
+    max_level: int
+    format: str
+
+
+class CacheMemory(BaseModel):
+    """Memory held by one cache."""
+
+    bytes: int
+    entries: int
+    # False の場合は使用量の報告のみで、予算による追い出しの対象外
+    evictable: bool
+
+
+class MemoryReport(BaseModel):
+    """Shared cache budget, per-cache usage and process memory."""
+
+    budget_bytes: int
+    used_bytes: int
+    evictions: int
+    caches: dict[str, CacheMemory]
+    rss_bytes: int | None = None
+    peak_rss_bytes: int | None = None
+    # tracemalloc が有効な場合のみ
+    traced_bytes: int | None = None
+    traced_peak_bytes: int | None = None
@@ -1,16 +1,55 @@
 """Tests for the refactored Image Sorter API."""
 
+import errno
+import io
 import json
+import os
+import subprocess
+import sqlite3
+import sys
 import tempfile
+import threading
+import time
+import tracemalloc
 from pathlib import Path
 from unittest.mock import patch
 
+import httpx
 import pytest
 from fastapi.testclient import TestClient
 
+from PIL import Image
+
+import benchmark
+import cli
 from app import create_app
 from models import FolderRequest, ClassifyRequest, UndoRequest
-from utils.file_operations import SUPPORTED_EXTENSIONS
+from utils.classification import LabelFolderNames, LabelFolderRegistry, classify_batch
+from utils.encoding import normalize_path, resolve_paths, safe_path_decode
+from utils.file_operations import (
+    SUPPORTED_EXTENSIONS, ImageListing, create_placeholder, get_images_from_folder,
+    move_image_to_label_folder, move_to_reserved
+)
+from utils.folder_index import FolderIndex
+from utils.image_hashing import MAX_DUPLICATE_DISTANCE, MAX_GROUP_HASHES, group_near_duplicates
+from utils.journal import MoveJournal
+from utils.manifest import effective_labels, read_manifest
+from utils.memory import MemoryBudget
+from utils.metadata import read_image_metadata
+from utils.suggestions import LabelSuggester
+from utils.thumbnails import ThumbnailCache
+from utils.tiles import render_level
+from utils.watcher import FolderWatcher
+
+BACKEND_DIR = Path(__file__).parent
+
+
+@pytest.fixture(autouse=True)
+def app_data_dir(tmp_path, monkeypatch):
+    """Isolate persistent caches in a per-test data directory."""
+    data_dir = tmp_path / "app-data"
+    monkeypatch.setenv("IMAGE_SORTER_DATA_DIR", str(data_dir))
+    return data_dir
 
 
 @pytest.fixture
@@ -92,6 +131,232 @@ class TestGetImages:
         assert "指定されたパスはフォルダではありません" in response.json()["detail"]
 
 
+class TestFolderIndex:
+    """Test the persistent folder index."""
+    
+    def test_index_tracks_added_and_removed_files(self, tmp_path):
+        """Test incremental rescans pick up changes."""
+        index = FolderIndex(tmp_path / "index.sqlite3")
+        folder = tmp_path / "images"
+        folder.mkdir()
+        for i in range(3):
+            (folder / f"a_{i}.jpg").write_bytes(b"x" * i)
+        
+        assert [e.filename for e in index.list_entries(folder)] == ["a_0.jpg", "a_1.jpg", "a_2.jpg"]
+        
+        (folder / "a_0.jpg").unlink()
+        (folder / "b.png").touch()
+        entries = index.list_entries(folder)
+        assert [e.filename for e in entries] == ["a_1.jpg", "a_2.jpg", "b.png"]
+        assert entries[1].size == 2
+
+    def test_overwrite_in_place_refreshes_entry(self, tmp_path):
+        """Test that a file rewritten under the same inode is re-stat'ed."""
+        index = FolderIndex(tmp_path / "index.sqlite3")
+        folder = tmp_path / "images"
+        folder.mkdir()
+        (folder / "a.jpg").write_bytes(b"x")
+        [before] = index.list_entries(folder)
+        index.store_hashes(folder, [("a.jpg", "ff00ff00ff00ff00")])
+        index.store_metadata(folder, [("a.jpg", 10, 20, "2020-01-01T00:00:00")])
+
+        old = time.time() - 3600
+        os.utime(folder, (old, old))
+        index.list_entries(folder)
+
+        # 同じinodeのまま内容を書き換える（フォルダの更新時刻は変わらない）
+        (folder / "a.jpg").write_bytes(b"y" * 100)
+        os.utime(folder, (old, old))
+
+        [after] = index.list_entries(folder)
+        assert index.hits == 1
+        assert after.inode == before.inode
+        assert after.size == 100
+        assert after.dhash is None
+        assert (after.width, after.height, after.taken_at) == (None, None, None)
+
+    def test_unchanged_folder_is_served_from_index(self, tmp_path):
+        """Test that a folder with an old, unchanged mtime is not rescanned."""
+        index = FolderIndex(tmp_path / "index.sqlite3")
+        folder = tmp_path / "images"
+        folder.mkdir()
+        (folder / "a.jpg").touch()
+        old = time.time() - 3600
+        os.utime(folder, (old, old))
+        index.list_entries(folder)
+        
+        # 更新時刻を戻して「変化なし」のフォルダを再現する
+        (folder / "b.jpg").touch()
+        os.utime(folder, (old, old))
+        
+        assert [e.filename for e in index.list_entries(folder)] == ["a.jpg"]
+        assert index.hits == 1
+    
+    def test_index_persists_across_instances(self, tmp_path):
+        """Test that a new index instance reuses the stored listing."""
+        folder = tmp_path / "images"
+        folder.mkdir()
+        (folder / "a.jpg").touch()
+        old = time.time() - 3600
+        os.utime(folder, (old, old))
+        FolderIndex(tmp_path / "index.sqlite3").list_entries(folder)
+        
+        index = FolderIndex(tmp_path / "index.sqlite3")
+        assert [e.filename for e in index.list_entries(folder)] == ["a.jpg"]
+        assert index.rescans == 0
+
+
+class TestFolderWatcher:
+    """Test folder change detection."""
+    
+    def test_detects_add_rename_and_remove(self, tmp_path):
+        """Test that deltas are reported for each kind of change."""
+        (tmp_path / "a.jpg").write_bytes(b"a")
+        watcher = FolderWatcher([tmp_path])
+        try:
+            (tmp_path / "b.jpg").write_bytes(b"bb")
+            assert watcher.poll() == [{"type": "added", "folder": str(tmp_path), "filename": "b.jpg"}]
+            
+            (tmp_path / "b.jpg").rename(tmp_path / "c.jpg")
+            assert watcher.poll() == [{
+                "type": "renamed", "folder": str(tmp_path), "filename": "c.jpg", "old_filename": "b.jpg"
+            }]
+            
+            (tmp_path / "a.jpg").unlink()
+            assert watcher.poll() == [{"type": "removed", "folder": str(tmp_path), "filename": "a.jpg"}]
+            assert watcher.poll() == []
+        finally:
+            watcher.close()
+    
+    def test_discovers_new_label_folders(self, tmp_path):
+        """Test that label folders created under the target are watched."""
+        watcher = FolderWatcher([], target_folder=tmp_path)
+        try:
+            (tmp_path / "class1").mkdir()
+            (tmp_path / "class1" / "x.png").touch()
+            assert watcher.poll() == [
+                {"type": "added", "folder": str(tmp_path / "class1"), "filename": "x.png"}
+            ]
+        finally:
+            watcher.close()
+    
+    def test_watch_nonexistent_folder(self, client):
+        """Test error when a watched folder doesn't exist."""
+        response = client.get("/watch", params={"folder_path": "/nonexistent/folder"})
+        
+        assert response.status_code == 404
+
+
+class TestGetImagesPaginated:
+    """Test paginated and streaming folder listing."""
+    
+    @pytest.fixture
+    def many_images_folder(self, tmp_path):
+        """Create a folder with 25 empty image files and one text file."""
+        for i in range(25):
+            (tmp_path / f"img_{i:03d}.png").touch()
+        (tmp_path / "notes.txt").touch()
+        return tmp_path
+    
+    def test_offset_pages_cover_folder(self, client, many_images_folder):
+        """Test that offset pages return every image exactly once."""
+        seen = []
+        offset = 0
+        while offset is not None:
+            response = client.post("/get-images/page", json={
+                "folder_path": str(many_images_folder), "offset": offset, "limit": 10
+            })
+            assert response.status_code == 200
+            page = response.json()
+            seen.extend(image["filename"] for image in page["images"])
+            offset = page["next_offset"]
+        
+        assert sorted(seen) == [f"img_{i:03d}.png" for i in range(25)]
+    
+    def test_cursor_pages_are_sorted(self, client, many_images_folder):
+        """Test that cursor pages are ordered by filename."""
+        response = client.post("/get-images/page", json={
+            "folder_path": str(many_images_folder), "limit": 10, "cursor": "img_009.png"
+        })
+        
+        page = response.json()
+        assert [image["filename"] for image in page["images"]] == [
+            f"img_{i:03d}.png" for i in range(10, 20)
+        ]
+        assert page["next_cursor"] == "img_019.png"
+    
+    def test_stream_ndjson(self, client, many_images_folder):
+        """Test NDJSON streaming of the folder listing."""
+        response = client.post("/get-images/stream", json={"folder_path": str(many_images_folder)})
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        records = [json.loads(line) for line in response.text.splitlines()]
+        assert len(records) == 25
+        assert all(record["filename"].endswith(".png") for record in records)
+    
+    def test_stream_nonexistent_folder(self, client):
+        """Test error before streaming starts when folder doesn't exist."""
+        response = client.post("/get-images/stream", json={"folder_path": "/nonexistent/folder"})
+        
+        assert response.status_code == 404
+
+
+class TestColumnarListing:
+    """Test the compact listing format and label-table classification."""
+    
+    def test_columnar_listing_matches_objects(self, client, temp_image_folder):
+        """Test that folder plus file names reproduce the object listing."""
+        objects = client.post("/get-images", json={"folder_path": str(temp_image_folder)}).json()
+        response = client.post("/get-images", json={
+            "folder_path": str(temp_image_folder), "response_format": "columnar"
+        })
+        
+        assert response.status_code == 200
+        listing = response.json()
+        assert listing["columns"] == {}
+        assert [os.path.join(listing["folder"], name) for name in listing["filenames"]] == [
+            image["path"] for image in objects
+        ]
+    
+    def test_columnar_listing_with_metadata_columns(self, client, temp_image_folder):
+        """Test that sorted listings carry only the fields that have values."""
+        (temp_image_folder / "test_1.jpg").write_bytes(b"x" * 10)
+        response = client.post("/get-images", json={
+            "folder_path": str(temp_image_folder), "response_format": "columnar",
+            "sort_by": "size", "descending": True, "include_metadata": True,
+        })
+        
+        listing = response.json()
+        assert listing["filenames"][0] == "test_1.jpg"
+        assert listing["columns"]["size"] == [10, 0, 0]
+        assert "width" not in listing["columns"]
+        assert "subpath" not in listing["columns"]
+    
+    def test_classify_with_label_indices(self, client, temp_image_folder, temp_target_folder):
+        """Test that label indices into a label table classify like label names."""
+        paths = [str(temp_image_folder / f"test_{i}.jpg") for i in range(3)]
+        response = client.post("/classify", json={
+            "image_paths": paths, "label_table": ["cat", "dog"], "label_indices": [1, 0, 1],
+            "target_folder": str(temp_target_folder),
+        })
+        
+        assert response.status_code == 200
+        assert sorted(p.name for p in (temp_target_folder / "dog").iterdir()) == ["test_0.jpg", "test_2.jpg"]
+        assert [p.name for p in (temp_target_folder / "cat").iterdir()] == ["test_1.jpg"]
+    
+    def test_classify_rejects_index_outside_table(self, client, temp_image_folder, temp_target_folder):
+        """Test that an index outside the label table is rejected before moving."""
+        response = client.post("/classify", json={
+            "image_paths": [str(temp_image_folder / "test_0.jpg")],
+            "label_table": ["cat"], "label_indices": [1],
+            "target_folder": str(temp_target_folder),
+        })
+        
+        assert response.status_code == 400
+        assert (temp_image_folder / "test_0.jpg").exists()
+
+
 class TestClassifyImages:
     """Test classify images endpoint."""
     
@@ -149,6 +414,110 @@ class TestClassifyImages:
         
         assert response.status_code == 404
         assert "対象フォルダが存在しません" in response.json()["detail"]
+    
+    def test_classify_reports_per_file_errors(self, client, temp_image_folder, temp_target_folder):
+        """Test that one missing file doesn't fail the whole batch."""
+        request = ClassifyRequest(
+            image_paths=[str(temp_image_folder / "test_0.jpg"), str(temp_image_folder / "missing.jpg")],
+            labels=["class1", "class1"],
+            target_folder=str(temp_target_folder)
+        )
+        
+        response = client.post("/classify", json=request.model_dump())
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["moved_files"]) == 1
+        assert data["errors"] == [{
+            "source": str(temp_image_folder / "missing.jpg"),
+            "label": "class1",
+            "detail": "ファイルが存在しません"
+        }]
+    
+    def test_classify_same_names_in_one_batch(self, client, tmp_path, temp_target_folder):
+        """Test that same-named files moved in parallel get distinct names."""
+        image_paths = []
+        for i in range(20):
+            camera = tmp_path / f"camera_{i}"
+            camera.mkdir()
+            (camera / "scan.jpg").write_bytes(str(i).encode())
+            image_paths.append(str(camera / "scan.jpg"))
+        
+        request = ClassifyRequest(
+            image_paths=image_paths,
+            labels=["class1"] * 20,
+            target_folder=str(temp_target_folder)
+        )
+        response = client.post("/classify", json=request.model_dump())
+        
+        assert response.status_code == 200
+        destinations = {Path(moved["destination"]).name for moved in response.json()["moved_files"]}
+        assert len(destinations) == 20
+        assert "scan.jpg" in destinations and "scan_19.jpg" in destinations
+        assert len(list((temp_target_folder / "class1").iterdir())) == 20
+
+
+class TestClassifyJobs:
+    """Test background classification jobs."""
+    
+    def wait_for_job(self, client, job_id):
+        deadline = time.monotonic() + 10
+        while True:
+            status = client.get(f"/classify/jobs/{job_id}").json()
+            if status["status"] not in ("queued", "running"):
+                return status
+            assert time.monotonic() < deadline
+            time.sleep(0.02)
+    
+    def test_job_runs_to_completion(self, client, temp_image_folder, temp_target_folder):
+        """Test that a job moves files and reports progress counters."""
+        (temp_image_folder / "test_0.jpg").write_bytes(b"12345")
+        request = ClassifyRequest(
+            image_paths=[str(temp_image_folder / f"test_{i}.jpg") for i in range(3)],
+            labels=["class1", "class2", "class1"],
+            target_folder=str(temp_target_folder)
+        )
+        
+        response = client.post("/classify/jobs", json=request.model_dump())
+        assert response.status_code == 200
+        status = self.wait_for_job(client, response.json()["job_id"])
+        
+        assert status["status"] == "completed"
+        assert status["done"] == 3
+        assert status["bytes_moved"] == 5
+        assert len(status["moved_files"]) == 3
+        assert status["eta_seconds"] == 0.0
+    
+    def test_job_events_end_with_finished(self, client, temp_image_folder, temp_target_folder):
+        """Test that the event stream closes with a finished event."""
+        request = ClassifyRequest(
+            image_paths=[str(temp_image_folder / "test_0.jpg")],
+            labels=["class1"],
+            target_folder=str(temp_target_folder)
+        )
+        job_id = client.post("/classify/jobs", json=request.model_dump()).json()["job_id"]
+        self.wait_for_job(client, job_id)
+        
+        response = client.get(f"/classify/jobs/{job_id}/events")
+        assert response.text.startswith("event: finished")
+    
+    def test_cancelled_batch_moves_nothing(self, temp_image_folder, temp_target_folder):
+        """Test that a set cancel event stops unstarted moves."""
+        cancel_event = threading.Event()
+        cancel_event.set()
+        
+        moved, errors, _ = classify_batch(
+            [str(temp_image_folder / "test_0.jpg")], ["class1"], str(temp_target_folder),
+            cancel_event=cancel_event
+        )
+        
+        assert moved == [] and errors == []
+        assert (temp_image_folder / "test_0.jpg").exists()
+    
+    def test_unknown_job(self, client):
+        """Test error when the job doesn't exist."""
+        assert client.get("/classify/jobs/unknown").status_code == 404
+        assert client.delete("/classify/jobs/unknown").status_code == 404
 
 
 class TestUndoClassification:
@@ -199,6 +568,978 @@ class TestUndoClassification:
         data = response.json()
         assert data["success"] is True
         assert len(data["restored_files"]) == 0  # No files were restored
+    
+    def test_undo_does_not_overwrite_new_file(self, client, temp_image_folder, temp_target_folder):
+        """Test that undo refuses to replace a file created at the original path."""
+        moved = client.post("/classify", json={
+            "image_paths": [str(temp_image_folder / "test_0.jpg")],
+            "labels": ["class1"],
+            "target_folder": str(temp_target_folder),
+        }).json()["moved_files"]
+        (temp_image_folder / "test_0.jpg").write_bytes(b"newer")
+        
+        response = client.post("/undo", json={"moved_files": moved})
+        
+        data = response.json()
+        assert data["restored_files"] == []
+        assert data["errors"][0]["destination"] == moved[0]["source"]
+        assert (temp_image_folder / "test_0.jpg").read_bytes() == b"newer"
+        assert Path(moved[0]["destination"]).exists()
+
+
+class TestThumbnail:
+    """Test thumbnail endpoint and cache."""
+    
+    @pytest.fixture
+    def real_image(self, tmp_path):
+        """Create a real JPEG larger than the thumbnail size."""
+        image_path = tmp_path / "photo.jpg"
+        Image.new("RGB", (800, 600), (200, 30, 30)).save(image_path)
+        return image_path
+    
+    def test_thumbnail_is_resized(self, client, real_image):
+        """Test that the thumbnail fits in the requested size."""
+        response = client.get("/thumbnail", params={"path": str(real_image), "thumbnail_size": 100})
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/jpeg"
+        with Image.open(io.BytesIO(response.content)) as thumb:
+            assert max(thumb.size) == 100
+    
+    def test_thumbnail_cache_survives_restart(self, real_image, app_data_dir):
+        """Test that a second app instance serves the thumbnail from disk."""
+        first = TestClient(create_app())
+        assert first.get("/thumbnail", params={"path": str(real_image)}).status_code == 200
+        
+        second_app = create_app()
+        second = TestClient(second_app)
+        assert second.get("/thumbnail", params={"path": str(real_image)}).status_code == 200
+        assert second_app.state.thumbnail_cache.hits == 1
+        assert second_app.state.thumbnail_cache.misses == 0
+    
+    def test_thumbnail_cache_evicts_least_recently_used(self, tmp_path):
+        """Test LRU eviction when the byte cap is exceeded."""
+        cache = ThumbnailCache(tmp_path / "cache", max_bytes=10)
+        paths = []
+        for i in range(3):
+            cached = tmp_path / "cache" / "ab" / f"ab{i}.jpg"
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            cached.write_bytes(b"x" * 4)
+            cache.register(cached, 4)
+            paths.append(cached)
+        
+        assert not paths[0].exists()
+        assert paths[1].exists() and paths[2].exists()
+        assert cache.total_bytes == 8
+    
+    def test_thumbnail_nonexistent_image(self, client):
+        """Test error when the image doesn't exist."""
+        response = client.get("/thumbnail", params={"path": "/nonexistent/image.jpg"})
+        
+        assert response.status_code == 404
+
+
+class TestImageServing:
+    """Test serving of original images."""
+    
+    @pytest.fixture
+    def original(self, tmp_path):
+        """Create a real PNG."""
+        image_path = tmp_path / "original.png"
+        Image.new("RGB", (64, 64), (0, 120, 200)).save(image_path)
+        return image_path
+    
+    def test_image_served_with_cache_headers(self, client, original):
+        """Test that the full image is returned with ETag and Cache-Control."""
+        response = client.get("/image", params={"path": str(original)})
+        
+        assert response.status_code == 200
+        assert response.content == original.read_bytes()
+        assert response.headers["content-type"] == "image/png"
+        assert response.headers["etag"]
+        assert "max-age" in response.headers["cache-control"]
+    
+    def test_image_if_none_match(self, client, original):
+        """Test that a matching ETag yields 304 without a body."""
+        etag = client.get("/image", params={"path": str(original)}).headers["etag"]
+        
+        response = client.get("/image", params={"path": str(original)}, headers={"If-None-Match": etag})
+        
+        assert response.status_code == 304
+        assert response.content == b""
+    
+    def test_image_range(self, client, original):
+        """Test that a byte range is served as partial content."""
+        response = client.get("/image", params={"path": str(original)}, headers={"Range": "bytes=0-7"})
+        
+        assert response.status_code == 206
+        assert response.content == original.read_bytes()[:8]
+    
+    def test_image_etag_changes_with_content(self, client, original):
+        """Test that rewriting the file invalidates the ETag."""
+        etag = client.get("/image", params={"path": str(original)}).headers["etag"]
+        Image.new("RGB", (32, 32)).save(original)
+        os.utime(original, ns=(time.time_ns(), time.time_ns() + 5_000_000_000))
+        
+        response = client.get("/image", params={"path": str(original)}, headers={"If-None-Match": etag})
+        
+        assert response.status_code == 200
+
+
+class TestTilePyramid:
+    """Test DeepZoom tile pyramid endpoints."""
+    
+    @pytest.fixture
+    def scan(self, tmp_path):
+        """Create a JPEG spanning several tiles."""
+        image_path = tmp_path / "scan.jpg"
+        Image.effect_mandelbrot((1000, 600), (-2.0, -1.2, 1.0, 1.2), 50).convert("RGB").save(image_path)
+        return image_path
+    
+    def test_tile_info(self, client, scan):
+        """Test the pyramid geometry."""
+        response = client.get("/tiles/info", params={"path": str(scan)})
+        
+        assert response.status_code == 200
+        info = response.json()
+        assert (info["width"], info["height"], info["max_level"]) == (1000, 600, 10)
+    
+    def test_tiles_have_expected_size(self, client, scan):
+        """Test interior, edge and lowest-level tiles."""
+        tile_size = client.get("/tiles/info", params={"path": str(scan)}).json()["tile_size"]
+        
+        first = client.get("/tiles/10/0/0", params={"path": str(scan)})
+        interior = client.get("/tiles/10/1/1", params={"path": str(scan)})
+        last = client.get("/tiles/10/3/2", params={"path": str(scan)})
+        smallest = client.get("/tiles/0/0/0", params={"path": str(scan)})
+        
+        with Image.open(io.BytesIO(first.content)) as tile:
+            assert tile.size == (tile_size + 1, tile_size + 1)
+        with Image.open(io.BytesIO(interior.content)) as tile:
+            assert tile.size == (tile_size + 2, tile_size + 2)
+        with Image.open(io.BytesIO(last.content)) as tile:
+            assert tile.size == (1000 - 3 * tile_size + 1, 600 - 2 * tile_size + 1)
+        with Image.open(io.BytesIO(smallest.content)) as tile:
+            assert tile.size == (1, 1)
+    
+    def test_level_rendered_once(self, scan):
+        """Test that the requested tile returns first and the rest of its level follows."""
+        app = create_app()
+        with TestClient(app) as client:
+            renderer = app.state.tile_renderer
+            release = threading.Event()
+            write_level = renderer._write_level
+            
+            def blocked_write_level(*args):
+                release.wait()
+                write_level(*args)
+            
+            with patch.object(renderer, "_write_level", side_effect=blocked_write_level), \
+                    patch("utils.tiles.render_level", wraps=render_level) as decode:
+                assert client.get("/tiles/9/0/0", params={"path": str(scan)}).status_code == 200
+                assert renderer.cache.memory_entries() == 1
+                # 残りを書き出す前でも、隣のタイルはデコード済みのレベルから切り出す
+                assert client.get("/tiles/9/1/0", params={"path": str(scan)}).status_code == 200
+                release.set()
+                renderer.wait()
+            client.get("/tiles/9/1/1", params={"path": str(scan)})
+        
+        assert decode.call_count == 1
+        # レベル9は500x300で2x2タイル
+        assert renderer.cache.memory_entries() == 4
+        assert (renderer.cache.hits, renderer.cache.misses) == (1, 2)
+    
+    def test_header_read_once_per_image_version(self, client, scan):
+        """Test that tiles reuse the pyramid geometry until the image changes."""
+        with patch("utils.tiles.read_image_metadata", wraps=read_image_metadata) as reader:
+            for col in range(3):
+                client.get(f"/tiles/10/{col}/0", params={"path": str(scan)})
+            assert reader.call_count == 1
+
+            Image.new("RGB", (300, 200)).save(scan)
+            info = client.get("/tiles/info", params={"path": str(scan)}).json()
+
+        assert reader.call_count == 2
+        assert (info["width"], info["height"]) == (300, 200)
+
+    def test_info_for_image_above_pillow_bomb_limit(self, client, tmp_path):
+        """Test that a 210-megapixel scan is not rejected as a decompression bomb."""
+        image_path = tmp_path / "huge.png"
+        # 1ビット画像ならメモリを使わずに約1.79億画素の既定上限を超えられる
+        Image.new("1", (15000, 14000)).save(image_path)
+        
+        response = client.get("/tiles/info", params={"path": str(image_path)})
+        
+        assert response.status_code == 200
+        assert (response.json()["width"], response.json()["height"]) == (15000, 14000)
+        assert read_image_metadata(str(image_path))[:2] == (15000, 14000)
+    
+    def test_tile_out_of_range(self, client, scan):
+        """Test 404 for tiles outside the pyramid."""
+        response = client.get("/tiles/10/9/9", params={"path": str(scan)})
+        
+        assert response.status_code == 404
+
+
+class TestThumbnailPrefetch:
+    """Test background thumbnail pre-generation."""
+    
+    def test_prefetch_fills_cache(self, tmp_path):
+        """Test that prefetched thumbnails end up in the cache."""
+        for i in range(3):
+            Image.new("RGB", (400, 300), (i * 50, 0, 0)).save(tmp_path / f"img_{i}.jpg")
+        
+        app = create_app()
+        with TestClient(app) as client:
+            response = client.post("/thumbnail/prefetch", json={
+                "folder_path": str(tmp_path),
+                "count": 3,
+                "thumbnail_size": 64,
+            })
+            assert response.status_code == 200
+            assert response.json()["queued"] == 3
+            
+            deadline = time.monotonic() + 30
+            while app.state.prefetcher.status()["completed"] < 3:
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+            
+            response = client.get("/thumbnail", params={
+                "path": str(tmp_path / "img_0.jpg"), "thumbnail_size": 64
+            })
+            assert response.status_code == 200
+            assert app.state.thumbnail_cache.hits == 1
+    
+    def test_prefetch_cancel(self, client):
+        """Test that cancelling with nothing queued is a no-op."""
+        response = client.delete("/thumbnail/prefetch")
+        
+        assert response.status_code == 200
+        assert response.json() == {"cancelled": 0}
+    
+    def test_prefetch_rejects_invalid_options(self, client, temp_image_folder):
+        """Test that thumbnail size and format are validated like GET /thumbnail."""
+        for options in ({"thumbnail_size": 100_000}, {"thumbnail_size": 0}, {"format": "gif"}):
+            response = client.post("/thumbnail/prefetch", json={
+                "folder_path": str(temp_image_folder), "count": 1, **options
+            })
+            
+            assert response.status_code == 422
+
+
+class TestRecursiveDataset:
+    """Test recursive listing of nested folders."""
+    
+    @pytest.fixture
+    def dataset_root(self, tmp_path):
+        """Create a nested tree of capture sessions."""
+        root = tmp_path / "dataset"
+        for relative in ["top.jpg", "s1/a.jpg", "s1/raw/b.png", "s2/c.jpg", "cache/d.jpg", "s2/notes.txt"]:
+            (root / relative).parent.mkdir(parents=True, exist_ok=True)
+            (root / relative).touch()
+        return root
+    
+    def test_recursive_listing_records_subpath(self, client, dataset_root):
+        """Test that every nested image is listed with its relative folder."""
+        response = client.post("/get-images", json={
+            "folder_path": str(dataset_root), "recursive": True, "exclude": ["cache"]
+        })
+        
+        assert response.status_code == 200
+        assert [(image["subpath"], image["filename"]) for image in response.json()] == [
+            ("", "top.jpg"), ("s1", "a.jpg"), ("s1/raw", "b.png"), ("s2", "c.jpg")
+        ]
+    
+    def test_recursive_stream_with_include(self, client, dataset_root):
+        """Test NDJSON streaming of a tree filtered by an include glob."""
+        response = client.post("/get-images/stream", json={
+            "folder_path": str(dataset_root), "recursive": True, "include": ["s1/*"]
+        })
+        
+        assert response.status_code == 200
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert sorted(line["filename"] for line in lines) == ["a.jpg", "b.png"]
+    
+    def test_classify_preserves_subpaths(self, client, dataset_root, temp_target_folder):
+        """Test that the directory structure is kept under the label folder."""
+        response = client.post("/classify", json={
+            "image_paths": [str(dataset_root / "s1/raw/b.png"), str(dataset_root / "top.jpg")],
+            "labels": ["cat", "cat"],
+            "target_folder": str(temp_target_folder),
+            "subpaths": ["s1/raw", ""],
+        })
+        
+        assert response.status_code == 200
+        assert (temp_target_folder / "cat" / "s1" / "raw" / "b.png").exists()
+        assert (temp_target_folder / "cat" / "top.jpg").exists()
+    
+    def test_classify_rejects_escaping_subpath(self, client, dataset_root, temp_target_folder):
+        """Test that a subpath cannot point outside the label folder."""
+        response = client.post("/classify", json={
+            "image_paths": [str(dataset_root / "top.jpg")],
+            "labels": ["cat"],
+            "target_folder": str(temp_target_folder),
+            "subpaths": ["../../elsewhere"],
+        })
+        
+        assert response.status_code == 400
+        assert (dataset_root / "top.jpg").exists()
+
+
+class TestImageMetadata:
+    """Test metadata fields, sorting and filtering of listings."""
+    
+    @pytest.fixture
+    def sized_folder(self, tmp_path):
+        """Create images of different sizes, one with an EXIF capture date."""
+        exif = Image.Exif()
+        exif.get_ifd(0x8769)[0x9003] = "2021:06:15 10:30:00"
+        Image.new("RGB", (400, 100)).save(tmp_path / "wide.jpg", exif=exif)
+        Image.new("RGB", (50, 50)).save(tmp_path / "tiny.png")
+        Image.new("RGB", (200, 300)).save(tmp_path / "tall.jpg")
+        return tmp_path
+    
+    def test_include_metadata(self, client, sized_folder):
+        """Test that header metadata is returned as optional fields."""
+        response = client.post("/get-images", json={
+            "folder_path": str(sized_folder), "include_metadata": True
+        })
+        
+        assert response.status_code == 200
+        images = {image["filename"]: image for image in response.json()}
+        assert images["wide.jpg"]["width"] == 400
+        assert images["wide.jpg"]["aspect_ratio"] == 4.0
+        assert images["wide.jpg"]["taken_at"] == "2021-06-15T10:30:00"
+        assert "taken_at" not in images["tiny.png"]
+        assert images["tall.jpg"]["size"] == (sized_folder / "tall.jpg").stat().st_size
+    
+    def test_sort_by_pixels(self, client, sized_folder):
+        """Test that tiny images can be put first."""
+        response = client.post("/get-images", json={
+            "folder_path": str(sized_folder), "sort_by": "pixels"
+        })
+        
+        assert [image["filename"] for image in response.json()] == ["tiny.png", "wide.jpg", "tall.jpg"]
+    
+    def test_filter_by_dimensions(self, client, sized_folder):
+        """Test width and aspect ratio filters."""
+        response = client.post("/get-images", json={
+            "folder_path": str(sized_folder), "min_width": 100, "max_aspect_ratio": 1.0
+        })
+        
+        assert [image["filename"] for image in response.json()] == ["tall.jpg"]
+    
+    def test_metadata_is_cached_in_index(self, sized_folder, app_data_dir):
+        """Test that metadata survives a restart through the folder index."""
+        with TestClient(create_app()) as first:
+            first.post("/get-images", json={"folder_path": str(sized_folder), "sort_by": "width"})
+        
+        index = FolderIndex(app_data_dir / "folder_index.sqlite3")
+        try:
+            entries = {entry.filename: entry for entry in index.list_entries(sized_folder)}
+        finally:
+            index.close()
+        assert (entries["tall.jpg"].width, entries["tall.jpg"].height) == (200, 300)
+
+    def test_overwritten_image_metadata_is_refreshed(self, client, sized_folder):
+        """Test that editing an image in place invalidates its cached metadata."""
+        request = {"folder_path": str(sized_folder), "include_metadata": True}
+        old = time.time() - 3600
+        os.utime(sized_folder, (old, old))
+        client.post("/get-images", json=request)
+        inode = (sized_folder / "wide.jpg").stat().st_ino
+
+        # 同じファイルに別の画像を書き込む（inodeもフォルダの更新時刻も変わらない）
+        Image.new("RGB", (120, 80)).save(sized_folder / "wide.jpg")
+        assert sized_folder.stat().st_mtime == old
+
+        images = {image["filename"]: image for image in client.post("/get-images", json=request).json()}
+        assert (sized_folder / "wide.jpg").stat().st_ino == inode
+        assert (images["wide.jpg"]["width"], images["wide.jpg"]["height"]) == (120, 80)
+        assert images["wide.jpg"]["size"] == (sized_folder / "wide.jpg").stat().st_size
+        assert "taken_at" not in images["wide.jpg"]
+
+
+class TestNearDuplicates:
+    """Test perceptual-hash grouping of near-duplicate images."""
+    
+    @pytest.fixture
+    def duplicate_folder(self, tmp_path):
+        """Create two near-identical images and one unrelated image."""
+        fractal = Image.effect_mandelbrot((320, 240), (-2.0, -1.2, 1.0, 1.2), 100).convert("RGB")
+        fractal.save(tmp_path / "a.jpg", quality=95)
+        fractal.resize((160, 120)).save(tmp_path / "b.jpg", quality=60)
+        fractal.transpose(Image.Transpose.FLIP_LEFT_RIGHT).save(tmp_path / "c.jpg")
+        return tmp_path
+    
+    def test_group_duplicates(self, client, duplicate_folder):
+        """Test that resized copies share a cluster and others do not."""
+        response = client.post("/get-images", json={
+            "folder_path": str(duplicate_folder), "group_duplicates": True
+        })
+        
+        assert response.status_code == 200
+        clusters = {image["filename"]: image for image in response.json()}
+        assert clusters["a.jpg"]["cluster_id"] == clusters["b.jpg"]["cluster_id"]
+        assert clusters["a.jpg"]["cluster_size"] == 2
+        assert clusters["c.jpg"]["cluster_size"] == 1
+    
+    def test_representatives_only(self, client, duplicate_folder):
+        """Test that only one image per cluster is returned."""
+        response = client.post("/get-images", json={
+            "folder_path": str(duplicate_folder),
+            "group_duplicates": True,
+            "representatives_only": True,
+        })
+        
+        assert [image["filename"] for image in response.json()] == ["a.jpg", "c.jpg"]
+    
+    def test_ungrouped_listing_omits_cluster_fields(self, client, duplicate_folder):
+        """Test that plain listings keep the original response shape."""
+        response = client.post("/get-images", json={"folder_path": str(duplicate_folder)})
+        
+        assert set(response.json()[0]) == {"path", "filename"}
+    
+    def test_classify_applies_label_to_duplicates(self, client, duplicate_folder, temp_target_folder):
+        """Test that labelling one image moves its near-duplicates too."""
+        response = client.post("/classify", json={
+            "image_paths": [str(duplicate_folder / "a.jpg")],
+            "labels": ["gradient"],
+            "target_folder": str(temp_target_folder),
+            "apply_to_duplicates": True,
+        })
+        
+        assert response.status_code == 200
+        assert len(response.json()["moved_files"]) == 2
+        assert sorted(os.listdir(temp_target_folder / "gradient")) == ["a.jpg", "b.jpg"]
+        assert (duplicate_folder / "c.jpg").exists()
+    
+    def test_distance_limited_to_selective_blocks(self, client, duplicate_folder):
+        """Test that distances beyond the multi-index limit are rejected."""
+        response = client.post("/get-images", json={
+            "folder_path": str(duplicate_folder), "group_duplicates": True, "duplicate_distance": 9
+        })
+        
+        assert response.status_code == 422
+        with pytest.raises(ValueError):
+            group_near_duplicates([0, 1], MAX_DUPLICATE_DISTANCE + 1)
+    
+    def test_groups_do_not_chain(self):
+        """Test that A~B and B~C do not put A and C in one group when they are far apart."""
+        a = 0
+        b = (1 << 4) - 1
+        c = (1 << 8) - 1
+        
+        groups = group_near_duplicates([a, b, c, None, a], 4)
+        
+        assert groups == [0, 0, 2, 3, 0]
+        # 先に来た B のグループには A だけが入り、C は別のグループになる
+        assert group_near_duplicates([b, a, c], 4) == [0, 0, 2]
+    
+    def test_burst_groups_are_capped(self):
+        """Test that a large cluster of near-identical hashes is split into capped groups."""
+        # 下位16ビットのうち2ビット以下が立ったハッシュは、互いの距離がすべて4以下
+        hashes = [value for value in range(1 << 16) if value.bit_count() <= 2]
+        
+        groups = group_near_duplicates(hashes, 4)
+        
+        sizes = {}
+        for group in groups:
+            sizes[group] = sizes.get(group, 0) + 1
+        assert len(hashes) > 2 * MAX_GROUP_HASHES
+        assert max(sizes.values()) == MAX_GROUP_HASHES
+        assert sum(sizes.values()) == len(hashes)
+
+
+class TestLabelSuggestions:
+    """Test the incrementally trained label suggestion model."""
+    
+    @pytest.fixture
+    def gradient_folder(self, tmp_path):
+        """Create left-to-right brightening ("light") and darkening ("dark") gradients."""
+        folder = tmp_path / "unsorted"
+        folder.mkdir()
+        for i in range(14):
+            base = Image.linear_gradient("L").rotate(90 if i % 2 else -90).resize((96, 64))
+            noisy = Image.blend(base, Image.effect_noise((96, 64), 20 + i), 0.1)
+            noisy.convert("RGB").save(folder / f"{i:02d}.jpg")
+        return folder
+    
+    def test_predict_from_learned_hashes(self, tmp_path):
+        """Test that predictions need enough examples and survive a restart."""
+        model_path = tmp_path / "suggestions.json"
+        index = FolderIndex(tmp_path / "index.sqlite3")
+        suggester = LabelSuggester(model_path, index)
+        low, high = 0x00000000000000FF, 0xFFFFFFFFFFFFFF00
+        
+        suggester.learn([low, high], ["dark", "light"])
+        assert suggester.predict([low]) == [None]
+        
+        suggester.learn([low ^ (1 << i) for i in range(5)] + [high ^ (1 << (63 - i)) for i in range(5)],
+                        ["dark"] * 5 + ["light"] * 5)
+        suggester.shutdown()
+        
+        restarted = LabelSuggester(model_path, index)
+        dark, light, unknown = restarted.predict([low | 0x100, high, None])
+        assert dark.label == "dark" and dark.confidence > 0.99
+        assert light.label == "light"
+        assert unknown is None
+        assert restarted.predict([high], candidates=["dark"]) == [None]
+        restarted.shutdown()
+        index.close()
+    
+    def test_suggestions_learned_from_classify(self, client, gradient_folder, temp_target_folder):
+        """Test that classified images train the model used by /suggestions and /get-images."""
+        paths = [str(gradient_folder / f"{i:02d}.jpg") for i in range(14)]
+        # 一覧でハッシュを計算しておくと、学習時に画像を読み直さない
+        client.post("/get-images", json={"folder_path": str(gradient_folder), "suggest_labels": True})
+        
+        response = client.post("/classify", json={
+            "image_paths": paths[:12],
+            "labels": ["light" if i % 2 else "dark" for i in range(12)],
+            "target_folder": str(temp_target_folder),
+        })
+        assert response.status_code == 200
+        client.app.state.label_suggester.wait()
+        
+        response = client.post("/suggestions", json={"image_paths": paths[12:], "labels": ["dark", "light"]})
+        
+        assert response.status_code == 200
+        assert [image["suggested_label"] for image in response.json()] == ["dark", "light"]
+        assert all(image["suggestion_confidence"] > 0.5 for image in response.json())
+        
+        listing = client.post("/get-images", json={"folder_path": str(gradient_folder), "suggest_labels": True})
+        assert [image["suggested_label"] for image in listing.json()] == ["dark", "light"]
+    
+    def test_no_suggestions_before_training(self, client, gradient_folder):
+        """Test that an untrained model leaves the listing fields unset."""
+        response = client.post("/suggestions", json={"image_paths": [str(gradient_folder / "00.jpg")]})
+        
+        assert response.status_code == 200
+        assert response.json() == [{"path": str(gradient_folder / "00.jpg"), "filename": "00.jpg"}]
+
+
+class TestLabelFolderNames:
+    """Test collision resolution for label folders."""
+    
+    def test_reserve_skips_existing_names(self, tmp_path):
+        """Test suffixes continue after names already on disk."""
+        (tmp_path / "scan.jpg").touch()
+        (tmp_path / "scan_1.jpg").touch()
+        names = LabelFolderNames(tmp_path)
+        
+        assert names.reserve("scan.jpg").name == "scan_2.jpg"
+        assert names.reserve("scan.jpg").name == "scan_3.jpg"
+        assert names.reserve("other.jpg").name == "other.jpg"
+        assert (tmp_path / "scan_3.jpg").exists()
+    
+    def test_reserve_detects_files_created_by_others(self, tmp_path):
+        """Test that a name taken after the scan is not overwritten."""
+        names = LabelFolderNames(tmp_path)
+        (tmp_path / "scan.jpg").write_bytes(b"foreign")
+        
+        assert names.reserve("scan.jpg").name == "scan_1.jpg"
+        assert (tmp_path / "scan.jpg").read_bytes() == b"foreign"
+
+    def test_reserve_same_name_is_linear(self, tmp_path):
+        """Test that thousands of same-named files reserve in linear time."""
+        def reserve_all(count):
+            names = LabelFolderNames(tmp_path)
+            started = time.perf_counter()
+            for _ in range(count):
+                dest = names.reserve("scan.jpg")
+            elapsed = time.perf_counter() - started
+            assert dest.name == f"scan_{count - 1}.jpg"
+            return elapsed
+
+        # ディスクへの予約を除き、候補名の選択だけを計測する
+        with patch("utils.classification.create_placeholder", return_value=True):
+            small = reserve_all(2000)
+            large = reserve_all(8000)
+        # 線形なら約4倍、二乗なら約16倍
+        assert large < small * 10 + 0.05
+
+    def test_single_move_and_redo_use_name_index(self, tmp_path):
+        """Test that legacy single moves and journal redo pick a free name with one probe."""
+        label_dir = tmp_path / "target" / "scan"
+        label_dir.mkdir(parents=True)
+        for name in ["scan.jpg"] + [f"scan_{i}.jpg" for i in range(1, 200)]:
+            (label_dir / name).touch()
+        source = tmp_path / "scan.jpg"
+        source.write_bytes(b"x")
+        
+        with patch("utils.classification.create_placeholder", wraps=create_placeholder) as probe:
+            moved = move_image_to_label_folder(str(source), "scan", str(tmp_path / "target"))
+        assert Path(moved["destination"]).name == "scan_200.jpg"
+        assert probe.call_count == 1
+        
+        journal = MoveJournal(tmp_path / "journal.jsonl")
+        batch_id = classify_batch(
+            [moved["destination"]], ["other"], str(tmp_path / "target"), journal=journal
+        ).batch_id
+        journal.undo(batch_id)
+        (label_dir.parent / "other" / "scan_200.jpg").write_bytes(b"taken")
+        with patch("utils.classification.create_placeholder", wraps=create_placeholder) as probe:
+            [redone] = journal.redo(batch_id)
+        journal.close()
+        assert Path(redone["destination"]).name == "scan_200_1.jpg"
+        assert probe.call_count == 1
+    
+    def test_failed_move_removes_placeholder(self, tmp_path):
+        """Test that a reservation is rolled back when the move fails."""
+        names = LabelFolderNames(tmp_path)
+        dest = names.reserve("scan.jpg")
+        
+        with pytest.raises(FileNotFoundError):
+            move_to_reserved(tmp_path / "missing.jpg", dest)
+        assert not dest.exists()
+    
+    def test_undo_releases_name(self, client, temp_image_folder, temp_target_folder):
+        """Test that re-classifying after undo reuses the original name."""
+        request = ClassifyRequest(
+            image_paths=[str(temp_image_folder / "test_0.jpg")],
+            labels=["class1"],
+            target_folder=str(temp_target_folder)
+        )
+        moved = client.post("/classify", json=request.model_dump()).json()["moved_files"]
+        client.post("/undo", json={"moved_files": moved})
+        
+        moved_again = client.post("/classify", json=request.model_dump()).json()["moved_files"]
+        assert moved_again[0]["destination"] == moved[0]["destination"]
+
+
+class TestTransferModes:
+    """Test copy mode, verified cross-device moves and resuming batches."""
+    
+    def test_copy_mode_keeps_originals_and_undo_removes_copies(self, client, temp_image_folder, temp_target_folder):
+        """Test that copy mode leaves the sources and undo deletes only the copies."""
+        (temp_image_folder / "test_0.jpg").write_bytes(b"original")
+        response = client.post("/classify", json={
+            "image_paths": [str(temp_image_folder / f"test_{i}.jpg") for i in range(2)],
+            "labels": ["class1", "class1"], "target_folder": str(temp_target_folder), "mode": "copy",
+        })
+        
+        assert response.status_code == 200
+        assert (temp_image_folder / "test_0.jpg").read_bytes() == b"original"
+        assert (temp_target_folder / "class1" / "test_0.jpg").read_bytes() == b"original"
+        
+        client.post("/undo", json={"batch_id": response.json()["batch_id"]})
+        assert list((temp_target_folder / "class1").iterdir()) == []
+        assert (temp_image_folder / "test_0.jpg").read_bytes() == b"original"
+    
+    def test_cross_device_move_is_verified(self, tmp_path):
+        """Test that a move across devices copies, verifies and then unlinks the source."""
+        source = tmp_path / "a.jpg"
+        source.write_bytes(os.urandom(100_000))
+        content = source.read_bytes()
+        dest = tmp_path / "label" / "a.jpg"
+        dest.parent.mkdir()
+        dest.touch()
+        real_replace = os.replace
+        
+        def replace(src, dst):
+            if Path(src) == source:
+                raise OSError(errno.EXDEV, "cross-device link")
+            real_replace(src, dst)
+        
+        with patch("utils.transfer.os.replace", side_effect=replace):
+            move_to_reserved(source, dest, verify=True)
+        
+        assert not source.exists()
+        assert dest.read_bytes() == content
+        assert os.listdir(dest.parent) == ["a.jpg"]
+    
+    def test_failed_verification_keeps_source(self, tmp_path):
+        """Test that a digest mismatch removes the copy and keeps the original."""
+        source = tmp_path / "a.jpg"
+        source.write_bytes(b"data")
+        dest = tmp_path / "label" / "a.jpg"
+        dest.parent.mkdir()
+        dest.touch()
+        
+        with patch("utils.transfer.file_digest", return_value="mismatch"):
+            with pytest.raises(OSError):
+                move_to_reserved(source, dest, mode="copy", verify=True)
+        
+        assert source.read_bytes() == b"data"
+        assert os.listdir(dest.parent) == []
+    
+    def test_resume_batch_skips_completed_files(self, client, temp_image_folder, temp_target_folder):
+        """Test that resuming a partial batch moves only the remaining files."""
+        paths = [str(temp_image_folder / f"test_{i}.jpg") for i in range(3)]
+        first = client.post("/classify", json={
+            "image_paths": paths[:1], "labels": ["class1"], "target_folder": str(temp_target_folder),
+        }).json()
+        
+        response = client.post("/classify", json={
+            "image_paths": paths, "labels": ["class1"] * 3,
+            "target_folder": str(temp_target_folder), "resume_batch_id": first["batch_id"],
+        })
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["batch_id"] == first["batch_id"]
+        assert data["moved_files"][0] == first["moved_files"][0]
+        assert len(list((temp_target_folder / "class1").iterdir())) == 3
+        summary = client.get("/journal/batches").json()[0]
+        assert (summary["total"], summary["moved"], summary["committed"]) == (3, 3, True)
+
+
+class TestManifestMode:
+    """Test recording labels to a manifest instead of moving files."""
+    
+    def test_manifest_records_labels_without_moving(self, client, temp_image_folder, temp_target_folder):
+        """Test that labels are appended with dimensions known to the index."""
+        Image.new("RGB", (8, 6)).save(temp_image_folder / "test_0.jpg")
+        client.post("/get-images", json={"folder_path": str(temp_image_folder), "include_metadata": True})
+        
+        response = client.post("/classify", json={
+            "image_paths": [str(temp_image_folder / f"test_{i}.jpg") for i in range(2)],
+            "labels": ["cat", "dog"], "target_folder": str(temp_target_folder), "mode": "manifest",
+        })
+        
+        assert response.status_code == 200
+        assert response.json()["recorded"] == 2
+        assert (temp_image_folder / "test_0.jpg").exists()
+        records = [json.loads(line) for line in (temp_target_folder / "labels.jsonl").read_text().splitlines()]
+        assert [(record["label"], record.get("width")) for record in records] == [("cat", 8), ("dog", None)]
+        assert {record["batch"] for record in records} == {response.json()["batch_id"]}
+    
+    def test_tombstones_undo_batches_and_images(self, client, temp_image_folder, temp_target_folder):
+        """Test that batch and image tombstones drop only the matching labels (CSV manifest)."""
+        manifest_path = str(temp_target_folder / "labels.csv")
+        paths = [str(temp_image_folder / f"test_{i}.jpg") for i in range(3)]
+        first = client.post("/classify", json={
+            "image_paths": paths[:2], "labels": ["cat", "cat"], "target_folder": str(temp_target_folder),
+            "mode": "manifest", "manifest_path": manifest_path,
+        }).json()
+        client.post("/classify", json={
+            "image_paths": paths[1:], "labels": ["dog", "dog"], "target_folder": str(temp_target_folder),
+            "mode": "manifest", "manifest_path": manifest_path,
+        })
+        
+        response = client.post("/manifest/undo", json={"manifest_path": manifest_path, "batch_id": first["batch_id"]})
+        assert response.json()["tombstones"] == 1
+        client.post("/manifest/undo", json={"manifest_path": manifest_path, "image_paths": paths[2:]})
+        
+        labels = effective_labels(read_manifest(Path(manifest_path)))
+        assert {Path(path).name: record["label"] for path, record in labels.items()} == {"test_1.jpg": "dog"}
+    
+    def test_materialize_applies_labels_in_bulk(self, client, temp_image_folder, temp_target_folder):
+        """Test that materialising a manifest moves files to their latest labels."""
+        manifest_path = str(temp_image_folder / "labels.jsonl")
+        paths = [str(temp_image_folder / f"test_{i}.jpg") for i in range(3)]
+        client.post("/classify", json={
+            "image_paths": paths, "labels": ["cat", "cat", "dog"], "target_folder": str(temp_target_folder),
+            "mode": "manifest", "manifest_path": manifest_path,
+        })
+        client.post("/classify", json={
+            "image_paths": paths[:1], "labels": ["dog"], "target_folder": str(temp_target_folder),
+            "mode": "manifest", "manifest_path": manifest_path,
+        })
+        
+        job = client.post("/manifest/materialize", json={
+            "manifest_path": manifest_path, "target_folder": str(temp_target_folder),
+        }).json()
+        deadline = time.monotonic() + 10
+        while client.get(f"/classify/jobs/{job['job_id']}").json()["status"] in ("queued", "running"):
+            assert time.monotonic() < deadline
+            time.sleep(0.02)
+        
+        assert sorted(os.listdir(temp_target_folder / "dog")) == ["test_0.jpg", "test_2.jpg"]
+        assert os.listdir(temp_target_folder / "cat") == ["test_1.jpg"]
+
+
+class TestMoveJournal:
+    """Test the move journal, batch undo/redo and crash recovery."""
+    
+    def test_undo_and_redo_batch_by_id(self, client, temp_image_folder, temp_target_folder):
+        """Test undoing and redoing a batch using only its id."""
+        request = ClassifyRequest(
+            image_paths=[str(temp_image_folder / f"test_{i}.jpg") for i in range(3)],
+            labels=["class1", "class2", "class1"],
+            target_folder=str(temp_target_folder)
+        )
+        batch_id = client.post("/classify", json=request.model_dump()).json()["batch_id"]
+        
+        batches = client.get("/journal/batches").json()
+        assert batches[0]["batch_id"] == batch_id
+        assert batches[0]["moved"] == 3
+        
+        response = client.post("/undo", json={"batch_id": batch_id})
+        assert len(response.json()["restored_files"]) == 3
+        assert all((temp_image_folder / f"test_{i}.jpg").exists() for i in range(3))
+        
+        response = client.post(f"/journal/batches/{batch_id}/redo")
+        assert len(response.json()["moved_files"]) == 3
+        assert not (temp_image_folder / "test_0.jpg").exists()
+        assert (temp_target_folder / "class1" / "test_0.jpg").exists()
+    
+    def test_batch_undo_reports_conflicts(self, client, temp_image_folder, temp_target_folder):
+        """Test that a batch undo skips files whose original path is taken again."""
+        batch_id = client.post("/classify", json={
+            "image_paths": [str(temp_image_folder / f"test_{i}.jpg") for i in range(2)],
+            "labels": ["class1", "class1"],
+            "target_folder": str(temp_target_folder),
+        }).json()["batch_id"]
+        (temp_image_folder / "test_0.jpg").write_bytes(b"newer")
+        
+        data = client.post("/undo", json={"batch_id": batch_id}).json()
+        
+        assert [restored["to"] for restored in data["restored_files"]] == [str(temp_image_folder / "test_1.jpg")]
+        assert len(data["errors"]) == 1
+        assert (temp_image_folder / "test_0.jpg").read_bytes() == b"newer"
+        assert (temp_target_folder / "class1" / "test_0.jpg").exists()
+        assert client.get("/journal/batches").json()[0]["moved"] == 1
+    
+    def test_intents_share_one_fsync_per_chunk(self, tmp_path):
+        """Test that a chunk of moves is journaled with a single fsync."""
+        source_dir = tmp_path / "src"
+        source_dir.mkdir()
+        for i in range(20):
+            (source_dir / f"{i}.jpg").write_bytes(b"x")
+        journal = MoveJournal(tmp_path / "journal.jsonl")
+        
+        with patch("utils.journal.os.fsync", wraps=os.fsync) as fsync:
+            result = classify_batch(
+                [str(source_dir / f"{i}.jpg") for i in range(20)], ["a"] * 20, str(tmp_path),
+                journal=journal
+            )
+        
+        assert len(result.moved_files) == 20
+        # 移動予定で1回、コミットで1回
+        assert fsync.call_count == 2
+        
+        with patch("utils.journal.os.fsync", wraps=os.fsync) as fsync:
+            assert len(journal.undo(result.batch_id)) == 20
+        assert fsync.call_count == 3
+        journal.close()
+    
+    def test_committed_batches_are_kept_on_disk(self, tmp_path):
+        """Test that committed batches drop their entries and read them back for undo."""
+        source_dir = tmp_path / "src"
+        label_dir = tmp_path / "target" / "class1"
+        source_dir.mkdir()
+        label_dir.mkdir(parents=True)
+        journal_path = tmp_path / "journal.jsonl"
+        journal = MoveJournal(journal_path)
+        for name in ("first", "second"):
+            batch = journal.begin(str(tmp_path / "target"))
+            for i in range(3):
+                source = source_dir / f"{name}_{i}.jpg"
+                destination = label_dir / source.name
+                destination.write_bytes(b"x")
+                batch.done(batch.intent(source, destination))
+            batch.commit()
+        journal.close()
+        
+        journal = MoveJournal(journal_path)
+        assert journal.memory_entries() == 0
+        assert [summary["moved"] for summary in journal.list_batches()] == [3, 3]
+        assert journal.reloads == 0
+        
+        first = journal.list_batches()[1]["batch_id"]
+        assert len(journal.undo(first)) == 3
+        assert journal.reloads == 1
+        assert journal.memory_entries() == 3
+        assert (source_dir / "first_0.jpg").exists()
+        
+        # 予算による追い出しの後も、クライアントからの取り消しは移動先から記録を探せる
+        assert journal.evict_oldest() > 0
+        assert journal.memory_entries() == 0
+        (label_dir / "second_0.jpg").rename(source_dir / "second_0.jpg")
+        journal.mark_undone(str(label_dir / "second_0.jpg"))
+        journal.close()
+        summaries = {summary["batch_id"]: summary for summary in MoveJournal(journal_path).list_batches()}
+        assert summaries[first]["undone"] == 3
+        assert [summary["undone"] for batch_id, summary in summaries.items() if batch_id != first] == [1]
+    
+    def test_recovery_after_crash_during_undo_and_redo(self, tmp_path):
+        """Test that interrupted undo and redo intents are reconciled on startup."""
+        source_dir = tmp_path / "src"
+        label_dir = tmp_path / "target" / "class1"
+        source_dir.mkdir()
+        label_dir.mkdir(parents=True)
+        # 取り消し: a は予約だけして落ちた、b は戻した後に落ちた
+        (source_dir / "a.jpg").touch()
+        (label_dir / "a.jpg").write_bytes(b"aaa")
+        (source_dir / "b.jpg").write_bytes(b"bbb")
+        # やり直し: c は予約だけして落ちた
+        (source_dir / "c.jpg").write_bytes(b"ccc")
+        (label_dir / "c_1.jpg").touch()
+        records = [{"op": "begin", "batch": "b1", "target": str(tmp_path / "target"), "time": 0}]
+        for seq, name in enumerate("abc"):
+            records += [
+                {"op": "intent", "batch": "b1", "seq": seq,
+                 "src": str(source_dir / f"{name}.jpg"), "dst": str(label_dir / f"{name}.jpg")},
+                {"op": "done", "batch": "b1", "seq": seq},
+            ]
+        records += [
+            {"op": "undone", "batch": "b1", "seq": 2},
+            {"op": "commit", "batch": "b1"},
+            {"op": "reopen", "batch": "b1"},
+            {"op": "undo_intent", "batch": "b1", "seq": 0, "dst": str(label_dir / "a.jpg")},
+            {"op": "undo_intent", "batch": "b1", "seq": 1, "dst": str(label_dir / "b.jpg")},
+            {"op": "redo_intent", "batch": "b1", "seq": 2, "dst": str(label_dir / "c_1.jpg")},
+        ]
+        journal_path = tmp_path / "journal.jsonl"
+        journal_path.write_text("\n".join(json.dumps(r) for r in records) + "\n")
+        
+        journal = MoveJournal(journal_path)
+        
+        assert journal.recovered == 3
+        assert not (source_dir / "a.jpg").exists()
+        assert (label_dir / "a.jpg").read_bytes() == b"aaa"
+        assert not (label_dir / "c_1.jpg").exists()
+        summary = journal.list_batches()[0]
+        assert summary["committed"] is True
+        assert (summary["moved"], summary["undone"]) == (1, 2)
+        
+        redone = {Path(moved["source"]).name: Path(moved["destination"]) for moved in journal.redo("b1")}
+        journal.close()
+        assert set(redone) == {"b.jpg", "c.jpg"}
+        assert redone["c.jpg"].read_bytes() == b"ccc"
+        assert MoveJournal(journal_path).list_batches()[0]["moved"] == 3
+    
+    def test_undo_unknown_batch(self, client):
+        """Test error when the batch doesn't exist."""
+        response = client.post("/undo", json={"batch_id": "unknown"})
+        
+        assert response.status_code == 404
+    
+    def test_recovery_after_crash(self, tmp_path):
+        """Test that unfinished intents are reconciled on startup."""
+        source_dir = tmp_path / "src"
+        label_dir = tmp_path / "target" / "class1"
+        source_dir.mkdir()
+        label_dir.mkdir(parents=True)
+        # 移動前に落ちた: 元ファイルと空の予約ファイルが残る
+        (source_dir / "a.jpg").write_bytes(b"aaa")
+        (label_dir / "a.jpg").touch()
+        # 移動後、完了記録前に落ちた
+        (label_dir / "b.jpg").write_bytes(b"bbb")
+        records = [
+            {"op": "begin", "batch": "b1", "target": str(tmp_path / "target"), "time": 0},
+            {"op": "intent", "batch": "b1", "seq": 0,
+             "src": str(source_dir / "a.jpg"), "dst": str(label_dir / "a.jpg")},
+            {"op": "intent", "batch": "b1", "seq": 1,
+             "src": str(source_dir / "b.jpg"), "dst": str(label_dir / "b.jpg")},
+        ]
+        journal_path = tmp_path / "journal.jsonl"
+        journal_path.write_text("\n".join(json.dumps(r) for r in records) + '\n{"op": "do')
+        
+        journal = MoveJournal(journal_path)
+        
+        assert journal.recovered == 2
+        assert not (label_dir / "a.jpg").exists()
+        summary = journal.list_batches()[0]
+        assert summary["committed"] is True
+        assert (summary["moved"], summary["failed"]) == (1, 1)
+        
+        journal.undo("b1")
+        journal.close()
+        assert (source_dir / "b.jpg").read_bytes() == b"bbb"
+        assert MoveJournal(journal_path).list_batches()[0]["undone"] == 1
 
 
 class TestFileOperations:
@@ -208,6 +1549,332 @@ class TestFileOperations:
         """Test that supported extensions are correctly defined."""
         expected = {".jpg", ".jpeg", ".png"}
         assert SUPPORTED_EXTENSIONS == expected
+    
+    def test_resolve_paths_matches_decode_and_normalize(self):
+        """Test that batch resolution gives the same paths as per-path normalisation."""
+        paths = [
+            "/photos/a.jpg",
+            "/photos/%E5%86%99%E7%9C%9F/b.jpg",
+            "C:\\resolve-test\\sub\\c.png",
+            "d.jpg",
+        ]
+        for wsl in (False, True):
+            with patch("utils.encoding.is_wsl", return_value=wsl):
+                resolved = resolve_paths(paths)
+                expected = [normalize_path(safe_path_decode(path)) for path in paths]
+            assert [item.path for item in resolved] == expected
+            assert [item.name for item in resolved] == ["a.jpg", "b.jpg", "c.png", "d.jpg"]
+        # WSLではフォルダ部分をLRUで再利用してもファイル名ごとに正しく変換される
+        with patch("utils.encoding.is_wsl", return_value=True):
+            assert resolve_paths(["C:\\resolve-test\\sub\\e.jpg"])[0].path == "/mnt/c/resolve-test/sub/e.jpg"
+
+
+class TestMemoryGovernance:
+    """Test compact listings, the shared cache budget and /debug/memory."""
+    
+    def test_listing_json_matches_image_info_shape(self):
+        """Test that chunked encoding yields the same objects and columnar JSON."""
+        listing = ImageListing("/photos", ["a.jpg", "b.jpg", "c.jpg", "d.jpg", "e.jpg"])
+        
+        objects = json.loads(b"".join(listing.iter_json(chunk_size=2)))
+        columnar = json.loads(b"".join(listing.iter_json("columnar", chunk_size=2)))
+        
+        assert objects == [
+            {"path": os.path.join("/photos", name), "filename": name} for name in listing.filenames
+        ]
+        assert columnar == {"folder": "/photos", "filenames": listing.filenames, "columns": {}}
+        assert json.loads(b"".join(ImageListing("/photos", []).iter_json())) == []
+    
+    def test_listing_500k_entries_peak_memory(self, tmp_path):
+        """Test that listing and encoding a 500k-entry indexed folder stays compact."""
+        folder = tmp_path / "photos"
+        folder.mkdir()
+        index = FolderIndex(tmp_path / "index.sqlite3")
+        # 50万ファイルは作らず、スキャン済みのフォルダとしてインデックスに直接登録する
+        with sqlite3.connect(tmp_path / "index.sqlite3") as conn:
+            folder_id = conn.execute(
+                "INSERT INTO folders (path, dir_mtime_ns, scanned_at_ns) VALUES (?, ?, ?)",
+                (str(folder.resolve()), folder.stat().st_mtime_ns, time.time_ns() + 3600 * 10 ** 9),
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO entries (folder_id, filename, size, mtime_ns, inode) VALUES (?, ?, 0, 0, ?)",
+                ((folder_id, f"IMG_{i:07d}.jpg", i) for i in range(500_000)),
+            )
+        
+        tracemalloc.start()
+        try:
+            listing = get_images_from_folder(str(folder), index)
+            body_bytes = sum(len(chunk) for chunk in listing.iter_json())
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            index.close()
+        
+        assert index.rescans == 0
+        assert len(listing) == 500_000
+        # 本体は約40MB。ファイル名のリストが約34MBで、画像ごとのモデルを作ると数百MBになる
+        assert body_bytes > 500_000 * 60
+        assert peak < 48 * 1024 * 1024
+    
+    def test_budget_evicts_least_recently_used_folder(self, tmp_path):
+        """Test that exceeding the budget drops the least recently used label folder."""
+        for name in ("a", "b"):
+            (tmp_path / name).mkdir()
+            for i in range(200):
+                (tmp_path / name / f"{i}.jpg").touch()
+        budget = MemoryBudget(max_bytes=10 ** 9)
+        registry = LabelFolderRegistry(budget=budget)
+        budget.register("label_folders", registry)
+        names_a = registry.get(tmp_path / "a")
+        budget.max_bytes = registry.memory_usage() * 3 // 2
+        
+        names_b = registry.get(tmp_path / "b")
+        
+        assert budget.evictions == 1
+        assert registry.get(tmp_path / "b") is names_b
+        assert registry.get(tmp_path / "a") is not names_a
+    
+    def test_debug_memory_reports_caches(self, client, temp_image_folder, temp_target_folder):
+        """Test that /debug/memory lists every cache with its size."""
+        client.post("/classify", json={
+            "image_paths": [str(temp_image_folder / "test_0.jpg")],
+            "labels": ["cat"],
+            "target_folder": str(temp_target_folder),
+        })
+        
+        response = client.get("/debug/memory")
+        
+        assert response.status_code == 200
+        report = response.json()
+        assert set(report["caches"]) == {
+            "label_folders", "classify_jobs", "journal", "thumbnail_index", "tile_index"
+        }
+        assert report["caches"]["label_folders"]["entries"] == 1
+        assert report["caches"]["journal"]["entries"] == 1
+        assert all(cache["evictable"] for cache in report["caches"].values())
+        assert 0 < report["used_bytes"] <= report["budget_bytes"]
+    
+    def test_budget_evicts_thumbnail_index(self, tmp_path):
+        """Test that the thumbnail index gives up its least recently used files under the budget."""
+        budget = MemoryBudget(max_bytes=10 ** 9)
+        cache = ThumbnailCache(tmp_path / "thumbnails", budget=budget)
+        budget.register("thumbnail_index", cache)
+        paths = [tmp_path / "thumbnails" / "ab" / f"ab{i:062d}.jpg" for i in range(20)]
+        for path in paths[:10]:
+            path.parent.mkdir(exist_ok=True)
+            path.write_bytes(b"x")
+            cache.register(path, 1)
+        budget.max_bytes = cache.memory_usage() * 3 // 2
+        cache.get(paths[0])
+        
+        for path in paths[10:]:
+            path.write_bytes(b"x")
+            cache.register(path, 1)
+        
+        assert budget.evictions > 0
+        assert cache.memory_usage() <= budget.max_bytes
+        # 最近使った paths[0] より先に、使われていない古いファイルから削除される
+        assert cache.contains(paths[0]) and paths[0].exists()
+        assert not cache.contains(paths[1]) and not paths[1].exists()
+        assert cache.contains(paths[-1])
+
+
+class TestMetrics:
+    """Test the Prometheus metrics endpoint and the profiling switch."""
+    
+    def test_metrics_after_classify(self, client, temp_image_folder, temp_target_folder):
+        """Test that request, phase and move counters are exported."""
+        client.post("/classify", json={
+            "image_paths": [str(temp_image_folder / "test_0.jpg")],
+            "labels": ["cat"],
+            "target_folder": str(temp_target_folder),
+        })
+        
+        response = client.get("/metrics")
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        text = response.text
+        assert 'image_sorter_http_requests_total{method="POST",route="/classify",status="200"}' in text
+        assert 'image_sorter_classify_phase_seconds_count{phase="move"}' in text
+        assert "image_sorter_files_moved_total" in text
+        assert "image_sorter_thumbnail_cache_misses_total 0" in text
+    
+    def test_profile_switch(self, monkeypatch, app_data_dir):
+        """Test that a profiled request writes a cProfile stats file."""
+        monkeypatch.setenv("IMAGE_SORTER_PROFILING", "1")
+        client = TestClient(create_app())
+        
+        response = client.get("/", headers={"X-Profile": "1"})
+        
+        assert response.status_code == 200
+        profile_path = Path(response.headers["x-profile-file"])
+        assert profile_path.parent == app_data_dir / "profiles"
+        assert profile_path.stat().st_size > 0
+    
+    def test_profile_switch_disabled_by_default(self, client):
+        """Test that the header is ignored unless profiling is enabled."""
+        response = client.get("/", headers={"X-Profile": "1"})
+        
+        assert "x-profile-file" not in response.headers
+
+
+class TestColdStart:
+    """Test startup cost and the readiness signal of main.py."""
+    
+    def test_import_time_budget(self, app_data_dir):
+        """Test that importing main stays within budget and does not load Pillow."""
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import main; print(main.IMPORT_TIME_BUDGET_MS)"],
+            cwd=BACKEND_DIR, capture_output=True, text=True, timeout=60,
+            env={**os.environ, "IMAGE_SORTER_DATA_DIR": str(app_data_dir)},
+        )
+        
+        assert result.returncode == 0, result.stderr
+        budget_ms = int(result.stdout.strip().splitlines()[-1])
+        cumulative_us = {}
+        for line in result.stderr.splitlines():
+            if line.startswith("import time:") and "|" in line:
+                _, cumulative, module = line.split("|")
+                if cumulative.strip().isdigit():
+                    cumulative_us[module.strip()] = int(cumulative)
+        assert not any(module == "PIL" or module.startswith("PIL.") for module in cumulative_us)
+        assert cumulative_us["main"] / 1000 < budget_ms
+    
+    def test_ready_line_on_stdout(self, app_data_dir):
+        """Test that the server announces readiness once it accepts connections."""
+        process = subprocess.Popen(
+            [sys.executable, "main.py", "--port", "0"],
+            cwd=BACKEND_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+            env={**os.environ, "IMAGE_SORTER_DATA_DIR": str(app_data_dir)},
+        )
+        try:
+            line = process.stdout.readline()
+            assert line.startswith("IMAGE_SORTER_READY http://127.0.0.1:")
+            
+            with httpx.Client() as http:
+                response = http.get(line.split()[1] + "/")
+            assert response.status_code == 200
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+    
+    def test_ready_line_on_pipe_without_console(self, app_data_dir):
+        """Test that readiness reaches the pipe passed in the environment when there is no stdout."""
+        read_fd, write_fd = os.pipe()
+        process = subprocess.Popen(
+            [sys.executable, "main.py", "--port", "0"],
+            cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, pass_fds=(write_fd,),
+            env={**os.environ, "IMAGE_SORTER_DATA_DIR": str(app_data_dir), "IMAGE_SORTER_READY_FD": str(write_fd)},
+        )
+        os.close(write_fd)
+        try:
+            with os.fdopen(read_fd, encoding="utf-8") as pipe:
+                line = pipe.readline()
+            assert line.startswith("IMAGE_SORTER_READY http://127.0.0.1:")
+            
+            with httpx.Client() as http:
+                response = http.get(line.split()[1] + "/")
+            assert response.status_code == 200
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+
+class TestBenchmark:
+    """Smoke test of the benchmark harness."""
+    
+    def test_benchmark_reports_all_scenarios(self, tmp_path):
+        """Test that a tiny run produces a complete JSON report."""
+        output = tmp_path / "bench.json"
+        
+        assert benchmark.main([
+            "--files", "12", "--width", "64", "--height", "48", "--batch-size", "5",
+            "--page-size", "5", "--repeat", "2", "--thumbnail-count", "3",
+            "--dir", str(tmp_path), "--output", str(output),
+        ]) == 0
+        
+        report = json.loads(output.read_text(encoding="utf-8"))
+        assert set(report["results"]) == {
+            "list_cold", "list_warm", "page", "thumbnail_cold", "thumbnail_warm", "classify", "undo"
+        }
+        assert report["results"]["classify"]["items"] == 12
+        assert report["results"]["undo"]["items"] == 12
+        assert report["results"]["page"]["requests"] == 3
+
+
+class TestCLI:
+    """Tests for headless classification from a label file."""
+    
+    def test_apply_streams_label_file_as_one_batch(self, temp_image_folder, temp_target_folder, tmp_path, capsys):
+        """Test that chunks of a CSV label file are moved under one batch id."""
+        label_file = tmp_path / "labels.csv"
+        label_file.write_text(
+            "path,label,subpath\n"
+            + "".join(
+                f"{os.path.join(temp_image_folder, f'test_{i}.jpg')},{'cat' if i % 2 else 'dog'},\n"
+                for i in range(3)
+            ),
+            encoding="utf-8"
+        )
+        journal_path = tmp_path / "journal.jsonl"
+        
+        assert cli.main([
+            "--journal", str(journal_path), "apply", str(label_file),
+            "--target", str(temp_target_folder), "--chunk-size", "2",
+        ]) == 0
+        
+        summary = json.loads(capsys.readouterr().out)
+        assert summary["processed"] == 3
+        assert summary["moved"] == 3
+        assert summary["errors"] == 0
+        assert sorted(os.listdir(os.path.join(temp_target_folder, "dog"))) == ["test_0.jpg", "test_2.jpg"]
+        assert os.listdir(os.path.join(temp_target_folder, "cat")) == ["test_1.jpg"]
+        
+        journal = MoveJournal(journal_path)
+        try:
+            batches = journal.list_batches()
+        finally:
+            journal.close()
+        assert [batch["batch_id"] for batch in batches] == [summary["batch_id"]]
+    
+    def test_undo_restores_batch(self, temp_image_folder, temp_target_folder, tmp_path, capsys):
+        """Test that the undo subcommand moves every file of the run back."""
+        label_file = tmp_path / "labels.jsonl"
+        label_file.write_text(
+            "".join(
+                json.dumps({"path": os.path.join(temp_image_folder, f"test_{i}.jpg"), "label": "cat"}) + "\n"
+                for i in range(3)
+            ),
+            encoding="utf-8"
+        )
+        journal_args = ["--journal", str(tmp_path / "journal.jsonl")]
+        assert cli.main([*journal_args, "apply", str(label_file), "--target", str(temp_target_folder)]) == 0
+        batch_id = json.loads(capsys.readouterr().out)["batch_id"]
+        
+        assert cli.main([*journal_args, "undo", batch_id]) == 0
+        
+        assert json.loads(capsys.readouterr().out)["restored"] == 3
+        for i in range(3):
+            assert os.path.exists(os.path.join(temp_image_folder, f"test_{i}.jpg"))
+    
+    def test_apply_rejects_tombstones_without_manifest_flag(self, temp_target_folder, tmp_path, capsys):
+        """Test that a manifest with tombstones is only applied with --manifest."""
+        label_file = tmp_path / "labels.jsonl"
+        label_file.write_text(
+            json.dumps({"op": "label", "batch": "b", "path": "/x/a.jpg", "label": "cat"}) + "\n"
+            + json.dumps({"op": "tombstone", "batch": "b"}) + "\n",
+            encoding="utf-8"
+        )
+        journal_args = ["--journal", str(tmp_path / "journal.jsonl")]
+        
+        assert cli.main([*journal_args, "apply", str(label_file), "--target", str(temp_target_folder)]) == 2
+        assert "--manifest" in capsys.readouterr().err
+        
+        assert cli.main([
+            *journal_args, "apply", str(label_file), "--target", str(temp_target_folder), "--manifest",
+        ]) == 0
+        assert json.loads(capsys.readouterr().out)["processed"] == 0
 
 
 # Integration tests
@@ -0,0 +1,33 @@
+"""Application data directory resolution for persistent caches."""
+
+import os
+import sys
+from pathlib import Path
+
+APP_DIR_NAME = "image-sorter"
+DATA_DIR_ENV = "IMAGE_SORTER_DATA_DIR"
+
+
+def get_app_data_dir() -> Path:
+    """
+    キャッシュやインデックスを保存するアプリデータディレクトリを取得する
+
+    環境変数 IMAGE_SORTER_DATA_DIR が設定されていればそれを優先する
+
+    Returns:
+        作成済みのディレクトリパス
+    """
+    override = os.environ.get(DATA_DIR_ENV)
+    if override:
+        data_dir = Path(override)
+    elif sys.platform.startswith('win'):
+        base = os.environ.get('LOCALAPPDATA') or Path.home() / 'AppData' / 'Local'
+        data_dir = Path(base) / APP_DIR_NAME
+    elif sys.platform == 'darwin':
+        data_dir = Path.home() / 'Library' / 'Caches' / APP_DIR_NAME
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+        data_dir = Path(base) / APP_DIR_NAME
+
+    data_dir.mkdir(parents=True, exist_ok=True)
+    return data_dir
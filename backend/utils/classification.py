@@ -0,0 +1,349 @@
+"""Batched classification engine that moves images on a bounded thread pool."""
+
+import os
+import stat
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, NamedTuple
+
+from utils.dataset import validate_subpath
+from utils.encoding import resolve_paths, safe_path_encode
+from utils.file_operations import (
+    SUPPORTED_EXTENSIONS,
+    candidate_names,
+    create_placeholder,
+    move_to_reserved,
+    resolve_target_folder
+)
+from utils.metrics import METRICS
+from utils.transfer import TRANSFER_COPY, TRANSFER_MOVE
+
+if TYPE_CHECKING:
+    from utils.journal import MoveJournal
+    from utils.memory import MemoryBudget
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_LABEL_FOLDERS = 256
+# 移動先の予約とジャーナルへの移動予定の記録（1回のfsync）をまとめて行う件数
+CLASSIFY_CHUNK_SIZE = 256
+
+
+class LabelFolderNames:
+    """In-memory set of the names present in one label folder.
+
+    Filled by a single scandir and updated as destinations are reserved, so
+    resolving a name collision costs O(1) set lookups instead of an
+    exists() probe per suffix. The set is only a hint: every destination is
+    still claimed on disk with O_EXCL, so names created by other processes
+    are detected and skipped, and a stale entry merely costs a suffix.
+    """
+
+    def __init__(self, label_folder: Path):
+        self.label_folder = label_folder
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+        with os.scandir(label_folder) as scanner:
+            self._names = {entry.name for entry in scanner}
+        self._name_bytes = sum(sys.getsizeof(name) for name in self._names)
+        # 元のファイル名ごとに次に試す候補の位置を覚え、同名が続いても先頭から数え直さない
+        self._next_candidate: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def memory_usage(self) -> int:
+        """名前の集合が使うおおよそのバイト数"""
+        return sys.getsizeof(self._names) + self._name_bytes + sys.getsizeof(self._next_candidate)
+
+    def reserve(self, filename: str) -> Path:
+        """
+        重複しない移動先を選び、空のプレースホルダで予約する
+
+        Args:
+            filename: 元のファイル名
+
+        Returns:
+            予約済みの移動先パス
+        """
+        while True:
+            with self._lock:
+                start = self._next_candidate.get(filename, 0) if filename in self._names else 0
+                # 前回選んだ位置の次から生成し、使用済みの候補を作り直さない
+                for position, name in enumerate(candidate_names(filename, start), start):
+                    if name not in self._names:
+                        break
+                self._names.add(name)
+                self._name_bytes += sys.getsizeof(name)
+                self._next_candidate[filename] = position + 1
+            dest_path = self.label_folder / name
+            if create_placeholder(dest_path):
+                return dest_path
+
+    def release(self, filename: str) -> None:
+        """ファイルがフォルダから移動されたことを記録する"""
+        with self._lock:
+            if filename in self._names:
+                self._names.discard(filename)
+                self._name_bytes -= sys.getsizeof(filename)
+            self._next_candidate.pop(filename, None)
+
+
+class LabelFolderRegistry:
+    """Keeps LabelFolderNames of recently used label folders across batches.
+
+    With a MemoryBudget, least recently used folders are also dropped when
+    the name sets of all folders together exceed the shared budget; a
+    dropped folder is rescanned the next time it is used.
+    """
+
+    def __init__(
+        self,
+        max_folders: int = DEFAULT_MAX_LABEL_FOLDERS,
+        budget: "MemoryBudget | None" = None
+    ):
+        self.max_folders = max_folders
+        self._budget = budget
+        self._lock = threading.Lock()
+        self._folders: OrderedDict[Path, LabelFolderNames] = OrderedDict()
+
+    def get(self, label_folder: Path) -> LabelFolderNames:
+        with self._lock:
+            names = self._folders.get(label_folder)
+            if names is not None:
+                self._folders.move_to_end(label_folder)
+                names.last_used = time.monotonic()
+                return names
+        names = LabelFolderNames(label_folder)
+        with self._lock:
+            names = self._folders.setdefault(label_folder, names)
+            while len(self._folders) > self.max_folders:
+                self._folders.popitem(last=False)
+        if self._budget is not None:
+            self._budget.enforce()
+        return names
+
+    def memory_usage(self) -> int:
+        with self._lock:
+            folders = list(self._folders.values())
+        return sum(names.memory_usage() for names in folders)
+
+    def memory_entries(self) -> int:
+        with self._lock:
+            return sum(len(names) for names in self._folders.values())
+
+    def oldest_use(self) -> float | None:
+        with self._lock:
+            for names in self._folders.values():
+                return names.last_used
+            return None
+
+    def evict_oldest(self) -> int:
+        """最も長く使われていないラベルフォルダの名前の集合を破棄する"""
+        with self._lock:
+            if not self._folders:
+                return 0
+            _, names = self._folders.popitem(last=False)
+        return names.memory_usage()
+
+    def release(self, path: Path) -> None:
+        """ラベルフォルダからファイルが出ていったことを記録する（取り消し時など）"""
+        with self._lock:
+            names = self._folders.get(path.parent)
+        if names is not None:
+            names.release(path.name)
+
+
+class BatchResult(NamedTuple):
+    """Outcome of classify_batch."""
+
+    moved_files: list[dict[str, str]]
+    errors: list[dict[str, str]]
+    batch_id: str | None = None
+
+
+def classify_batch(
+    image_paths: list[str],
+    labels: list[str],
+    target_folder_str: str,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    registry: LabelFolderRegistry | None = None,
+    on_progress: Callable[[bool, int], None] | None = None,
+    cancel_event: threading.Event | None = None,
+    journal: "MoveJournal | None" = None,
+    subpaths: list[str] | None = None,
+    mode: str = TRANSFER_MOVE,
+    verify: bool = False,
+    resume_batch_id: str | None = None
+) -> BatchResult:
+    """
+    複数の画像をまとめてラベルフォルダに移動する
+
+    ラベルフォルダはバッチごとに1回だけ作成し、移動は並列に実行する。
+    CLASSIFY_CHUNK_SIZE 件ごとに移動先を予約し、ジャーナルの移動予定を
+    1回のfsyncで記録してから移動する。
+    1件の失敗でバッチ全体を中断せず、ファイルごとに結果を返す
+
+    Args:
+        image_paths: 画像ファイルパスのリスト
+        labels: 各画像のラベル名
+        target_folder_str: 対象フォルダパス
+        max_workers: 並列に移動する最大数
+        registry: バッチをまたいで使うラベルフォルダ名の索引（省略時はこのバッチ限り）
+        on_progress: 1件処理するごとに (成功したか, 移動したバイト数) で呼ばれる
+        cancel_event: セットされると未着手のファイルを処理せずに終了する
+        journal: 指定した場合は各移動の前後をジャーナルに記録する
+        subpaths: 指定した場合は各画像をラベルフォルダ下のこの相対フォルダに移動する
+        mode: TRANSFER_MOVE、または元ファイルを残す TRANSFER_COPY
+        verify: デバイスをまたぐ移動・コピーで内容を検証してから完了とする
+        resume_batch_id: 中断したバッチの続きとして記録し、移動済みのファイルは処理しない
+
+    Returns:
+        BatchResult。移動情報とエラー情報はどちらも入力順で、
+        キャンセルで処理しなかったファイルはどちらにも含まれない
+
+    Raises:
+        FileNotFoundError: 対象フォルダが存在しない
+        ValueError: サブフォルダがラベルフォルダの外を指す、または再開するバッチが不正
+    """
+    target_folder = resolve_target_folder(target_folder_str)
+
+    resumed = None
+    if resume_batch_id is not None:
+        resumed = journal.get(resume_batch_id) if journal is not None else None
+        if resumed is None:
+            raise ValueError("再開するバッチが存在しません")
+        if resumed.target_folder != str(target_folder):
+            raise ValueError("再開するバッチと対象フォルダが異なります")
+
+    if registry is None:
+        registry = LabelFolderRegistry()
+
+    if subpaths is None:
+        folder_keys = [(label, "") for label in labels]
+    else:
+        folder_keys = [(label, validate_subpath(subpath)) for label, subpath in zip(labels, subpaths)]
+
+    label_names: dict[tuple[str, str], LabelFolderNames] = {}
+    for label, subpath in dict.fromkeys(folder_keys):
+        with METRICS.time("classify_phase_seconds", phase="mkdir"):
+            label_folder = target_folder / label
+            if subpath:
+                label_folder = label_folder / subpath
+                label_folder.mkdir(parents=True, exist_ok=True)
+            else:
+                label_folder.mkdir(exist_ok=True)
+            label_names[label, subpath] = registry.get(label_folder)
+
+    # 入力順の (移動情報, エラー情報)。キャンセルで処理しなかったファイルは両方None
+    results: list[tuple[dict[str, str] | None, dict[str, str] | None]] = [(None, None)] * len(image_paths)
+
+    def record_error(index: int, error: Exception) -> None:
+        if isinstance(error, FileNotFoundError):
+            detail = "ファイルが存在しません"
+        elif isinstance(error, PermissionError):
+            detail = "ファイル操作の権限がありません"
+        else:
+            detail = str(error)
+        METRICS.inc("classify_errors_total")
+        if on_progress is not None:
+            on_progress(False, 0)
+        results[index] = None, {"source": image_paths[index], "label": folder_keys[index][0], "detail": detail}
+
+    def reserve_one(index: int) -> tuple[int, Path, Path, int] | None:
+        # 移動先を予約し、移動が必要なら (入力位置, 移動元, 移動先, サイズ) を返す
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        resolved = resolved_paths[index]
+        try:
+            if os.path.splitext(resolved.name)[1].lower() not in SUPPORTED_EXTENSIONS:
+                raise ValueError("対応していない画像形式です")
+            source_path = Path(resolved.path)
+            previous = resumed.moved_destination(str(source_path)) if resumed is not None else None
+            if previous is not None:
+                # 再開したバッチで移動済みのファイル
+                if on_progress is not None:
+                    on_progress(True, 0)
+                results[index] = {"source": safe_path_encode(source_path), "destination": previous}, None
+                return None
+            with METRICS.time("classify_phase_seconds", phase="stat"):
+                st = source_path.stat()
+            if not stat.S_ISREG(st.st_mode):
+                raise FileNotFoundError(image_paths[index])
+            # 名前の衝突を避ける候補探索とO_EXCLでの予約
+            with METRICS.time("classify_phase_seconds", phase="reserve"):
+                dest_path = label_names[folder_keys[index]].reserve(resolved.name)
+        except Exception as e:
+            record_error(index, e)
+            return None
+        return index, source_path, dest_path, st.st_size
+
+    def move_one(move: tuple[int, Path, Path, int], seq: int | None) -> None:
+        index, source_path, dest_path, size = move
+        try:
+            try:
+                with METRICS.time("classify_phase_seconds", phase=mode):
+                    move_to_reserved(source_path, dest_path, mode, verify)
+            except BaseException:
+                if seq is not None:
+                    journal_batch.failed(seq)
+                raise
+            if seq is not None:
+                with METRICS.time("classify_phase_seconds", phase="journal"):
+                    journal_batch.done(seq)
+        except Exception as e:
+            record_error(index, e)
+            return
+        if mode == TRANSFER_COPY:
+            METRICS.inc("files_copied_total")
+            METRICS.inc("bytes_copied_total", size)
+        else:
+            METRICS.inc("files_moved_total")
+            METRICS.inc("bytes_moved_total", size)
+        if on_progress is not None:
+            on_progress(True, size)
+        results[index] = {
+            "source": safe_path_encode(source_path),
+            "destination": safe_path_encode(dest_path)
+        }, None
+
+    moved_files = []
+    errors = []
+    if not image_paths:
+        return BatchResult(moved_files, errors)
+
+    # パスのデコード・正規化はバッチ全体で1回にまとめる（フォルダ部分は使い回される）
+    with METRICS.time("classify_phase_seconds", phase="decode"):
+        resolved_paths = resolve_paths(image_paths)
+
+    if resumed is not None:
+        resumed.reopen()
+        journal_batch = resumed
+    else:
+        journal_batch = journal.begin(str(target_folder)) if journal is not None else None
+    try:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(image_paths))) as executor:
+            # チャンクごとに移動先を予約し、移動予定を1回のfsyncで記録してから移動する
+            for start in range(0, len(image_paths), CLASSIFY_CHUNK_SIZE):
+                indices = range(start, min(start + CLASSIFY_CHUNK_SIZE, len(image_paths)))
+                moves = [move for move in executor.map(reserve_one, indices) if move is not None]
+                if journal_batch is not None:
+                    with METRICS.time("classify_phase_seconds", phase="journal"):
+                        seqs = journal_batch.intents([(source, dest, mode) for _, source, dest, _ in moves])
+                else:
+                    seqs = [None] * len(moves)
+                list(executor.map(move_one, moves, seqs))
+    finally:
+        if journal_batch is not None:
+            journal_batch.commit()
+    for moved, error in results:
+        if moved is not None:
+            moved_files.append(moved)
+        elif error is not None:
+            errors.append(error)
+    return BatchResult(
+        moved_files, errors, journal_batch.batch_id if journal_batch is not None else None
+    )
@@ -0,0 +1,180 @@
+"""Recursive dataset mode: parallel directory walking with glob filters."""
+
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from fnmatch import fnmatchcase
+from pathlib import Path
+from typing import Iterator
+
+from models import ImageInfo
+from utils.file_operations import is_supported_image_name
+
+DEFAULT_WALK_WORKERS = 16
+
+
+def matches_glob(relative_path: str, patterns: list[str]) -> bool:
+    """
+    相対パスがいずれかのグロブに一致するか判定する
+
+    "/" を含まないパターンは名前だけと、含むパターンはルートからの
+    相対パス（"/" 区切り）と照合する。"*" は "/" にも一致する
+
+    Args:
+        relative_path: ルートからの "/" 区切りの相対パス
+        patterns: グロブパターンのリスト
+
+    Returns:
+        一致するパターンがあるか
+    """
+    name = relative_path.rpartition("/")[2]
+    for pattern in patterns:
+        target = relative_path if "/" in pattern else name
+        if fnmatchcase(target, pattern.strip("/")):
+            return True
+    return False
+
+
+def _scan_directory(
+    directory: str,
+    scanner,
+    include: list[str],
+    exclude: list[str]
+) -> tuple[list[ImageInfo], list[str]]:
+    images = []
+    subdirectories = []
+    prefix = f"{directory}/" if directory else ""
+    with scanner:
+        for entry in scanner:
+            relative_path = prefix + entry.name
+            if exclude and matches_glob(relative_path, exclude):
+                continue
+            # シンボリックリンクのディレクトリは循環を避けるため辿らない
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(relative_path)
+            elif is_supported_image_name(entry.name) and entry.is_file():
+                if include and not matches_glob(relative_path, include):
+                    continue
+                images.append(ImageInfo(path=entry.path, filename=entry.name, subpath=directory))
+    return images, subdirectories
+
+
+def _scan_subdirectory(
+    root: Path,
+    directory: str,
+    include: list[str],
+    exclude: list[str]
+) -> tuple[list[ImageInfo], list[str]]:
+    try:
+        scanner = os.scandir(root / directory)
+    except OSError:
+        # 読めないサブフォルダは os.walk と同様に飛ばす
+        return [], []
+    return _scan_directory(directory, scanner, include, exclude)
+
+
+def walk_images(
+    root: Path,
+    include: list[str] | None = None,
+    exclude: list[str] | None = None,
+    max_workers: int = DEFAULT_WALK_WORKERS
+) -> Iterator[list[ImageInfo]]:
+    """
+    フォルダ以下の画像を再帰的に走査し、フォルダごとにまとめて返す
+
+    フォルダ1つの scandir を1タスクとしてスレッドプールで並列に実行し、
+    完了したフォルダから順に返す（順序は不定）。ルートは呼び出し時に
+    開くため、ルートの権限エラー等は即座に送出される
+
+    Args:
+        root: 検証済みのルートフォルダパス
+        include: 指定した場合は一致する画像だけを返す
+        exclude: 一致するファイル・フォルダを除外する（フォルダは配下ごと）
+        max_workers: 並列に走査する最大数
+
+    Returns:
+        ImageInfo（subpath はルートからの "/" 区切りの相対フォルダ）のリストのイテレータ
+    """
+    scanner = os.scandir(root)
+    return _walk(root, scanner, include or [], exclude or [], max_workers)
+
+
+def _walk(
+    root: Path,
+    scanner,
+    include: list[str],
+    exclude: list[str],
+    max_workers: int
+) -> Iterator[list[ImageInfo]]:
+    images, pending_directories = _scan_directory("", scanner, include, exclude)
+    if images:
+        yield images
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dataset-walk")
+    try:
+        running = {
+            executor.submit(_scan_subdirectory, root, directory, include, exclude)
+            for directory in pending_directories
+        }
+        while running:
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                images, subdirectories = future.result()
+                running.update(
+                    executor.submit(_scan_subdirectory, root, directory, include, exclude)
+                    for directory in subdirectories
+                )
+                if images:
+                    yield images
+    finally:
+        # 途中で打ち切られた場合（クライアント切断等）は未着手の走査を破棄する
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def stream_dataset_ndjson(
+    root: Path,
+    include: list[str] | None = None,
+    exclude: list[str] | None = None
+) -> Iterator[bytes]:
+    """
+    フォルダ以下の画像を走査しながらNDJSONとして逐次出力する
+
+    Args:
+        root: 検証済みのルートフォルダパス
+        include: 指定した場合は一致する画像だけを返す
+        exclude: 一致するファイル・フォルダを除外する
+
+    Returns:
+        フォルダごとにまとめたNDJSONのバイト列イテレータ
+    """
+    batches = walk_images(root, include, exclude)
+    return _encode_batches(batches)
+
+
+def _encode_batches(batches: Iterator[list[ImageInfo]]) -> Iterator[bytes]:
+    for images in batches:
+        lines = [
+            json.dumps(image.model_dump(exclude_none=True), ensure_ascii=False)
+            for image in images
+        ]
+        lines.append("")
+        yield "\n".join(lines).encode("utf-8")
+
+
+def validate_subpath(subpath: str) -> str:
+    """
+    ラベルフォルダ下に再現する相対フォルダを検証する
+
+    Args:
+        subpath: "/" 区切りの相対フォルダ（空文字はラベルフォルダ直下）
+
+    Returns:
+        正規化した相対フォルダ
+
+    Raises:
+        ValueError: 絶対パスや ".." を含み、ラベルフォルダの外を指す
+    """
+    parts = [part for part in subpath.replace("\\", "/").split("/") if part not in ("", ".")]
+    if subpath.startswith(("/", "\\")) or ".." in parts or (parts and ":" in parts[0]):
+        raise ValueError(f"不正なサブフォルダです: {subpath}")
+    return "/".join(parts)
@@ -1,9 +1,14 @@
 """UTF-8 encoding utilities for cross-platform compatibility."""
 
 import sys
+from functools import lru_cache
 from pathlib import Path
+from typing import Iterable, NamedTuple
 from urllib.parse import unquote
 
+# 正規化済みのフォルダ部分を覚えておく数（1リクエストの画像は少数のフォルダに集中する）
+FOLDER_CACHE_SIZE = 4096
+
 
 def setup_locale() -> None:
     """Setup UTF-8 locale for Windows environment."""
@@ -39,20 +44,75 @@ def safe_path_encode(path_obj: Path) -> str:
         return str(path_obj).encode('utf-8', errors='replace').decode('utf-8')
 
 
+@lru_cache(maxsize=None)
+def is_wsl() -> bool:
+    """
+    WSL環境かどうかを判定する
+
+    実行中に変わることはないため、/proc/version の読み込みはプロセスで1回だけ行う
+    """
+    try:
+        with open('/proc/version', 'r') as f:
+            return 'microsoft' in f.read().lower()
+    except OSError:
+        return False
+
+
 def normalize_path(path_str: str) -> str:
     """
     WindowsパスとWSLパスを正規化する
     WSL環境でない場合はWindowsパスをそのまま使用
     """
-    import os
-    
-    # WSL環境かどうかをチェック
-    is_wsl = os.path.exists('/proc/version') and 'microsoft' in open('/proc/version', 'r').read().lower()
-    
-    if is_wsl and (path_str.startswith('C:\\\\') or path_str.startswith('C:\\')):
+    if is_wsl() and (path_str.startswith('C:\\\\') or path_str.startswith('C:\\')):
         # WSL環境でのみWindows→WSLパス変換を実行
         normalized = path_str.replace('C:\\\\', '/mnt/c/').replace('C:\\', '/mnt/c/')
         normalized = normalized.replace('\\\\', '/').replace('\\', '/')
         return normalized
     
-    return path_str
\ No newline at end of file
+    return path_str
+
+
+class ResolvedPath(NamedTuple):
+    """Decoded and normalised path string together with its file name."""
+
+    path: str
+    name: str
+
+
+@lru_cache(maxsize=FOLDER_CACHE_SIZE)
+def _normalize_folder(folder_str: str) -> str:
+    return normalize_path(folder_str)
+
+
+def resolve_path(path_str: str) -> ResolvedPath:
+    """
+    パス文字列をデコード・正規化する
+
+    safe_path_decode と normalize_path を続けて適用した結果と同じになる。
+    WSLでの変換はフォルダ部分だけにかかるため、フォルダ部分の結果をLRUで再利用する
+
+    Args:
+        path_str: リクエストで受け取ったパス文字列
+
+    Returns:
+        ResolvedPath
+    """
+    decoded = safe_path_decode(path_str)
+    cut = max(decoded.rfind('/'), decoded.rfind('\\')) + 1
+    name = decoded[cut:]
+    if not is_wsl():
+        return ResolvedPath(decoded, name)
+    return ResolvedPath(_normalize_folder(decoded[:cut]) + name, name)
+
+
+def resolve_paths(path_strs: Iterable[str]) -> list[ResolvedPath]:
+    """
+    リクエスト内のパスをまとめてデコード・正規化する
+
+    Args:
+        path_strs: パス文字列
+
+    Returns:
+        入力順のResolvedPathのリスト
+    """
+    return [resolve_path(path_str) for path_str in path_strs]
@@ -1,31 +1,40 @@
 """File operation utilities for image processing."""
 
-import shutil
+import errno
+import heapq
+import json
+import os
+from itertools import islice
 from pathlib import Path
+from typing import TYPE_CHECKING, Iterator
 
-from models import ImageInfo
-from utils.encoding import safe_path_encode, safe_path_decode, normalize_path
+from models import ImageInfo, ImagePage, ListingFormat
+from utils.encoding import resolve_path, safe_path_decode, safe_path_encode
+from utils.transfer import TRANSFER_MOVE, transfer_file
+from utils.wire import LISTING_CHUNK_SIZE, iter_columnar_names, iter_image_objects
+
+if TYPE_CHECKING:
+    from utils.classification import LabelFolderRegistry
+    from utils.folder_index import FolderIndex
 
 SUPPORTED_EXTENSIONS = {".jpg", ".jpeg", ".png"}
 
 
-def get_images_from_folder(folder_path_str: str) -> list[ImageInfo]:
+def resolve_folder_path(folder_path_str: str) -> Path:
     """
-    指定されたフォルダから画像ファイル一覧を取得する
+    フォルダパス文字列をデコード・正規化して検証済みのPathに変換する
     
     Args:
         folder_path_str: フォルダパス文字列
         
     Returns:
-        ImageInfoのリスト
+        フォルダのPath
         
     Raises:
         FileNotFoundError: フォルダが存在しない
         NotADirectoryError: 指定パスがディレクトリではない
     """
-    decoded_path = safe_path_decode(folder_path_str)
-    normalized_path = normalize_path(decoded_path)
-    folder_path = Path(normalized_path)
+    folder_path = Path(resolve_path(folder_path_str).path)
     
     if not folder_path.exists():
         raise FileNotFoundError("指定されたフォルダが存在しません")
@@ -33,20 +42,341 @@ def get_images_from_folder(folder_path_str: str) -> list[ImageInfo]:
     if not folder_path.is_dir():
         raise NotADirectoryError("指定されたパスはフォルダではありません")
     
-    images = []
-    for file_path in folder_path.iterdir():
-        if file_path.is_file() and file_path.suffix.lower() in SUPPORTED_EXTENSIONS:
-            safe_path = safe_path_encode(file_path)
-            safe_filename = file_path.name
-            images.append(ImageInfo(path=safe_path, filename=safe_filename))
+    return folder_path
+
+
+def is_supported_image_name(filename: str) -> bool:
+    """ファイル名が対応画像形式の拡張子を持つか判定する"""
+    return os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS
+
+
+def iter_image_entries(folder_path: Path) -> Iterator[os.DirEntry]:
+    """
+    フォルダ内の画像ファイルを走査順に返す
+    
+    os.scandir のDirEntryはディレクトリ読み出し時の型情報を持つため、
+    シンボリックリンク以外はファイルごとのstatが発生しない。
+    フォルダのオープンは呼び出し時に行うため、権限エラー等は即座に送出される
+    
+    Args:
+        folder_path: 検証済みのフォルダパス
+        
+    Returns:
+        画像ファイルのDirEntryイテレータ
+    """
+    scanner = os.scandir(folder_path)
+    return _filter_image_entries(scanner)
+
+
+def _filter_image_entries(scanner) -> Iterator[os.DirEntry]:
+    with scanner:
+        for entry in scanner:
+            if is_supported_image_name(entry.name) and entry.is_file():
+                yield entry
+
+
+class ImageListing:
+    """Folder listing held as one folder path and a list of file names.
+
+    Replaces a list of per-image ImageInfo objects: a name costs one string
+    instead of a model with two strings and a field dict, and the JSON
+    body is encoded chunk by chunk while it is sent.
+    """
+
+    __slots__ = ("folder", "filenames")
+
+    def __init__(self, folder: str, filenames: list[str]):
+        self.folder = folder
+        self.filenames = filenames
+
+    def __len__(self) -> int:
+        return len(self.filenames)
+
+    def paths(self, start: int = 0, stop: int | None = None) -> list[str]:
+        """start 番目から stop 番目の手前までの画像パス"""
+        return [os.path.join(self.folder, name) for name in self.filenames[start:stop]]
+
+    def iter_json(
+        self,
+        response_format: ListingFormat = "objects",
+        chunk_size: int = LISTING_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        """一覧を ImageInfo の配列、または ColumnarImageList のJSONとして少しずつ出力する"""
+        if response_format == "columnar":
+            return iter_columnar_names(self.folder, self.filenames, chunk_size)
+        return iter_image_objects(self.folder, self.filenames, chunk_size)
+
+
+def get_images_from_folder(
+    folder_path_str: str,
+    index: "FolderIndex | None" = None
+) -> ImageListing:
+    """
+    指定されたフォルダから画像ファイル一覧を取得する
+    
+    Args:
+        folder_path_str: フォルダパス文字列
+        index: 指定した場合はフォルダインデックスから差分更新して取得する（ファイル名順）
+        
+    Returns:
+        ImageListing
+        
+    Raises:
+        FileNotFoundError: フォルダが存在しない
+        NotADirectoryError: 指定パスがディレクトリではない
+    """
+    folder_path = resolve_folder_path(folder_path_str)
+    
+    if index is not None:
+        return ImageListing(str(folder_path), index.list_filenames(folder_path))
+    
+    return ImageListing(str(folder_path), [entry.name for entry in iter_image_entries(folder_path)])
+
+
+def get_images_page(
+    folder_path_str: str,
+    offset: int = 0,
+    limit: int = 100,
+    cursor: str | None = None
+) -> ImagePage:
+    """
+    フォルダ内の画像を1ページ分だけ取得する
+    
+    cursor を指定しない場合は走査順で offset から limit 件を返し、
+    必要な件数が揃った時点で走査を打ち切る。
+    cursor を指定した場合はファイル名順で cursor より後の limit 件を返す
+    （フォルダ内容が変化してもページが重複・欠落しない。メモリは limit 件分のみ使用）
+    
+    Args:
+        folder_path_str: フォルダパス文字列
+        offset: 走査順での開始位置
+        limit: 1ページの最大件数
+        cursor: 前ページの next_cursor
+        
+    Returns:
+        ImagePage
+        
+    Raises:
+        FileNotFoundError: フォルダが存在しない
+        NotADirectoryError: 指定パスがディレクトリではない
+    """
+    folder_path = resolve_folder_path(folder_path_str)
+    entries = iter_image_entries(folder_path)
+    
+    if cursor is None:
+        window = list(islice(entries, offset, offset + limit + 1))
+        has_more = len(window) > limit
+        window = window[:limit]
+        return ImagePage(
+            images=[ImageInfo(path=entry.path, filename=entry.name) for entry in window],
+            next_offset=offset + limit if has_more else None,
+        )
+    
+    names = heapq.nsmallest(
+        limit + 1, (entry.name for entry in entries if entry.name > cursor)
+    )
+    has_more = len(names) > limit
+    names = names[:limit]
+    return ImagePage(
+        images=[
+            ImageInfo(path=os.path.join(folder_path, name), filename=name)
+            for name in names
+        ],
+        next_cursor=names[-1] if has_more else None,
+    )
+
+
+def stream_images_ndjson(folder_path: Path, chunk_size: int = 256) -> Iterator[bytes]:
+    """
+    フォルダ内の画像を1行1件のNDJSONとして逐次出力する
+    
+    走査の完了を待たずに chunk_size 件ごとに送出する
+    
+    Args:
+        folder_path: 検証済みのフォルダパス
+        chunk_size: 1回に送出する件数
+        
+    Returns:
+        NDJSONのバイト列イテレータ
+    """
+    entries = iter_image_entries(folder_path)
+    return _encode_ndjson(entries, chunk_size)
+
+
+def _encode_ndjson(entries: Iterator[os.DirEntry], chunk_size: int) -> Iterator[bytes]:
+    lines = []
+    for entry in entries:
+        lines.append(json.dumps({"path": entry.path, "filename": entry.name}, ensure_ascii=False))
+        if len(lines) >= chunk_size:
+            lines.append("")
+            yield "\n".join(lines).encode("utf-8")
+            lines = []
+    if lines:
+        lines.append("")
+        yield "\n".join(lines).encode("utf-8")
+
+
+def resolve_image_path(image_path_str: str) -> Path:
+    """
+    画像パス文字列をデコード・正規化して検証済みのPathに変換する
+    
+    Args:
+        image_path_str: 画像ファイルパス
+        
+    Returns:
+        画像ファイルのPath
+        
+    Raises:
+        FileNotFoundError: ファイルが存在しない
+        ValueError: 対応していない拡張子
+    """
+    image_path = Path(resolve_path(image_path_str).path)
+    
+    if not image_path.is_file():
+        raise FileNotFoundError("指定された画像が存在しません")
+    
+    if image_path.suffix.lower() not in SUPPORTED_EXTENSIONS:
+        raise ValueError("対応していない画像形式です")
+    
+    return image_path
+
+
+def file_etag(st: os.stat_result) -> str:
+    """
+    更新時刻とサイズから強いETagを作る
+
+    Args:
+        st: ファイルのstat結果
+
+    Returns:
+        引用符付きのETag
+    """
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    If-None-Match ヘッダがETagに一致するか判定する（弱い比較）
+
+    Args:
+        if_none_match: If-None-Match ヘッダの値
+        etag: 現在のETag
+
+    Returns:
+        一致すればTrue（304を返してよい）
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+
+def resolve_target_folder(target_folder_str: str) -> Path:
+    """
+    分類先フォルダのパス文字列をデコード・正規化して検証済みのPathに変換する
+    
+    Args:
+        target_folder_str: 対象フォルダパス
+        
+    Returns:
+        対象フォルダのPath
+        
+    Raises:
+        FileNotFoundError: 対象フォルダが存在しない
+    """
+    target_folder = Path(resolve_path(target_folder_str).path)
+    
+    if not target_folder.exists():
+        raise FileNotFoundError("対象フォルダが存在しません")
+    
+    return target_folder
+
+
+def candidate_names(filename: str, start: int = 0) -> Iterator[str]:
+    """
+    移動先の候補名を name.jpg, name_1.jpg, name_2.jpg, ... の順で返す
+
+    Args:
+        filename: 元のファイル名
+        start: 最初に返す候補の位置（0 は元の名前、n は name_n.jpg）
+    """
+    if start == 0:
+        yield filename
+    stem, suffix = os.path.splitext(filename)
+    counter = max(start, 1)
+    while True:
+        yield f"{stem}_{counter}{suffix}"
+        counter += 1
+
+
+def create_placeholder(dest_path: Path) -> bool:
+    """
+    移動先に空のプレースホルダファイルを排他的に作成して予約する
+    
+    存在確認と作成が1回のシステムコールで行われるため、
+    他のプロセスやスレッドと同じ名前を取り合っても上書きが起きない
+    
+    Returns:
+        予約できた場合 True、既に存在した場合 False
+    """
+    try:
+        fd = os.open(dest_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    os.close(fd)
+    return True
+
+
+def move_file(source_path: Path, dest_path: Path) -> None:
+    """
+    ファイルを移動する
+    
+    同一デバイス内ではアトミックな rename のみで完了し、
+    デバイスをまたぐ場合に限りコピー後に元ファイルを削除する
     
-    return images
+    Args:
+        source_path: 移動元
+        dest_path: 移動先（予約用のプレースホルダがあれば置き換える）
+    """
+    transfer_file(source_path, dest_path, TRANSFER_MOVE)
+
+
+def move_to_reserved(
+    source_path: Path,
+    dest_path: Path,
+    mode: str = TRANSFER_MOVE,
+    verify: bool = False
+) -> None:
+    """
+    予約済みの移動先へファイルを移動（またはコピー）する
+    
+    失敗した場合はプレースホルダを削除し、元ファイルを残す
+    
+    Args:
+        source_path: 移動元
+        dest_path: 予約済みの移動先
+        mode: TRANSFER_MOVE または TRANSFER_COPY
+        verify: デバイスをまたぐ場合・コピーする場合に内容を検証する
+    """
+    try:
+        transfer_file(source_path, dest_path, mode, verify)
+    except BaseException:
+        try:
+            os.unlink(dest_path)
+        except OSError:
+            pass
+        raise
 
 
 def move_image_to_label_folder(
     image_path_str: str, 
     label: str, 
-    target_folder_str: str
+    target_folder_str: str,
+    registry: "LabelFolderRegistry | None" = None
 ) -> dict[str, str] | None:
     """
     画像ファイルをラベルフォルダに移動する
@@ -55,6 +385,7 @@ def move_image_to_label_folder(
         image_path_str: 画像ファイルパス
         label: ラベル名  
         target_folder_str: 対象フォルダパス
+        registry: ラベルフォルダ名の索引（省略時はこの呼び出し限り）
         
     Returns:
         移動情報辞書（sourceとdestination）、失敗時はNone
@@ -68,29 +399,19 @@ def move_image_to_label_folder(
     if not source_path.suffix.lower() in SUPPORTED_EXTENSIONS:
         return None
     
-    decoded_target = safe_path_decode(target_folder_str)
-    normalized_target = normalize_path(decoded_target)
-    target_folder = Path(normalized_target)
-    
-    if not target_folder.exists():
-        raise FileNotFoundError("対象フォルダが存在しません")
+    target_folder = resolve_target_folder(target_folder_str)
     
     # ラベルフォルダを作成
     label_folder = target_folder / label
     label_folder.mkdir(exist_ok=True)
     
-    # ファイル移動先パスを決定（重複回避）
-    dest_path = label_folder / source_path.name
-    counter = 1
-    original_dest_path = dest_path
-    while dest_path.exists():
-        stem = original_dest_path.stem
-        suffix = original_dest_path.suffix
-        dest_path = original_dest_path.parent / f"{stem}_{counter}{suffix}"
-        counter += 1
+    # ファイル移動先パスを予約（名前の集合で候補を選ぶため同名ファイルが多くても探索は1回）
+    # classification は file_operations に依存するため使用時に読み込む
+    from utils.classification import LabelFolderRegistry
+    dest_path = (registry or LabelFolderRegistry()).get(label_folder).reserve(source_path.name)
     
     # ファイル移動実行
-    shutil.move(str(source_path), str(dest_path))
+    move_to_reserved(source_path, dest_path)
     
     return {
         "source": safe_path_encode(source_path),
@@ -108,20 +429,41 @@ def restore_file(source_path_str: str, dest_path_str: str) -> dict[str, str] | N
         
     Returns:
         復元情報辞書（fromとto）、失敗時はNone
+        
+    Raises:
+        FileExistsError: 戻す場所に別のファイルが存在する
     """
     decoded_source = safe_path_decode(source_path_str)
     decoded_dest = safe_path_decode(dest_path_str)
     
-    source_path = Path(decoded_source)
-    dest_path = Path(decoded_dest)
+    return restore_path(Path(decoded_source), Path(decoded_dest))
+
+
+def restore_path(source_path: Path, dest_path: Path) -> dict[str, str] | None:
+    """
+    デコード済みのパスでファイルを元の場所に戻す
+    
+    戻す場所は O_EXCL で予約するため、その後に作られた同名のファイルは上書きしない
     
+    Args:
+        source_path: 現在の場所
+        dest_path: 戻す場所
+        
+    Returns:
+        復元情報辞書（fromとto）、失敗時はNone
+        
+    Raises:
+        FileExistsError: 戻す場所に別のファイルが存在する
+    """
     if not source_path.exists():
         return None
     
     if not dest_path.parent.exists():
         return None
     
-    shutil.move(str(source_path), str(dest_path))
+    if not create_placeholder(dest_path):
+        raise FileExistsError(errno.EEXIST, "元の場所に同名のファイルが存在します", str(dest_path))
+    move_to_reserved(source_path, dest_path)
     
     return {
         "from": safe_path_encode(source_path),
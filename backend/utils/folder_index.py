@@ -0,0 +1,306 @@
+"""Persistent SQLite index of folder listings with incremental rescans."""
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from utils.file_operations import is_supported_image_name
+
+# ディレクトリの更新時刻がスキャン時刻にこれより近い場合は、同じ時刻刻み内の
+# 変更を見逃さないよう再スキャンする（gitの "racy clean" 対策と同じ考え方）
+RACY_WINDOW_NS = 2_000_000_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    dir_mtime_ns INTEGER NOT NULL,
+    scanned_at_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    folder_id INTEGER NOT NULL REFERENCES folders(id) ON DELETE CASCADE,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    dhash TEXT,
+    width INTEGER,
+    height INTEGER,
+    taken_at TEXT,
+    PRIMARY KEY (folder_id, filename)
+) WITHOUT ROWID;
+"""
+
+# 既存のデータベースに後から追加した列（名前, 型）
+_ADDED_COLUMNS = [
+    ("dhash", "TEXT"),
+    ("width", "INTEGER"),
+    ("height", "INTEGER"),
+    ("taken_at", "TEXT"),
+]
+
+
+class IndexedEntry(NamedTuple):
+    """A single image file as recorded in the folder index."""
+
+    filename: str
+    size: int
+    mtime_ns: int
+    inode: int
+    dhash: str | None = None
+    # 幅がNoneの行はメタデータ未取得、0は画像として読み込めなかったことを表す
+    width: int | None = None
+    height: int | None = None
+    taken_at: str | None = None
+
+
+class FolderIndex:
+    """Per-folder image listing index stored in SQLite.
+
+    A folder is served straight from the index while its directory mtime
+    is unchanged. Otherwise it is rescanned with scandir, every entry is
+    stat'ed, and only rows whose size, mtime or inode changed are rewritten.
+    Editing a file in place does not touch its directory, so list_entries
+    also re-stats indexed rows before serving their hashes and metadata.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(_SCHEMA)
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(entries)")}
+        for name, column_type in _ADDED_COLUMNS:
+            if name not in existing:
+                self._conn.execute(f"ALTER TABLE entries ADD COLUMN {name} {column_type}")
+        self.hits = 0
+        self.rescans = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def list_entries(self, folder_path: Path) -> list[IndexedEntry]:
+        """
+        フォルダ内の画像ファイル一覧をファイル名順で返す
+
+        Args:
+            folder_path: 検証済みのフォルダパス
+
+        Returns:
+            IndexedEntryのリスト
+        """
+        with self._lock:
+            folder_id, rescanned = self._fresh_folder_id_locked(folder_path)
+            entries = [
+                IndexedEntry(*values)
+                for values in self._conn.execute(
+                    "SELECT filename, size, mtime_ns, inode, dhash, width, height, taken_at FROM entries "
+                    "WHERE folder_id = ? ORDER BY filename",
+                    (folder_id,),
+                )
+            ]
+            if rescanned:
+                return entries
+            return self._restat_locked(folder_id, folder_path, entries)
+
+    def list_filenames(self, folder_path: Path) -> list[str]:
+        """
+        フォルダ内の画像ファイル名だけをファイル名順で返す
+
+        エントリのタプルを作らないため、大きなフォルダの一覧で使うメモリが少ない
+
+        Args:
+            folder_path: 検証済みのフォルダパス
+
+        Returns:
+            ファイル名のリスト
+        """
+        with self._lock:
+            folder_id, _ = self._fresh_folder_id_locked(folder_path)
+            return [
+                values[0]
+                for values in self._conn.execute(
+                    "SELECT filename FROM entries WHERE folder_id = ? ORDER BY filename", (folder_id,)
+                )
+            ]
+
+    def _fresh_folder_id_locked(self, folder_path: Path) -> tuple[int, bool]:
+        # 更新がなければインデックスのまま、あれば差分を再スキャンしてから
+        # (フォルダID, 再スキャンしたか) を返す
+        dir_mtime_ns = os.stat(folder_path).st_mtime_ns
+        key = str(folder_path)
+        row = self._conn.execute(
+            "SELECT id, dir_mtime_ns, scanned_at_ns FROM folders WHERE path = ?", (key,)
+        ).fetchone()
+        if (
+            row is not None
+            and row[1] == dir_mtime_ns
+            and dir_mtime_ns < row[2] - RACY_WINDOW_NS
+        ):
+            self.hits += 1
+            return row[0], False
+        self.rescans += 1
+        return self._rescan(key, folder_path, dir_mtime_ns, row), True
+
+    def _restat_locked(
+        self,
+        folder_id: int,
+        folder_path: Path,
+        entries: list[IndexedEntry]
+    ) -> list[IndexedEntry]:
+        # その場で書き換えられたファイルはフォルダの更新時刻を変えないため、
+        # 行ごとにstatし、サイズ・更新時刻・inodeが変わった行の派生データを破棄する
+        fresh = []
+        changed = []
+        removed = []
+        for entry in entries:
+            try:
+                st = os.stat(os.path.join(folder_path, entry.filename))
+            except FileNotFoundError:
+                removed.append((folder_id, entry.filename))
+                continue
+            values = (st.st_size, st.st_mtime_ns, st.st_ino)
+            if values == (entry.size, entry.mtime_ns, entry.inode):
+                fresh.append(entry)
+            else:
+                fresh.append(IndexedEntry(entry.filename, *values))
+                changed.append((folder_id, entry.filename, *values))
+        if changed or removed:
+            with self._conn:
+                self._conn.executemany(
+                    "DELETE FROM entries WHERE folder_id = ? AND filename = ?", removed
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO entries (folder_id, filename, size, mtime_ns, inode) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    changed,
+                )
+        return fresh
+
+    def known_entries(self, folder_path: Path) -> dict[str, IndexedEntry]:
+        """
+        インデックス済みのエントリを再スキャンせずに返す
+
+        Args:
+            folder_path: フォルダパス
+
+        Returns:
+            ファイル名 -> IndexedEntry。インデックスにないフォルダは空
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM folders WHERE path = ?", (str(folder_path),)
+            ).fetchone()
+            if row is None:
+                return {}
+            return {
+                values[0]: IndexedEntry(*values)
+                for values in self._conn.execute(
+                    "SELECT filename, size, mtime_ns, inode, dhash, width, height, taken_at FROM entries "
+                    "WHERE folder_id = ?",
+                    (row[0],),
+                )
+            }
+
+    def _rescan(self, key: str, folder_path: Path, dir_mtime_ns: int, row) -> int:
+        scanned_at_ns = time.time_ns()
+        with self._conn:
+            if row is None:
+                folder_id = self._conn.execute(
+                    "INSERT INTO folders (path, dir_mtime_ns, scanned_at_ns) VALUES (?, ?, ?)",
+                    (key, dir_mtime_ns, scanned_at_ns),
+                ).lastrowid
+                known = {}
+            else:
+                folder_id = row[0]
+                self._conn.execute(
+                    "UPDATE folders SET dir_mtime_ns = ?, scanned_at_ns = ? WHERE id = ?",
+                    (dir_mtime_ns, scanned_at_ns, folder_id),
+                )
+                known = {
+                    filename: (size, mtime_ns, inode)
+                    for filename, size, mtime_ns, inode in self._conn.execute(
+                        "SELECT filename, size, mtime_ns, inode FROM entries WHERE folder_id = ?",
+                        (folder_id,),
+                    )
+                }
+
+            changed = []
+            with os.scandir(folder_path) as scanner:
+                for entry in scanner:
+                    if not is_supported_image_name(entry.name) or not entry.is_file():
+                        continue
+                    previous = known.pop(entry.name, None)
+                    # 同じinodeのまま上書きされたファイルを見逃さないよう、常にstatして
+                    # サイズ・更新時刻・inodeがすべて一致する行だけを再利用する
+                    st = entry.stat()
+                    values = (st.st_size, st.st_mtime_ns, st.st_ino)
+                    if values != previous:
+                        # 内容が変わった可能性があるため、付随する派生データ（ハッシュ等）は破棄される
+                        changed.append((folder_id, entry.name, *values))
+
+            if known:
+                self._conn.executemany(
+                    "DELETE FROM entries WHERE folder_id = ? AND filename = ?",
+                    [(folder_id, filename) for filename in known],
+                )
+            if changed:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO entries (folder_id, filename, size, mtime_ns, inode) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    changed,
+                )
+        return folder_id
+
+    def store_hashes(self, folder_path: Path, hashes: list[tuple[str, str]]) -> None:
+        """
+        画像の知覚ハッシュを保存する
+
+        Args:
+            folder_path: list_entries で登録済みのフォルダパス
+            hashes: (ファイル名, 16進ハッシュ) のリスト。読み込めない画像は空文字
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id FROM folders WHERE path = ?", (str(folder_path),)
+            ).fetchone()
+            if row is None:
+                return
+            self._conn.executemany(
+                "UPDATE entries SET dhash = ? WHERE folder_id = ? AND filename = ?",
+                [(value, row[0], filename) for filename, value in hashes],
+            )
+
+    def store_metadata(
+        self,
+        folder_path: Path,
+        metadata: list[tuple[str, int, int, str | None]]
+    ) -> None:
+        """
+        画像のメタデータ（寸法と撮影日時）を保存する
+
+        Args:
+            folder_path: list_entries で登録済みのフォルダパス
+            metadata: (ファイル名, 幅, 高さ, 撮影日時) のリスト。読み込めない画像は幅・高さが0
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT id FROM folders WHERE path = ?", (str(folder_path),)
+            ).fetchone()
+            if row is None:
+                return
+            self._conn.executemany(
+                "UPDATE entries SET width = ?, height = ?, taken_at = ? "
+                "WHERE folder_id = ? AND filename = ?",
+                [
+                    (width, height, taken_at, row[0], filename)
+                    for filename, width, height, taken_at in metadata
+                ],
+            )
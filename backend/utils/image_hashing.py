@@ -0,0 +1,296 @@
+"""Perceptual hashing and near-duplicate grouping of images."""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from models import ImageInfo
+from utils.encoding import resolve_paths, safe_path_encode
+from utils.folder_index import FolderIndex, IndexedEntry
+from utils.imaging import allow_large_images
+
+HASH_BITS = 64
+# 距離 d ではハッシュを d+1 個のブロックに分けるため、これを超えると1ブロックが
+# 7ビット未満になって一致する候補が多すぎ、比較がほぼ総当たりになる
+MAX_DUPLICATE_DISTANCE = 8
+DEFAULT_DUPLICATE_DISTANCE = 4
+# 1つの重複グループに入れる異なるハッシュの最大数（グループ内の比較の数を抑える）
+MAX_GROUP_HASHES = 64
+# これより少ない件数はプロセス起動のコストの方が大きいため同じプロセスで計算する
+INLINE_HASH_LIMIT = 32
+HASH_CHUNK_SIZE = 64
+
+
+def compute_dhash(image_path: str) -> str:
+    """
+    画像の差分ハッシュ（dHash, 64bit）を計算する
+
+    9x8のグレースケールに縮小し、横に隣り合う画素の明暗の大小をビットにする。
+    プロセスプールから呼び出せるようモジュールレベル関数としている
+
+    Args:
+        image_path: 画像ファイルパス
+
+    Returns:
+        16桁の16進文字列。読み込めない画像は空文字
+    """
+    # Pillowは起動時間を短くするため使用時に読み込む
+    from PIL import Image, UnidentifiedImageError
+
+    allow_large_images()
+    try:
+        with Image.open(image_path) as img:
+            # JPEGはDCTスケーリングで縮小デコードする
+            img.draft('L', (64, 64))
+            small = img.convert('L').resize((9, 8), Image.Resampling.BOX)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        return ""
+
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{value:016x}"
+
+
+def group_near_duplicates(hashes: list[int | None], distance: int) -> list[int]:
+    """
+    互いのハミング距離がすべて distance 以下になるように画像をグループにまとめる
+
+    入力順に各ハッシュを、グループ内のすべてのハッシュとの距離が distance 以下の
+    最初のグループに加える（完全連結）。A~B・B~C でも A と C が離れていれば
+    同じグループにはならない。ハッシュを distance+1 個のブロックに分けると、
+    距離が distance 以下の2つのハッシュは鳩の巣原理により少なくとも1ブロックが
+    一致する（multi-index hashing）ため、候補はブロックが一致するグループの代表
+    （最初のハッシュ）だけに絞る。異なるハッシュが MAX_GROUP_HASHES 個に達した
+    グループは候補から外し、連写のような大きな集まりでも比較の数を抑える
+
+    Args:
+        hashes: 各画像のハッシュ（計算できなかった画像はNone）
+        distance: 同一とみなす最大ハミング距離（MAX_DUPLICATE_DISTANCE まで）
+
+    Returns:
+        各画像のグループ番号（グループ内で最も小さい入力位置）
+
+    Raises:
+        ValueError: distance が 0 から MAX_DUPLICATE_DISTANCE の範囲外
+    """
+    if not 0 <= distance <= MAX_DUPLICATE_DISTANCE:
+        raise ValueError(f"重複とみなす距離は0から{MAX_DUPLICATE_DISTANCE}の範囲で指定してください")
+
+    # 完全一致は同じハッシュとして1回だけ扱う（挿入順は入力順）
+    first_by_hash: dict[int, int] = {}
+    for i, value in enumerate(hashes):
+        if value is not None:
+            first_by_hash.setdefault(value, i)
+
+    group_by_hash = dict(first_by_hash)
+    if distance > 0:
+        blocks = distance + 1
+        bounds = [(HASH_BITS * b // blocks, HASH_BITS * (b + 1) // blocks) for b in range(blocks)]
+        # ブロックごとの 代表のブロック値 -> まだ加えられるグループの番号
+        buckets: list[dict[int, list[int]]] = [{} for _ in bounds]
+        # グループ番号 -> (代表のブロック値, グループ内の異なるハッシュ)
+        groups: dict[int, tuple[list[int], list[int]]] = {}
+        for value, i in first_by_hash.items():
+            keys = [(value >> low) & ((1 << (high - low)) - 1) for low, high in bounds]
+            candidates = sorted({
+                group for block, key in enumerate(keys) for group in buckets[block].get(key, ())
+            })
+            for group in candidates:
+                members = groups[group][1]
+                # 先頭は代表なので、離れたグループは最初の比較で外れる
+                if all((value ^ member).bit_count() <= distance for member in members):
+                    members.append(value)
+                    if len(members) >= MAX_GROUP_HASHES:
+                        for block, key in enumerate(groups[group][0]):
+                            buckets[block][key].remove(group)
+                    group_by_hash[value] = group
+                    break
+            else:
+                groups[i] = (keys, [value])
+                for block, key in enumerate(keys):
+                    buckets[block].setdefault(key, []).append(i)
+
+    return [i if value is None else group_by_hash[value] for i, value in enumerate(hashes)]
+
+
+class ImageHasher:
+    """Computes missing hashes on a process pool and stores them in the folder index."""
+
+    def __init__(self, index: FolderIndex, max_workers: int | None = None):
+        self._index = index
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _compute(self, paths: list[str]) -> list[str]:
+        if len(paths) <= INLINE_HASH_LIMIT:
+            return [compute_dhash(path) for path in paths]
+        return list(self._get_executor().map(compute_dhash, paths, chunksize=HASH_CHUNK_SIZE))
+
+    def path_hashes(self, image_paths: list[str]) -> list[int | None]:
+        """
+        指定した画像だけのハッシュを取得する（未計算のものだけ計算して保存する）
+
+        フォルダ全体ではなく1ページ分の画像を対象にするため、大きなフォルダでも
+        表示する画像の数に比例した時間で終わる
+
+        Args:
+            image_paths: 画像ファイルパスのリスト
+
+        Returns:
+            各画像のハッシュ値（読み込めない・存在しない画像はNone）
+        """
+        resolved_paths = resolve_paths(image_paths)
+        known: dict[str, dict[str, IndexedEntry]] = {}
+        values: list[str | None] = []
+        missing: dict[str, list[int]] = {}
+        for position, resolved in enumerate(resolved_paths):
+            folder = os.path.dirname(resolved.path)
+            if folder not in known:
+                entries = self._index.known_entries(Path(folder))
+                if not entries:
+                    try:
+                        # 保存先の行を作るため、未登録のフォルダは一度だけ走査する
+                        entries = {entry.filename: entry for entry in self._index.list_entries(Path(folder))}
+                    except OSError:
+                        entries = {}
+                known[folder] = entries
+            entry = known[folder].get(resolved.name)
+            values.append(entry.dhash if entry is not None else None)
+            if values[-1] is None:
+                missing.setdefault(resolved.path, []).append(position)
+
+        if missing:
+            computed = dict(zip(missing, self._compute(list(missing))))
+            by_folder: dict[str, list[tuple[str, str]]] = {}
+            for path, value in computed.items():
+                for position in missing[path]:
+                    values[position] = value
+                folder, filename = os.path.split(path)
+                if filename in known[folder]:
+                    by_folder.setdefault(folder, []).append((filename, value))
+            for folder, hashes in by_folder.items():
+                self._index.store_hashes(Path(folder), hashes)
+        return [int(value, 16) if value else None for value in values]
+
+    def folder_hashes(self, folder_path: Path) -> dict[str, int | None]:
+        """
+        フォルダ内の全画像のハッシュを取得する（未計算のものだけ計算して保存する）
+
+        Args:
+            folder_path: 検証済みのフォルダパス
+
+        Returns:
+            ファイル名 -> ハッシュ値（読み込めない画像はNone）
+        """
+        entries = self._index.list_entries(folder_path)
+        missing = [entry.filename for entry in entries if entry.dhash is None]
+        computed: dict[str, str] = {}
+        if missing:
+            computed = dict(zip(missing, self._compute(
+                [os.path.join(folder_path, filename) for filename in missing]
+            )))
+            self._index.store_hashes(folder_path, list(computed.items()))
+
+        result = {}
+        for entry in entries:
+            value = computed.get(entry.filename, entry.dhash)
+            result[entry.filename] = int(value, 16) if value else None
+        return result
+
+    def group_images(
+        self,
+        folder_path: Path,
+        images: list[ImageInfo],
+        distance: int,
+        representatives_only: bool = False
+    ) -> list[ImageInfo]:
+        """
+        画像一覧に重複グループ情報を付与する
+
+        Args:
+            folder_path: 画像のフォルダ
+            images: フォルダの画像一覧
+            distance: 同一とみなす最大ハミング距離
+            representatives_only: 各グループの代表（先頭の画像）だけを返すか
+
+        Returns:
+            cluster_id と cluster_size を設定したImageInfoのリスト
+        """
+        hashes_by_name = self.folder_hashes(folder_path)
+        groups = group_near_duplicates(
+            [hashes_by_name.get(image.filename) for image in images], distance
+        )
+        sizes: dict[int, int] = {}
+        for group in groups:
+            sizes[group] = sizes.get(group, 0) + 1
+
+        result = []
+        for i, (image, group) in enumerate(zip(images, groups)):
+            if representatives_only and group != i:
+                continue
+            result.append(image.model_copy(update={"cluster_id": group, "cluster_size": sizes[group]}))
+        return result
+
+    def expand_to_clusters(self, image_paths: list[str], distance: int) -> tuple[list[str], list[int]]:
+        """
+        各画像と同じ重複グループの画像を加えた一覧を作る
+
+        Args:
+            image_paths: 分類リクエストの画像パス
+            distance: 同一とみなす最大ハミング距離
+
+        Returns:
+            (展開後の画像パス, 各画像の元になった指定の位置)。元の指定を先頭に保つ
+        """
+        expanded_paths = list(image_paths)
+        origins = list(range(len(image_paths)))
+        resolved_paths = [Path(resolved.path) for resolved in resolve_paths(image_paths)]
+        seen = set(resolved_paths)
+        members_by_folder: dict[Path, dict[str, list[str]]] = {}
+
+        for position, image_path in enumerate(resolved_paths):
+            folder_path = image_path.parent
+            if folder_path not in members_by_folder:
+                try:
+                    hashes_by_name = self.folder_hashes(folder_path)
+                except OSError:
+                    # 元画像の検証と個別のエラーは classify_batch に任せる
+                    hashes_by_name = {}
+                names = list(hashes_by_name)
+                groups = group_near_duplicates([hashes_by_name[name] for name in names], distance)
+                by_group: dict[int, list[str]] = {}
+                for name, group in zip(names, groups):
+                    by_group.setdefault(group, []).append(name)
+                members_by_folder[folder_path] = {
+                    name: by_group[group] for name, group in zip(names, groups)
+                }
+
+            for name in members_by_folder[folder_path].get(image_path.name, []):
+                member_path = folder_path / name
+                if member_path not in seen:
+                    seen.add(member_path)
+                    expanded_paths.append(safe_path_encode(member_path))
+                    origins.append(position)
+        return expanded_paths, origins
@@ -0,0 +1,19 @@
+"""Pillow settings for the trusted local images this app opens.
+
+Pillow refuses images above about 179 megapixels as possible decompression
+bombs. The images opened here are the user's own files, and 100+ megapixel
+scans are exactly what the tile pyramid is for, so the limit is raised to
+LOCAL_MAX_IMAGE_PIXELS in every process before an image is opened.
+"""
+
+# Pillowが読み込みを拒否する画素数の上限（この2倍を超える画像は拒否される）
+LOCAL_MAX_IMAGE_PIXELS = 1 << 30
+
+
+def allow_large_images() -> None:
+    """Pillowの展開爆弾の上限を LOCAL_MAX_IMAGE_PIXELS まで引き上げる（何度呼んでもよい）"""
+    # Pillowは起動時間を短くするため使用時に読み込む
+    from PIL import Image
+
+    if Image.MAX_IMAGE_PIXELS is not None and Image.MAX_IMAGE_PIXELS < LOCAL_MAX_IMAGE_PIXELS:
+        Image.MAX_IMAGE_PIXELS = LOCAL_MAX_IMAGE_PIXELS
@@ -0,0 +1,273 @@
+"""Background classification jobs with progress tracking and cancellation."""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable
+
+from utils.classification import LabelFolderRegistry, classify_batch
+from utils.dataset import validate_subpath
+from utils.file_operations import resolve_target_folder
+from utils.journal import MoveJournal
+from utils.memory import estimate_bytes
+from utils.transfer import TRANSFER_MOVE
+
+if TYPE_CHECKING:
+    from utils.memory import MemoryBudget
+
+DEFAULT_MAX_CONCURRENT_JOBS = 1
+DEFAULT_MAX_FINISHED_JOBS = 100
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_CANCELLED = "cancelled"
+JOB_FAILED = "failed"
+FINISHED_STATES = {JOB_COMPLETED, JOB_CANCELLED, JOB_FAILED}
+
+
+class ClassificationJob:
+    """State and progress counters of a single classification job."""
+
+    def __init__(
+        self,
+        image_paths: list[str],
+        labels: list[str],
+        target_folder: str,
+        subpaths: list[str] | None = None,
+        mode: str = TRANSFER_MOVE,
+        verify: bool = False,
+        resume_batch_id: str | None = None
+    ):
+        self.job_id = uuid.uuid4().hex
+        self.image_paths = image_paths
+        self.labels = labels
+        self.subpaths = subpaths
+        self.target_folder = target_folder
+        self.mode = mode
+        self.verify = verify
+        self.resume_batch_id = resume_batch_id
+        self.total = len(image_paths)
+        self.status = JOB_QUEUED
+        self.done = 0
+        self.failed = 0
+        self.bytes_moved = 0
+        self.detail: str | None = None
+        self.batch_id: str | None = None
+        self.moved_files: list[dict[str, str]] = []
+        self.errors: list[dict[str, str]] = []
+        # 終了後に保持する結果のおおよそのバイト数
+        self.nbytes = 0
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def record(self, moved: bool, nbytes: int) -> None:
+        """classify_batch の進捗コールバック"""
+        with self._lock:
+            self.done += 1
+            if moved:
+                self.bytes_moved += nbytes
+            else:
+                self.failed += 1
+
+    def snapshot(self, include_results: bool = True) -> dict:
+        """
+        進捗のスナップショットを返す
+
+        Args:
+            include_results: 移動結果とエラーの一覧を含めるか
+
+        Returns:
+            スループットと残り時間の推定を含む辞書
+        """
+        with self._lock:
+            done, failed, bytes_moved = self.done, self.failed, self.bytes_moved
+        if self.started_at is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+
+        files_per_second = done / elapsed if elapsed > 0 else 0.0
+        bytes_per_second = bytes_moved / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - done
+        if self.finished:
+            eta_seconds = 0.0
+        elif files_per_second > 0:
+            eta_seconds = remaining / files_per_second
+        else:
+            eta_seconds = None
+
+        result = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "total": self.total,
+            "done": done,
+            "failed": failed,
+            "bytes_moved": bytes_moved,
+            "elapsed_seconds": elapsed,
+            "files_per_second": files_per_second,
+            "bytes_per_second": bytes_per_second,
+            "eta_seconds": eta_seconds,
+            "detail": self.detail,
+            "batch_id": self.batch_id,
+        }
+        if include_results:
+            result["moved_files"] = self.moved_files
+            result["errors"] = self.errors
+        return result
+
+
+class JobManager:
+    """Runs classification jobs on a background executor."""
+
+    def __init__(
+        self,
+        registry: LabelFolderRegistry,
+        journal: MoveJournal | None = None,
+        max_concurrent_jobs: int = DEFAULT_MAX_CONCURRENT_JOBS,
+        max_finished_jobs: int = DEFAULT_MAX_FINISHED_JOBS,
+        on_finished: Callable[[ClassificationJob], None] | None = None,
+        budget: "MemoryBudget | None" = None
+    ):
+        self._registry = registry
+        self._journal = journal
+        self._on_finished = on_finished
+        self._budget = budget
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_jobs, thread_name_prefix="classify-job"
+        )
+        self._max_finished_jobs = max_finished_jobs
+        self._lock = threading.Lock()
+        self._jobs: OrderedDict[str, ClassificationJob] = OrderedDict()
+
+    def create(
+        self,
+        image_paths: list[str],
+        labels: list[str],
+        target_folder: str,
+        subpaths: list[str] | None = None,
+        mode: str = TRANSFER_MOVE,
+        verify: bool = False,
+        resume_batch_id: str | None = None
+    ) -> ClassificationJob:
+        """
+        分類ジョブを作成してバックグラウンドで開始する
+
+        Raises:
+            FileNotFoundError: 対象フォルダが存在しない
+            ValueError: サブフォルダがラベルフォルダの外を指す、または再開するバッチが存在しない
+        """
+        resolve_target_folder(target_folder)
+        for subpath in subpaths or []:
+            validate_subpath(subpath)
+        if resume_batch_id is not None and (self._journal is None or self._journal.get(resume_batch_id) is None):
+            raise ValueError("再開するバッチが存在しません")
+        job = ClassificationJob(
+            image_paths, labels, target_folder, subpaths, mode, verify, resume_batch_id
+        )
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune_locked()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> ClassificationJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> ClassificationJob | None:
+        """
+        ジョブの中止を要求する
+
+        実行中の移動は完了させ、未着手のファイルは処理しない
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel_event.set()
+        if job.status == JOB_QUEUED:
+            job.status = JOB_CANCELLED
+        return job
+
+    def shutdown(self) -> None:
+        with self._lock:
+            for job in self._jobs.values():
+                job.cancel_event.set()
+        self._executor.shutdown(wait=True)
+
+    def _prune_locked(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self._max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    def _run(self, job: ClassificationJob) -> None:
+        if job.cancel_event.is_set():
+            job.status = JOB_CANCELLED
+            return
+        job.status = JOB_RUNNING
+        job.started_at = time.monotonic()
+        try:
+            job.moved_files, job.errors, job.batch_id = classify_batch(
+                job.image_paths,
+                job.labels,
+                job.target_folder,
+                registry=self._registry,
+                on_progress=job.record,
+                cancel_event=job.cancel_event,
+                journal=self._journal,
+                subpaths=job.subpaths,
+                mode=job.mode,
+                verify=job.verify,
+                resume_batch_id=job.resume_batch_id,
+            )
+            status = JOB_CANCELLED if job.done < job.total else JOB_COMPLETED
+            if self._on_finished is not None:
+                self._on_finished(job)
+        except Exception as e:
+            job.detail = str(e)
+            status = JOB_FAILED
+        # 終了後は入力を参照しないため、大きなジョブの入力リストを解放する
+        job.image_paths = job.labels = []
+        job.subpaths = None
+        job.nbytes = (
+            estimate_bytes(job.moved_files, len(job.moved_files))
+            + estimate_bytes(job.errors, len(job.errors))
+        )
+        job.finished_at = time.monotonic()
+        job.status = status
+        if self._budget is not None:
+            self._budget.enforce()
+
+    def memory_usage(self) -> int:
+        with self._lock:
+            return sum(job.nbytes for job in self._jobs.values() if job.finished)
+
+    def memory_entries(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.finished)
+
+    def oldest_use(self) -> float | None:
+        with self._lock:
+            finished = [job.finished_at for job in self._jobs.values() if job.finished]
+        # キャンセル待ちのジョブは finished_at がない
+        return min((at for at in finished if at is not None), default=None)
+
+    def evict_oldest(self) -> int:
+        """最も前に終了したジョブとその結果を破棄する"""
+        with self._lock:
+            candidates = [
+                job for job in self._jobs.values() if job.finished and job.finished_at is not None
+            ]
+            if not candidates:
+                return 0
+            job = min(candidates, key=lambda candidate: candidate.finished_at)
+            del self._jobs[job.job_id]
+        return job.nbytes
@@ -0,0 +1,801 @@
+"""Append-only write-ahead journal of file moves with crash recovery and undo/redo."""
+
+import errno
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from utils.classification import LabelFolderRegistry
+from utils.file_operations import create_placeholder, move_to_reserved
+from utils.memory import estimate_bytes
+from utils.transfer import TRANSFER_COPY, TRANSFER_MOVE, partial_path
+
+if TYPE_CHECKING:
+    from utils.memory import MemoryBudget
+
+DEFAULT_MAX_BATCHES = 1000
+DEFAULT_UNDO_WORKERS = 8
+# 移動予定をまとめて記録し、1回のfsyncでディスクに書き込む件数
+JOURNAL_CHUNK_SIZE = 256
+
+ENTRY_PENDING = "pending"
+ENTRY_MOVED = "moved"
+ENTRY_FAILED = "failed"
+ENTRY_UNDONE = "undone"
+# 取り消し・やり直しの予定を記録済みで、完了がまだ記録されていない
+ENTRY_UNDOING = "undoing"
+ENTRY_REDOING = "redoing"
+ENTRY_STATES = (ENTRY_PENDING, ENTRY_MOVED, ENTRY_FAILED, ENTRY_UNDONE, ENTRY_UNDOING, ENTRY_REDOING)
+
+
+class JournalEntry:
+    """One file move (or copy) recorded in the journal."""
+
+    __slots__ = ("source", "destination", "state", "mode")
+
+    def __init__(
+        self,
+        source: str,
+        destination: str,
+        state: str = ENTRY_PENDING,
+        mode: str = TRANSFER_MOVE
+    ):
+        self.source = source
+        self.destination = destination
+        self.state = state
+        self.mode = mode
+
+
+class JournalBatch:
+    """A group of moves made by one classification request."""
+
+    def __init__(
+        self,
+        journal: "MoveJournal",
+        batch_id: str,
+        target_folder: str,
+        created_at: float,
+        offset: int = 0
+    ):
+        self.journal = journal
+        self.batch_id = batch_id
+        self.target_folder = target_folder
+        self.created_at = created_at
+        self.committed = False
+        # 終了したバッチのエントリはメモリから追い出すことがあり、その間はNone
+        self.entries: list[JournalEntry] | None = []
+        # 移動済みのエントリの 移動元 -> 移動先（バッチを再開したときの照合用）
+        self.moved: dict[str, str] = {}
+        # ジャーナルファイル内の begin 記録の位置（追い出したエントリはここから読み直す）
+        self.offset = offset
+        self.last_used = time.monotonic()
+        # エントリを追い出したときの状態ごとの件数
+        self._counts: dict[str, int] = {}
+
+    def intent(self, source: Path, destination: Path, mode: str = TRANSFER_MOVE) -> int:
+        """
+        移動の前に移動予定を記録し、ディスクに書き込まれるまで待つ
+
+        複数スレッドからの記録は1回のfsyncにまとめられる
+
+        Returns:
+            エントリ番号
+        """
+        return self.intents([(source, destination, mode)])[0]
+
+    def intents(self, moves: list[tuple[Path, Path, str]]) -> list[int]:
+        """
+        複数の移動予定をまとめて記録し、1回のfsyncでディスクに書き込む
+
+        Args:
+            moves: (移動元, 予約済みの移動先, モード) のリスト
+
+        Returns:
+            各移動のエントリ番号
+        """
+        return self.journal._intents(
+            self, [(str(source), str(destination), mode) for source, destination, mode in moves]
+        )
+
+    def done(self, seq: int) -> None:
+        """移動完了を記録する（fsyncはcommit時にまとめて行う）"""
+        self.journal._set_state(self, seq, ENTRY_MOVED, {"op": "done"})
+
+    def failed(self, seq: int) -> None:
+        """移動失敗を記録する"""
+        self.journal._set_state(self, seq, ENTRY_FAILED, {"op": "failed"})
+
+    def commit(self) -> None:
+        """バッチの終了を記録してディスクに書き込む"""
+        self.journal._commit(self)
+
+    def reopen(self) -> None:
+        """中断・キャンセルしたバッチに続きの移動を記録できるようにする"""
+        self.journal._reopen(self)
+
+    def moved_destination(self, source: str) -> str | None:
+        """移動元がこのバッチで移動済みなら移動先を返す"""
+        return self.journal._moved_destination(self, source)
+
+    def counts(self) -> dict[str, int]:
+        """状態ごとのエントリ数と総数（total）。エントリを追い出していても返せる"""
+        if self.entries is None:
+            return self._counts
+        counts = dict.fromkeys(ENTRY_STATES, 0)
+        for entry in self.entries:
+            counts[entry.state] += 1
+        counts["total"] = len(self.entries)
+        return counts
+
+    def summary(self) -> dict:
+        counts = self.counts()
+        return {
+            "batch_id": self.batch_id,
+            "target_folder": self.target_folder,
+            "created_at": self.created_at,
+            "committed": self.committed,
+            "total": counts["total"],
+            "moved": counts[ENTRY_MOVED],
+            "failed": counts[ENTRY_FAILED],
+            "undone": counts[ENTRY_UNDONE],
+        }
+
+
+class MoveJournal:
+    """Write-ahead journal of file moves stored as JSON lines.
+
+    Each move is logged as an intent (with its reserved destination) before
+    it happens and as done/failed afterwards. Intents are written a chunk
+    at a time and fsynced with group commit: concurrent writers share a
+    single fsync. Undo and redo reopen the batch and log their own intents
+    the same way, so on startup every batch left unfinished by a crash,
+    including an interrupted undo or redo, is reconciled with the file system.
+
+    Only batch summaries are kept for committed batches: their entries are
+    dropped at startup and, when the shared memory budget is exceeded,
+    least recently used first. They are read back from the journal file,
+    starting at the batch's begin record, when an undo or redo needs them.
+    """
+
+    def __init__(
+        self,
+        journal_path: Path,
+        max_batches: int = DEFAULT_MAX_BATCHES,
+        budget: "MemoryBudget | None" = None
+    ):
+        self.journal_path = journal_path
+        self.max_batches = max_batches
+        self._budget = budget
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._batches: OrderedDict[str, JournalBatch] = OrderedDict()
+        self._by_destination: dict[str, tuple[JournalBatch, int]] = {}
+        self._written = 0
+        self._synced = 0
+        self.recovered = 0
+        self.reloads = 0
+
+        self._load()
+        if len(self._batches) > self.max_batches:
+            self._compact()
+        self._file = open(self.journal_path, "ab")
+        if self._file.tell() > 0:
+            with open(self.journal_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # 途中で切れた最終行に次の記録が連結されないよう改行で区切る
+                    self._file.write(b"\n")
+        self._recover()
+        with self._lock:
+            for batch in self._batches.values():
+                if batch.committed and batch.entries:
+                    self._unload_locked(batch)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def memory_usage(self) -> int:
+        """メモリ上のエントリのおおよそのバイト数（追い出したバッチの概要は含めない）"""
+        with self._lock:
+            batches = [batch for batch in self._batches.values() if batch.entries is not None]
+            count = sum(len(batch.entries) for batch in batches)
+            entry_bytes = estimate_bytes(chain.from_iterable(batch.entries for batch in batches), count)
+            # 移動元・移動先の文字列はエントリと共有されるため、索引は辞書自体の大きさのみ数える
+            index_bytes = sys.getsizeof(self._by_destination) + sum(
+                sys.getsizeof(batch.moved) for batch in batches
+            )
+        return entry_bytes + index_bytes
+
+    def memory_entries(self) -> int:
+        with self._lock:
+            return sum(len(batch.entries or ()) for batch in self._batches.values())
+
+    def oldest_use(self) -> float | None:
+        with self._lock:
+            uses = [batch.last_used for batch in self._batches.values() if self._evictable_locked(batch)]
+        return min(uses, default=None)
+
+    def evict_oldest(self) -> int:
+        """最も長く使われていない終了済みバッチのエントリをメモリから破棄する"""
+        with self._lock:
+            candidates = [batch for batch in self._batches.values() if self._evictable_locked(batch)]
+            if not candidates:
+                return 0
+            return self._unload_locked(min(candidates, key=lambda batch: batch.last_used))
+
+    @staticmethod
+    def _evictable_locked(batch: JournalBatch) -> bool:
+        # 処理中（未終了）のバッチは追い出さない
+        return batch.committed and bool(batch.entries)
+
+    def _unload_locked(self, batch: JournalBatch) -> int:
+        nbytes = estimate_bytes(batch.entries, len(batch.entries)) + sys.getsizeof(batch.moved)
+        counts = batch.counts()
+        self._forget_locked(batch)
+        batch._counts = counts
+        batch.entries = None
+        batch.moved = {}
+        return nbytes
+
+    def _entries_locked(self, batch: JournalBatch) -> list[JournalEntry]:
+        """バッチのエントリを返す（追い出していればジャーナルファイルから読み直す）"""
+        if batch.entries is None:
+            self._reload_locked(batch)
+        batch.last_used = time.monotonic()
+        return batch.entries
+
+    def _reload_locked(self, batch: JournalBatch) -> None:
+        self._file.flush()
+        batch.entries = []
+        batch.moved = {}
+        # バッチIDを含まない行は解析せずに読み飛ばす
+        marker = batch.batch_id.encode("ascii")
+        with open(self.journal_path, "rb") as f:
+            f.seek(batch.offset)
+            for line in f:
+                if marker not in line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("batch") == batch.batch_id:
+                    self._apply(batch, record)
+        self.reloads += 1
+
+    def _moved_destination(self, batch: JournalBatch, source: str) -> str | None:
+        with self._lock:
+            self._entries_locked(batch)
+            return batch.moved.get(source)
+
+    # --- 書き込み ---------------------------------------------------------
+
+    def _append_locked(self, record: dict) -> int:
+        self._file.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        self._written += 1
+        return self._written
+
+    def _sync(self, position: int) -> None:
+        """position 番目までの記録がディスクに書き込まれたことを保証する"""
+        with self._sync_lock:
+            if self._synced >= position:
+                # 他のスレッドのfsyncで書き込み済み
+                return
+            with self._lock:
+                self._file.flush()
+                target = self._written
+            os.fsync(self._file.fileno())
+            self._synced = target
+
+    def begin(self, target_folder: str) -> JournalBatch:
+        """新しいバッチを開始する"""
+        with self._lock:
+            batch = JournalBatch(self, uuid.uuid4().hex, target_folder, time.time(), self._file.tell())
+            self._append_locked({
+                "op": "begin", "batch": batch.batch_id,
+                "target": target_folder, "time": batch.created_at,
+            })
+            self._batches[batch.batch_id] = batch
+            while len(self._batches) > self.max_batches:
+                _, dropped = self._batches.popitem(last=False)
+                self._forget_locked(dropped)
+        return batch
+
+    def _intents(self, batch: JournalBatch, moves: list[tuple[str, str, str]]) -> list[int]:
+        if not moves:
+            return []
+        with self._lock:
+            entries = self._entries_locked(batch)
+            start = len(entries)
+            for seq, (source, destination, mode) in enumerate(moves, start):
+                entries.append(JournalEntry(source, destination, mode=mode))
+                record = {
+                    "op": "intent", "batch": batch.batch_id, "seq": seq,
+                    "src": source, "dst": destination,
+                }
+                if mode != TRANSFER_MOVE:
+                    record["mode"] = mode
+                position = self._append_locked(record)
+        self._sync(position)
+        return list(range(start, start + len(moves)))
+
+    def _plan(self, batch: JournalBatch, state: str, targets: list[tuple[int, str]]) -> None:
+        """取り消し（ENTRY_UNDOING）・やり直し（ENTRY_REDOING）の予定をまとめて記録し、ディスクに書き込む"""
+        if not targets:
+            return
+        op = "undo_intent" if state == ENTRY_UNDOING else "redo_intent"
+        with self._lock:
+            entries = self._entries_locked(batch)
+            for seq, destination in targets:
+                entry = entries[seq]
+                if entry.state == ENTRY_MOVED:
+                    self._by_destination.pop(entry.destination, None)
+                entry.state = state
+                entry.destination = destination
+                self._track_moved_locked(batch, entry)
+                position = self._append_locked({
+                    "op": op, "batch": batch.batch_id, "seq": seq, "dst": destination,
+                })
+        self._sync(position)
+
+    def _set_state(self, batch: JournalBatch, seq: int, state: str, record: dict) -> None:
+        with self._lock:
+            entry = self._entries_locked(batch)[seq]
+            entry.state = state
+            self._track_moved_locked(batch, entry)
+            if state == ENTRY_MOVED:
+                self._by_destination[entry.destination] = (batch, seq)
+            else:
+                self._by_destination.pop(entry.destination, None)
+            self._append_locked({**record, "batch": batch.batch_id, "seq": seq})
+
+    def _commit(self, batch: JournalBatch) -> None:
+        with self._lock:
+            batch.committed = True
+            position = self._append_locked({"op": "commit", "batch": batch.batch_id})
+        self._sync(position)
+        if self._budget is not None:
+            self._budget.enforce()
+
+    def _reopen(self, batch: JournalBatch) -> None:
+        with self._lock:
+            position = self._reopen_locked(batch)
+        self._sync(position)
+
+    def _reopen_locked(self, batch: JournalBatch) -> int:
+        # 終了済みでなくなったバッチのエントリは追い出されない
+        self._entries_locked(batch)
+        batch.committed = False
+        return self._append_locked({"op": "reopen", "batch": batch.batch_id})
+
+    @staticmethod
+    def _track_moved_locked(batch: JournalBatch, entry: JournalEntry) -> None:
+        if entry.state == ENTRY_MOVED:
+            batch.moved[entry.source] = entry.destination
+        elif batch.moved.get(entry.source) == entry.destination:
+            del batch.moved[entry.source]
+
+    def _forget_locked(self, batch: JournalBatch) -> None:
+        for entry in batch.entries or ():
+            current = self._by_destination.get(entry.destination)
+            if current is not None and current[0] is batch:
+                del self._by_destination[entry.destination]
+
+    # --- 読み込みと復旧 ---------------------------------------------------
+
+    def _load(self) -> None:
+        if not self.journal_path.exists():
+            return
+        with open(self.journal_path, "rb") as f:
+            offset = 0
+            for line in f:
+                start, offset = offset, offset + len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # クラッシュで途中までしか書かれなかった最終行
+                    continue
+                self._replay(record, start)
+
+    def _replay(self, record: dict, offset: int) -> None:
+        if record.get("op") == "begin":
+            self._batches[record["batch"]] = JournalBatch(
+                self, record["batch"], record.get("target", ""), record.get("time", 0.0), offset
+            )
+            return
+        batch = self._batches.get(record.get("batch"))
+        if batch is not None:
+            self._apply(batch, record)
+
+    def _apply(self, batch: JournalBatch, record: dict) -> None:
+        """バッチの記録1件をメモリ上のエントリに反映する（begin 以外）"""
+        op = record.get("op")
+        if op == "intent":
+            batch.entries.append(
+                JournalEntry(record["src"], record["dst"], mode=record.get("mode", TRANSFER_MOVE))
+            )
+        elif op == "commit":
+            batch.committed = True
+        elif op == "reopen":
+            batch.committed = False
+        elif 0 <= record.get("seq", -1) < len(batch.entries):
+            entry = batch.entries[record["seq"]]
+            if op in ("done", "redone"):
+                entry.state = ENTRY_MOVED
+                entry.destination = record.get("dst", entry.destination)
+            elif op == "failed":
+                entry.state = ENTRY_FAILED
+            elif op == "undone":
+                entry.state = ENTRY_UNDONE
+            elif op == "undo_intent":
+                entry.state = ENTRY_UNDOING
+            elif op == "redo_intent":
+                entry.state = ENTRY_REDOING
+                entry.destination = record.get("dst", entry.destination)
+            elif op in ("recovered", "aborted"):
+                entry.state = record["state"]
+            self._track_moved_locked(batch, entry)
+            if entry.state == ENTRY_MOVED:
+                self._by_destination[entry.destination] = (batch, record["seq"])
+            elif self._by_destination.get(entry.destination, (None,))[0] is batch:
+                del self._by_destination[entry.destination]
+
+    def _compact(self) -> None:
+        """古いバッチを捨て、残すバッチの現在の状態だけでジャーナルを書き直す"""
+        while len(self._batches) > self.max_batches:
+            _, dropped = self._batches.popitem(last=False)
+            self._forget_locked(dropped)
+
+        tmp_path = self.journal_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            for batch in self._batches.values():
+                batch.offset = f.tell()
+                records = [{
+                    "op": "begin", "batch": batch.batch_id,
+                    "target": batch.target_folder, "time": batch.created_at,
+                }]
+                for seq, entry in enumerate(batch.entries):
+                    intent = {
+                        "op": "intent", "batch": batch.batch_id, "seq": seq,
+                        "src": entry.source, "dst": entry.destination,
+                    }
+                    if entry.mode != TRANSFER_MOVE:
+                        intent["mode"] = entry.mode
+                    records.append(intent)
+                    if entry.state != ENTRY_PENDING:
+                        records.append({
+                            "op": "recovered", "batch": batch.batch_id, "seq": seq,
+                            "state": entry.state,
+                        })
+                if batch.committed:
+                    records.append({"op": "commit", "batch": batch.batch_id})
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    def _recover(self) -> None:
+        """
+        前回異常終了したバッチの移動予定をファイルシステムの状態と突き合わせる
+
+        移動（やり直しを含む）の予定:
+
+        - 移動元がなく移動先がある: 移動済み
+        - 移動元が残っている: 未移動。予約用の空ファイルや途中までのコピーは削除する
+        - コピーの場合: 移動先が元ファイルと同じサイズなら完了、それ以外は未完了
+
+        取り消しの予定（元の場所は予約してから記録しているため、そこにあるのはこのバッチのファイル）:
+
+        - 元の場所がなく移動先がある: 未取り消し
+        - 元の場所が空の予約ファイル: 未取り消し。予約ファイルは削除する
+        - 元の場所に移動先と同じサイズのファイルがある: 取り消し済み（残った移動先は削除する）
+        - 移動先がなく元の場所にある: 取り消し済み
+
+        デバイスをまたぐ移動・コピーで残った一時ファイルも削除する
+        """
+        unfinished = [batch for batch in self._batches.values() if not batch.committed]
+        if not unfinished:
+            return
+        for batch in unfinished:
+            for seq, entry in enumerate(batch.entries):
+                if entry.state in (ENTRY_PENDING, ENTRY_REDOING):
+                    state = self._reconcile_move(entry)
+                elif entry.state == ENTRY_UNDOING:
+                    state = self._reconcile_undo(entry)
+                else:
+                    continue
+                self._set_state(batch, seq, state, {"op": "recovered", "state": state})
+                self.recovered += 1
+            self._commit(batch)
+
+    @staticmethod
+    def _reconcile_move(entry: JournalEntry) -> str:
+        # やり直しが完了しなかった場合は取り消した状態に戻す
+        not_moved = ENTRY_UNDONE if entry.state == ENTRY_REDOING else ENTRY_FAILED
+        source = Path(entry.source)
+        destination = Path(entry.destination)
+        try:
+            os.unlink(partial_path(destination))
+        except OSError:
+            pass
+        if entry.mode == TRANSFER_COPY and source.exists():
+            # コピーは一時ファイルから置き換えるため、移動先は予約ファイルか完成したコピー
+            try:
+                complete = destination.stat().st_size == source.stat().st_size
+            except FileNotFoundError:
+                complete = False
+            if not complete:
+                try:
+                    os.unlink(destination)
+                except FileNotFoundError:
+                    pass
+            return ENTRY_MOVED if complete else not_moved
+        if source.exists():
+            # 移動先は O_EXCL で予約したこのバッチのファイルなので、
+            # 元ファイル以下のサイズ（空の予約ファイルか途中までのコピー）なら削除してよい
+            try:
+                if destination.stat().st_size <= source.stat().st_size:
+                    os.unlink(destination)
+            except FileNotFoundError:
+                pass
+            return not_moved
+        if destination.exists():
+            return ENTRY_MOVED
+        return ENTRY_FAILED
+
+    @staticmethod
+    def _reconcile_undo(entry: JournalEntry) -> str:
+        original = Path(entry.source)
+        current = Path(entry.destination)
+        try:
+            os.unlink(partial_path(original))
+        except OSError:
+            pass
+        try:
+            original_size = original.stat().st_size
+        except FileNotFoundError:
+            original_size = None
+        try:
+            current_size = current.stat().st_size
+        except FileNotFoundError:
+            current_size = None
+        if current_size is None:
+            return ENTRY_FAILED if original_size is None else ENTRY_UNDONE
+        if original_size is None:
+            return ENTRY_MOVED
+        if original_size == 0 and current_size > 0:
+            try:
+                os.unlink(original)
+            except OSError:
+                pass
+            return ENTRY_MOVED
+        if original_size == current_size:
+            # デバイスをまたぐ復元で、コピー後に移動先を削除する前に落ちた（コピーの取り消しも同じ）
+            try:
+                os.unlink(current)
+            except OSError:
+                return ENTRY_MOVED
+            return ENTRY_UNDONE
+        # どちらとも判断できない場合はファイルを消さずに残す
+        return ENTRY_MOVED
+
+    # --- 取り消しとやり直し -----------------------------------------------
+
+    def list_batches(self, limit: int = 50) -> list[dict]:
+        """新しい順にバッチの概要を返す（移動予定のないバッチは除く。エントリは読み直さない）"""
+        with self._lock:
+            summaries = [batch.summary() for batch in self._batches.values()]
+        summaries = [summary for summary in summaries if summary["total"]]
+        return list(reversed(summaries[-limit:]))
+
+    def get(self, batch_id: str) -> JournalBatch | None:
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def undo(
+        self,
+        batch_id: str,
+        max_workers: int = DEFAULT_UNDO_WORKERS,
+        errors: list[dict[str, str]] | None = None
+    ) -> list[dict[str, str]] | None:
+        """
+        バッチの移動をすべて元に戻す
+
+        バッチを開き直し、JOURNAL_CHUNK_SIZE 件ごとに元の場所を予約してから
+        取り消しの予定を1回のfsyncで記録し、その後で戻す。
+        元の場所に別のファイルが作られている場合は上書きせず、そのファイルは戻さない
+
+        Args:
+            batch_id: バッチID
+            max_workers: 並列に戻す最大数
+            errors: 指定した場合は戻せなかったファイル（source・destination・detail）を追加する
+
+        Returns:
+            復元情報辞書のリスト。バッチが存在しない場合はNone
+        """
+        batch = self.get(batch_id)
+        if batch is None:
+            return None
+        with self._lock:
+            targets = [
+                (seq, entry.source, entry.destination, entry.mode)
+                for seq, entry in enumerate(self._entries_locked(batch))
+                if entry.state == ENTRY_MOVED
+            ]
+            # 読み直したエントリが処理中に追い出されないよう、同じロック内でバッチを開き直す
+            position = self._reopen_locked(batch) if targets else 0
+
+        def report(source: str, destination: str, error: OSError) -> None:
+            if errors is not None:
+                errors.append({
+                    "source": destination, "destination": source,
+                    "detail": error.strerror or str(error),
+                })
+
+        def reserve_one(target: tuple[int, str, str, str]) -> tuple[int, str, str, bool] | None:
+            seq, source, destination, mode = target
+            if not Path(destination).exists() or not Path(source).parent.exists():
+                return None
+            if mode == TRANSFER_COPY and Path(source).exists():
+                # 元ファイルが残っているコピーはコピーを削除するだけでよい
+                return seq, source, destination, False
+            try:
+                if not create_placeholder(Path(source)):
+                    raise FileExistsError(errno.EEXIST, "元の場所に同名のファイルが存在します", source)
+            except OSError as e:
+                report(source, destination, e)
+                return None
+            return seq, source, destination, True
+
+        def restore_one(target: tuple[int, str, str, bool]) -> dict[str, str] | None:
+            seq, source, destination, reserved = target
+            try:
+                if reserved:
+                    move_to_reserved(Path(destination), Path(source))
+                else:
+                    os.unlink(destination)
+            except OSError as e:
+                report(source, destination, e)
+                self._set_state(batch, seq, ENTRY_MOVED, {"op": "aborted", "state": ENTRY_MOVED})
+                return None
+            self._set_state(batch, seq, ENTRY_UNDONE, {"op": "undone"})
+            return {"from": destination, "to": source}
+
+        if not targets:
+            return []
+        restored = []
+        self._sync(position)
+        try:
+            for start in range(0, len(targets), JOURNAL_CHUNK_SIZE):
+                chunk = self._run_parallel(reserve_one, targets[start:start + JOURNAL_CHUNK_SIZE], max_workers)
+                self._plan(batch, ENTRY_UNDOING, [(seq, destination) for seq, _, destination, _ in chunk])
+                restored.extend(self._run_parallel(restore_one, chunk, max_workers))
+        finally:
+            self._commit(batch)
+        return restored
+
+    def redo(
+        self,
+        batch_id: str,
+        max_workers: int = DEFAULT_UNDO_WORKERS,
+        registry: LabelFolderRegistry | None = None
+    ) -> list[dict[str, str]] | None:
+        """
+        取り消したバッチの移動をやり直す
+
+        取り消しと同じく、移動先を予約してからやり直しの予定を記録し、その後で移動する。
+        元の移動先が使われている場合は同じラベルフォルダ内の別名に移動する
+
+        Args:
+            batch_id: バッチID
+            max_workers: 並列に移動する最大数
+            registry: ラベルフォルダ名の索引（省略時はこの呼び出し限り）
+
+        Returns:
+            移動情報辞書のリスト。バッチが存在しない場合はNone
+        """
+        batch = self.get(batch_id)
+        if batch is None:
+            return None
+        if registry is None:
+            registry = LabelFolderRegistry()
+        with self._lock:
+            targets = [
+                (seq, entry.source, entry.destination, entry.mode)
+                for seq, entry in enumerate(self._entries_locked(batch))
+                if entry.state == ENTRY_UNDONE
+            ]
+            position = self._reopen_locked(batch) if targets else 0
+
+        def reserve_one(target: tuple[int, str, str, str]) -> tuple[int, str, str, str] | None:
+            seq, source, destination, mode = target
+            destination_path = Path(destination)
+            if not Path(source).exists() or not destination_path.parent.exists():
+                return None
+            try:
+                reserved = registry.get(destination_path.parent).reserve(destination_path.name)
+            except OSError:
+                return None
+            return seq, source, str(reserved), mode
+
+        def move_one(target: tuple[int, str, str, str]) -> dict[str, str] | None:
+            seq, source, destination, mode = target
+            try:
+                move_to_reserved(Path(source), Path(destination), mode)
+            except OSError:
+                self._set_state(batch, seq, ENTRY_UNDONE, {"op": "aborted", "state": ENTRY_UNDONE})
+                return None
+            self._set_state(batch, seq, ENTRY_MOVED, {"op": "redone", "dst": destination})
+            return {"source": source, "destination": destination}
+
+        if not targets:
+            return []
+        moved = []
+        self._sync(position)
+        try:
+            for start in range(0, len(targets), JOURNAL_CHUNK_SIZE):
+                chunk = self._run_parallel(reserve_one, targets[start:start + JOURNAL_CHUNK_SIZE], max_workers)
+                self._plan(batch, ENTRY_REDOING, [(seq, destination) for seq, _, destination, _ in chunk])
+                moved.extend(self._run_parallel(move_one, chunk, max_workers))
+        finally:
+            self._commit(batch)
+        return moved
+
+    def mark_undone(self, destination: str) -> None:
+        """クライアントから送られた移動情報で戻したファイルを記録する"""
+        with self._lock:
+            found = self._by_destination.get(destination)
+            if found is None:
+                found = self._find_unloaded_locked(destination)
+        if found is not None:
+            batch, seq = found
+            self._set_state(batch, seq, ENTRY_UNDONE, {"op": "undone"})
+
+    def _find_unloaded_locked(self, destination: str) -> tuple[JournalBatch, int] | None:
+        # 索引にはメモリ上のバッチしかないため、追い出したバッチの記録から移動先を探して読み直す
+        unloaded = {batch.batch_id: batch for batch in self._batches.values() if batch.entries is None}
+        if not unloaded:
+            return None
+        self._file.flush()
+        marker = json.dumps(destination, ensure_ascii=False)[1:-1].encode("utf-8")
+        found = []
+        with open(self.journal_path, "rb") as f:
+            f.seek(min(batch.offset for batch in unloaded.values()))
+            for line in f:
+                if marker not in line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                batch = unloaded.get(record.get("batch"))
+                if batch is not None and record.get("dst") == destination and batch not in found:
+                    found.append(batch)
+        for batch in found:
+            self._entries_locked(batch)
+        return self._by_destination.get(destination)
+
+    def flush(self) -> None:
+        """バッファ中の記録をディスクに書き込む"""
+        with self._lock:
+            position = self._written
+        self._sync(position)
+
+    @staticmethod
+    def _run_parallel(func, targets: list, max_workers: int) -> list:
+        if not targets:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(targets))) as executor:
+            return [result for result in executor.map(func, targets) if result is not None]
@@ -0,0 +1,369 @@
+"""Append-only label manifests (JSONL, CSV or Parquet) with tombstones.
+
+In manifest mode the classify pipeline records ``path -> label`` instead
+of moving files. Undo appends tombstones rather than rewriting the file,
+and the effective labels (latest record per path, minus tombstoned ones)
+can later be materialised as one bulk classification job.
+"""
+
+import csv
+import importlib.util
+import json
+import os
+import threading
+import time
+import uuid
+from itertools import repeat
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, NamedTuple
+
+from utils.dataset import validate_subpath
+from utils.encoding import resolve_paths
+from utils.file_operations import SUPPORTED_EXTENSIONS
+from utils.metrics import METRICS
+
+if TYPE_CHECKING:
+    from utils.folder_index import FolderIndex
+
+OP_LABEL = "label"
+OP_TOMBSTONE = "tombstone"
+MANIFEST_FIELDS = ("op", "batch", "time", "path", "label", "subpath", "dhash", "width", "height")
+MANIFEST_FORMATS = {".jsonl": "jsonl", ".csv": "csv", ".parquet": "parquet"}
+DEFAULT_MANIFEST_NAME = "labels.jsonl"
+WRITE_BUFFER_SIZE = 1024 * 1024
+# Parquetはこの行数がたまるごとに1つのパートファイルとして書き出す
+PARQUET_BATCH_ROWS = 50_000
+
+
+def manifest_format(manifest_path: Path) -> str:
+    """
+    拡張子からマニフェストの形式を決める
+
+    Raises:
+        ValueError: 対応していない拡張子、またはParquetで pyarrow がない
+    """
+    fmt = MANIFEST_FORMATS.get(manifest_path.suffix.lower())
+    if fmt is None:
+        raise ValueError(f"対応していないマニフェスト形式です: {manifest_path.name}")
+    if fmt == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise ValueError("Parquet形式のマニフェストには pyarrow が必要です")
+    return fmt
+
+
+def _parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("op", pa.string()), ("batch", pa.string()), ("time", pa.float64()),
+        ("path", pa.string()), ("label", pa.string()), ("subpath", pa.string()),
+        ("dhash", pa.string()), ("width", pa.int64()), ("height", pa.int64()),
+    ])
+
+
+def _csv_value(field: str, value: str):
+    if value == "":
+        return None
+    if field in ("width", "height"):
+        return int(value)
+    if field == "time":
+        return float(value)
+    return value
+
+
+def _valid_record(record: dict) -> bool:
+    # op のない行は path と label を持つラベルファイルの行として扱う
+    op = record["op"] = record.get("op") or OP_LABEL
+    if op == OP_LABEL:
+        return bool(record.get("path")) and bool(record.get("label"))
+    return op == OP_TOMBSTONE
+
+
+def read_manifest(manifest_path: Path) -> Iterator[dict]:
+    """
+    マニフェストの記録を書き込み順に返す
+
+    op 列のない path・label（・subpath）だけのファイルもラベルの記録として読める。
+    異常終了で途中までしか書かれなかった行は読み飛ばす
+
+    Args:
+        manifest_path: マニフェストのパス（Parquetはパートファイルのフォルダ）
+
+    Returns:
+        記録の辞書のイテレータ
+    """
+    fmt = manifest_format(manifest_path)
+    if not manifest_path.exists():
+        return
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        for part in sorted(manifest_path.glob("part-*.parquet")):
+            yield from pq.read_table(part).to_pylist()
+        return
+
+    with open(manifest_path, "r", encoding="utf-8", newline="") as f:
+        if fmt == "jsonl":
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and _valid_record(record):
+                    yield record
+            return
+        for row in csv.DictReader(f):
+            if None in row.values():
+                continue
+            record = {field: _csv_value(field, row.get(field, "")) for field in MANIFEST_FIELDS}
+            if _valid_record(record):
+                yield record
+
+
+def effective_labels(records: Iterable[dict]) -> dict[str, dict]:
+    """
+    記録を順に適用し、取り消されていない各画像の最新のラベル記録を返す
+
+    - ラベル: 同じ画像の以前の記録を置き換える
+    - バッチの墓標: そのバッチが最新の記録である画像を取り消す
+    - 画像の墓標: その画像の記録を取り消す（バッチ指定があればそのバッチの記録のみ）
+
+    Args:
+        records: 書き込み順の記録
+
+    Returns:
+        画像パス -> ラベル記録（最初に記録された順）
+    """
+    current: dict[str, dict] = {}
+    paths_by_batch: dict[str, set[str]] = {}
+    for record in records:
+        path, batch = record.get("path"), record.get("batch")
+        if record["op"] == OP_LABEL:
+            current[path] = record
+            paths_by_batch.setdefault(batch, set()).add(path)
+        elif path:
+            if path in current and (batch is None or current[path].get("batch") == batch):
+                del current[path]
+        else:
+            for batch_path in paths_by_batch.pop(batch, ()):
+                if current.get(batch_path, {}).get("batch") == batch:
+                    del current[batch_path]
+    return current
+
+
+class LabelManifest:
+    """Buffered, incremental appender for one manifest.
+
+    JSONL and CSV records go through a large write buffer and are flushed
+    and fsynced once per batch. Parquet manifests are folders of part
+    files; rows are buffered and written as a new part every
+    PARQUET_BATCH_ROWS rows and on flush(), so a crash can lose rows that
+    were not yet written.
+    """
+
+    def __init__(self, manifest_path: Path):
+        self.manifest_path = manifest_path
+        self.format = manifest_format(manifest_path)
+        self._lock = threading.Lock()
+        self._file = None
+        self._writer = None
+        self._pending: list[dict] = []
+
+    def append(self, records: list[dict]) -> None:
+        """記録を追記する（JSONL・CSVはディスクまで書き込む）"""
+        with self._lock:
+            if self.format == "parquet":
+                self._pending.extend(records)
+                if len(self._pending) >= PARQUET_BATCH_ROWS:
+                    self._write_parquet_part_locked()
+                return
+            self._open_locked()
+            if self.format == "jsonl":
+                self._file.writelines(
+                    json.dumps(
+                        {key: value for key, value in record.items() if value is not None},
+                        ensure_ascii=False
+                    ) + "\n"
+                    for record in records
+                )
+            else:
+                self._writer.writerows(
+                    [record.get(field) for field in MANIFEST_FIELDS] for record in records
+                )
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def tombstone(self, batch_id: str | None = None, image_paths: list[str] | None = None) -> int:
+        """
+        バッチ全体、または指定した画像の記録を取り消す墓標を追記する
+
+        Args:
+            batch_id: 取り消すバッチ（image_paths と併用するとそのバッチの記録のみ）
+            image_paths: 取り消す画像パス
+
+        Returns:
+            追記した墓標の数
+
+        Raises:
+            ValueError: どちらも指定されていない
+        """
+        now = time.time()
+        if image_paths:
+            records = [
+                {"op": OP_TOMBSTONE, "batch": batch_id, "time": now, "path": resolved.path}
+                for resolved in resolve_paths(image_paths)
+            ]
+        elif batch_id is not None:
+            records = [{"op": OP_TOMBSTONE, "batch": batch_id, "time": now}]
+        else:
+            raise ValueError("取り消すバッチまたは画像を指定してください")
+        self.append(records)
+        return len(records)
+
+    def read(self) -> Iterator[dict]:
+        """書き込み待ちの記録を書き出してから、すべての記録を返す"""
+        self.flush()
+        return read_manifest(self.manifest_path)
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._pending:
+                self._write_parquet_part_locked()
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _open_locked(self) -> None:
+        if self._file is not None:
+            return
+        existed = self.manifest_path.exists() and self.manifest_path.stat().st_size > 0
+        if existed:
+            with open(self.manifest_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b"\n"
+        self._file = open(
+            self.manifest_path, "a", encoding="utf-8", newline="", buffering=WRITE_BUFFER_SIZE
+        )
+        if existed and torn:
+            # 途中で切れた最終行に次の記録が連結されないよう改行で区切る
+            self._file.write("\n")
+        if self.format == "csv":
+            self._writer = csv.writer(self._file, lineterminator="\n")
+            if not existed:
+                self._writer.writerow(MANIFEST_FIELDS)
+
+    def _write_parquet_part_locked(self) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.manifest_path.mkdir(exist_ok=True)
+        # 名前順が書き込み順になるよう時刻を先頭に付ける
+        name = f"part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.parquet"
+        temp_path = self.manifest_path / f".{name}.tmp"
+        rows = [{field: record.get(field) for field in MANIFEST_FIELDS} for record in self._pending]
+        pq.write_table(pa.Table.from_pylist(rows, schema=_parquet_schema()), temp_path)
+        os.replace(temp_path, self.manifest_path / name)
+        self._pending = []
+
+
+class ManifestRegistry:
+    """Open manifests shared across requests, one appender per file."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._manifests: dict[Path, LabelManifest] = {}
+
+    def get(self, manifest_path: Path) -> LabelManifest:
+        """
+        マニフェストの追記先を返す
+
+        Raises:
+            ValueError: 対応していない形式
+        """
+        with self._lock:
+            manifest = self._manifests.get(manifest_path)
+            if manifest is None:
+                manifest = self._manifests[manifest_path] = LabelManifest(manifest_path)
+            return manifest
+
+    def close(self) -> None:
+        with self._lock:
+            manifests = list(self._manifests.values())
+            self._manifests.clear()
+        for manifest in manifests:
+            manifest.close()
+
+
+class ManifestResult(NamedTuple):
+    """Outcome of record_labels."""
+
+    batch_id: str
+    recorded: int
+    errors: list[dict[str, str]]
+
+
+def record_labels(
+    manifest: LabelManifest,
+    image_paths: list[str],
+    labels: list[str],
+    subpaths: list[str] | None = None,
+    index: "FolderIndex | None" = None
+) -> ManifestResult:
+    """
+    ファイルを移動せず、画像のラベルを1バッチとしてマニフェストに追記する
+
+    知覚ハッシュと寸法はフォルダインデックスに記録済みの場合のみ含める
+    （ファイルを読み込まないため、NAS上でもディレクトリ走査やstatは発生しない）
+
+    Args:
+        manifest: 追記先
+        image_paths: 画像ファイルパスのリスト
+        labels: 各画像のラベル名
+        subpaths: 各画像のラベルフォルダ下の相対フォルダ
+        index: ハッシュと寸法を引くフォルダインデックス
+
+    Returns:
+        ManifestResult。エラー情報は入力順
+
+    Raises:
+        ValueError: サブフォルダがラベルフォルダの外を指す
+    """
+    if subpaths is not None:
+        subpaths = [validate_subpath(subpath) for subpath in subpaths]
+    batch_id = uuid.uuid4().hex
+    now = time.time()
+    known: dict[str, dict] = {}
+    records = []
+    errors = []
+    for image_path_str, resolved, label, subpath in zip(
+        image_paths, resolve_paths(image_paths), labels, subpaths or repeat(None)
+    ):
+        if os.path.splitext(resolved.name)[1].lower() not in SUPPORTED_EXTENSIONS:
+            errors.append({"source": image_path_str, "label": label, "detail": "対応していない画像形式です"})
+            continue
+        folder = os.path.dirname(resolved.path)
+        if folder not in known:
+            known[folder] = index.known_entries(Path(folder)) if index is not None else {}
+        entry = known[folder].get(resolved.name)
+        dhash = width = height = None
+        if entry is not None:
+            # 未取得（None）と読み込めなかった画像（0）はどちらも値なしとする
+            dhash, width, height = entry.dhash or None, entry.width or None, entry.height or None
+        records.append({
+            "op": OP_LABEL,
+            "batch": batch_id,
+            "time": now,
+            "path": resolved.path,
+            "label": label,
+            "subpath": subpath or None,
+            "dhash": dhash,
+            "width": width,
+            "height": height,
+        })
+
+    manifest.append(records)
+    METRICS.inc("labels_recorded_total", len(records))
+    return ManifestResult(batch_id, len(records), errors)
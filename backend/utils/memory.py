@@ -0,0 +1,196 @@
+"""Global memory budget shared by the backend's in-memory caches.
+
+Evictable caches register with a MemoryBudget and report their size. When
+the total exceeds the budget, entries are evicted across all of them in
+global least-recently-used order, so one cache cannot keep stale entries
+while another has to drop fresh ones. Consumers that must not lose entries
+can be registered as report-only so /debug/memory still shows them.
+"""
+
+import os
+import sys
+import threading
+import tracemalloc
+from itertools import islice
+from typing import Iterable, Protocol
+
+try:
+    # 任意。Windowsにはないため、その場合はプロセスのピークRSSを報告しない
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_MEMORY_BUDGET_BYTES = 256 * 1024 * 1024
+# 設定するとキャッシュ全体の上限をMB単位で変更する
+MEMORY_BUDGET_ENV = "IMAGE_SORTER_MEMORY_BUDGET_MB"
+# 同じ形の記録の大きさを見積もるときに実測する件数
+SIZE_SAMPLE = 64
+
+
+class MemoryConsumer(Protocol):
+    """Anything that can report how much memory it holds."""
+
+    def memory_usage(self) -> int: ...
+
+    def memory_entries(self) -> int: ...
+
+
+class EvictableCache(MemoryConsumer, Protocol):
+    """A cache whose entries the budget may drop, oldest first.
+
+    oldest_use() is the time.monotonic() of the least recently used
+    entry, or None when nothing can be evicted.
+    """
+
+    def oldest_use(self) -> float | None: ...
+
+    def evict_oldest(self) -> int: ...
+
+
+def _deep_size(value) -> int:
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(key) + sys.getsizeof(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(sys.getsizeof(item) for item in value)
+    elif hasattr(value, "__slots__"):
+        size += sum(sys.getsizeof(getattr(value, name, None)) for name in value.__slots__)
+    return size
+
+
+def estimate_bytes(records: Iterable, count: int) -> int:
+    """
+    同じ形の記録 count 件のおおよそのバイト数を、先頭 SIZE_SAMPLE 件の実測から見積もる
+
+    Args:
+        records: 記録（辞書・タプル・__slots__ を持つオブジェクトなど）
+        count: 記録の総数
+
+    Returns:
+        見積もったバイト数
+    """
+    sample = list(islice(records, SIZE_SAMPLE))
+    if not sample:
+        return 0
+    return sum(_deep_size(record) for record in sample) * count // len(sample)
+
+
+def budget_from_env() -> int:
+    """環境変数の指定、なければ既定値の予算（バイト）"""
+    value = os.environ.get(MEMORY_BUDGET_ENV)
+    if value:
+        return int(float(value) * 1024 * 1024)
+    return DEFAULT_MEMORY_BUDGET_BYTES
+
+
+def process_memory() -> dict[str, int | None]:
+    """
+    プロセスの使用メモリを返す
+
+    Returns:
+        rss_bytes（Linuxのみ）、peak_rss_bytes、tracemalloc 実行中の traced_bytes・traced_peak_bytes
+    """
+    rss = peak_rss = traced = traced_peak = None
+    try:
+        with open("/proc/self/statm", "r") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linuxはキロバイト単位、macOSはバイト単位
+        peak_rss = peak_rss if sys.platform == "darwin" else peak_rss * 1024
+    if tracemalloc.is_tracing():
+        traced, traced_peak = tracemalloc.get_traced_memory()
+    return {
+        "rss_bytes": rss,
+        "peak_rss_bytes": peak_rss,
+        "traced_bytes": traced,
+        "traced_peak_bytes": traced_peak,
+    }
+
+
+class MemoryBudget:
+    """Byte budget enforced across all registered evictable caches."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MEMORY_BUDGET_BYTES):
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._caches: dict[str, EvictableCache] = {}
+        self._reporters: dict[str, MemoryConsumer] = {}
+
+    def register(self, name: str, cache: EvictableCache) -> None:
+        """予算の対象とするキャッシュを登録する"""
+        with self._lock:
+            self._caches[name] = cache
+
+    def register_reporter(self, name: str, consumer: MemoryConsumer) -> None:
+        """追い出しはせず、使用量の報告だけを行う対象を登録する"""
+        with self._lock:
+            self._reporters[name] = consumer
+
+    def used_bytes(self) -> int:
+        with self._lock:
+            caches = list(self._caches.values())
+        return sum(cache.memory_usage() for cache in caches)
+
+    def enforce(self) -> int:
+        """
+        予算を超えている間、すべてのキャッシュの中で最も長く使われていないエントリから追い出す
+
+        他のスレッドが実行中の場合は何もしない（その実行が予算内に収める）
+
+        Returns:
+            解放したバイト数の見積もり
+        """
+        if not self._evict_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self._lock:
+                caches = list(self._caches.values())
+            used = sum(cache.memory_usage() for cache in caches)
+            freed = 0
+            while used > self.max_bytes:
+                candidates = [
+                    (oldest, cache) for cache in caches
+                    if (oldest := cache.oldest_use()) is not None
+                ]
+                if not candidates:
+                    break
+                _, cache = min(candidates, key=lambda candidate: candidate[0])
+                nbytes = cache.evict_oldest()
+                self.evictions += 1
+                used -= nbytes
+                freed += nbytes
+            return freed
+        finally:
+            self._evict_lock.release()
+
+    def report(self) -> dict:
+        """
+        予算と各キャッシュの使用量を返す
+
+        Returns:
+            MemoryReport 形式の辞書
+        """
+        with self._lock:
+            caches = dict(self._caches)
+            reporters = dict(self._reporters)
+        report = {}
+        for name, cache in caches.items():
+            report[name] = {
+                "bytes": cache.memory_usage(), "entries": cache.memory_entries(), "evictable": True
+            }
+        for name, consumer in reporters.items():
+            report[name] = {
+                "bytes": consumer.memory_usage(), "entries": consumer.memory_entries(), "evictable": False
+            }
+        return {
+            "budget_bytes": self.max_bytes,
+            "used_bytes": sum(cache["bytes"] for cache in report.values() if cache["evictable"]),
+            "evictions": self.evictions,
+            "caches": report,
+            **process_memory(),
+        }
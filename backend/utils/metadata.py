@@ -0,0 +1,216 @@
+"""Header-only image metadata extraction, filtering and sorting of listings."""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+from models import FolderRequest, ImageInfo
+from utils.folder_index import FolderIndex, IndexedEntry
+from utils.imaging import allow_large_images
+
+DEFAULT_METADATA_WORKERS = 8
+
+# EXIFタグ番号
+EXIF_IFD_POINTER = 0x8769
+EXIF_ORIENTATION = 0x0112
+EXIF_DATETIME = 0x0132
+EXIF_DATETIME_ORIGINAL = 0x9003
+# 90度回転して表示される向き（幅と高さを入れ替える）
+ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+# 画像の寸法が必要なソートキー・フィルタ
+METADATA_SORT_KEYS = {"width", "height", "pixels", "aspect_ratio", "taken_at"}
+METADATA_FILTERS = (
+    "min_width", "max_width", "min_height", "max_height",
+    "min_aspect_ratio", "max_aspect_ratio", "taken_after", "taken_before",
+)
+
+
+class ImageMetadata(NamedTuple):
+    """Dimensions as displayed and EXIF capture time of an image."""
+
+    width: int
+    height: int
+    taken_at: str | None = None
+
+
+def read_image_metadata(image_path: str) -> ImageMetadata:
+    """
+    画像ヘッダだけを読んでメタデータを取得する
+
+    Image.open は遅延読み込みで画素をデコードしないため、
+    ファイル先頭のヘッダ（JPEGはEXIFセグメントを含む）のみが読まれる
+
+    Args:
+        image_path: 画像ファイルパス
+
+    Returns:
+        ImageMetadata。読み込めない画像は幅・高さが0
+    """
+    # Pillowは起動時間を短くするため使用時に読み込む
+    from PIL import Image, UnidentifiedImageError
+
+    allow_large_images()
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+            exif = img.getexif()
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError, SyntaxError):
+        return ImageMetadata(0, 0)
+
+    if exif.get(EXIF_ORIENTATION) in ROTATED_ORIENTATIONS:
+        width, height = height, width
+
+    taken = exif.get_ifd(EXIF_IFD_POINTER).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+    return ImageMetadata(width, height, _exif_datetime_to_iso(taken))
+
+
+def _exif_datetime_to_iso(value) -> str | None:
+    # EXIFの日時は "YYYY:MM:DD HH:MM:SS" 形式
+    if not isinstance(value, str) or len(value) < 19:
+        return None
+    date, _, clock = value.strip("\x00 ").partition(" ")
+    if len(date) != 10 or not clock:
+        return None
+    return f"{date.replace(':', '-')}T{clock}"
+
+
+def needs_metadata(request: FolderRequest) -> bool:
+    """リクエストが画像ヘッダの読み込みを必要とするか判定する"""
+    return (
+        request.include_metadata
+        or request.sort_by in METADATA_SORT_KEYS
+        or any(getattr(request, name) is not None for name in METADATA_FILTERS)
+    )
+
+
+def needs_listing_options(request: FolderRequest) -> bool:
+    """リクエストにソート・フィルタ・メタデータの指定があるか判定する"""
+    return (
+        needs_metadata(request)
+        or request.sort_by is not None
+        or request.min_file_size is not None
+        or request.max_file_size is not None
+    )
+
+
+def _aspect_ratio(entry: IndexedEntry) -> float | None:
+    if not entry.width or not entry.height:
+        return None
+    return entry.width / entry.height
+
+
+def _in_range(value, low, high) -> bool:
+    if low is None and high is None:
+        return True
+    if value is None:
+        return False
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+def _sort_value(entry: IndexedEntry, sort_by: str):
+    if sort_by == "name":
+        return entry.filename
+    if sort_by == "size":
+        return entry.size
+    if sort_by == "modified":
+        return entry.mtime_ns
+    if sort_by == "pixels":
+        return entry.width * entry.height if entry.width else None
+    if sort_by == "aspect_ratio":
+        return _aspect_ratio(entry)
+    if sort_by == "taken_at":
+        return entry.taken_at
+    # 読み込めない画像（0）は値なしとして扱う
+    return getattr(entry, sort_by) or None
+
+
+class MetadataReader:
+    """Fills in missing image metadata of indexed folders on a thread pool."""
+
+    def __init__(self, index: FolderIndex, max_workers: int = DEFAULT_METADATA_WORKERS):
+        self._index = index
+        self._max_workers = max_workers
+
+    def folder_entries(self, folder_path: Path, with_metadata: bool = True) -> list[IndexedEntry]:
+        """
+        フォルダのインデックス済みエントリを返す（必要なら未取得のメタデータを読み込む）
+
+        ヘッダ読み込みはI/O待ちが主体のため、スレッドで並列に実行する
+
+        Args:
+            folder_path: 検証済みのフォルダパス
+            with_metadata: メタデータを揃えるか
+
+        Returns:
+            ファイル名順のIndexedEntryのリスト
+        """
+        entries = self._index.list_entries(folder_path)
+        if not with_metadata:
+            return entries
+
+        missing = [i for i, entry in enumerate(entries) if entry.width is None]
+        if not missing:
+            return entries
+
+        paths = [os.path.join(folder_path, entries[i].filename) for i in missing]
+        with ThreadPoolExecutor(max_workers=min(self._max_workers, len(paths))) as executor:
+            results = list(executor.map(read_image_metadata, paths))
+
+        for i, metadata in zip(missing, results):
+            entries[i] = entries[i]._replace(**metadata._asdict())
+        self._index.store_metadata(
+            folder_path,
+            [(entries[i].filename, *metadata) for i, metadata in zip(missing, results)],
+        )
+        return entries
+
+    def list_images(self, folder_path: Path, request: FolderRequest) -> list[ImageInfo]:
+        """
+        ソート・フィルタを適用した画像一覧を返す
+
+        Args:
+            folder_path: 検証済みのフォルダパス
+            request: ソート・フィルタ条件を含むリクエスト
+
+        Returns:
+            ImageInfoのリスト。include_metadata の場合はメタデータ項目を含む
+        """
+        entries = self.folder_entries(folder_path, with_metadata=needs_metadata(request))
+
+        entries = [
+            entry for entry in entries
+            if _in_range(entry.size, request.min_file_size, request.max_file_size)
+            and _in_range(entry.width or None, request.min_width, request.max_width)
+            and _in_range(entry.height or None, request.min_height, request.max_height)
+            and _in_range(_aspect_ratio(entry), request.min_aspect_ratio, request.max_aspect_ratio)
+            and _in_range(entry.taken_at, request.taken_after, request.taken_before)
+        ]
+
+        if request.sort_by is not None:
+            keyed = [(_sort_value(entry, request.sort_by), entry) for entry in entries]
+            # 値のない画像は昇順・降順のどちらでも末尾に置く
+            present = [item for item in keyed if item[0] is not None]
+            present.sort(key=lambda item: item[0], reverse=request.descending)
+            entries = [entry for _, entry in present]
+            entries.extend(entry for value, entry in keyed if value is None)
+
+        if not request.include_metadata:
+            return [
+                ImageInfo(path=os.path.join(folder_path, entry.filename), filename=entry.filename)
+                for entry in entries
+            ]
+        return [
+            ImageInfo(
+                path=os.path.join(folder_path, entry.filename),
+                filename=entry.filename,
+                size=entry.size,
+                modified_at=entry.mtime_ns / 1e9,
+                width=entry.width or None,
+                height=entry.height or None,
+                aspect_ratio=_aspect_ratio(entry),
+                taken_at=entry.taken_at,
+            )
+            for entry in entries
+        ]
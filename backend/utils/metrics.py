@@ -0,0 +1,216 @@
+"""Process-wide counters and timers exposed in Prometheus text format."""
+
+import asyncio
+import cProfile
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "image_sorter_"
+DEFAULT_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+PROFILE_HEADER = b"x-profile"
+
+# メトリクス名 -> (種類, 説明)
+METRIC_HELP = {
+    "http_requests_total": ("counter", "HTTP requests by route and status"),
+    "http_request_duration_seconds": ("histogram", "HTTP request duration including the streamed body"),
+    "classify_phase_seconds": ("histogram", "Time spent per phase of moving one file (decode: per batch)"),
+    "files_moved_total": ("counter", "Files moved into label folders"),
+    "bytes_moved_total": ("counter", "Bytes moved into label folders"),
+    "files_copied_total": ("counter", "Files copied into label folders in copy mode"),
+    "bytes_copied_total": ("counter", "Bytes copied into label folders in copy mode"),
+    "classify_errors_total": ("counter", "Files that could not be classified"),
+    "labels_recorded_total": ("counter", "Labels appended to manifests instead of moving files"),
+    "labels_learned_total": ("counter", "Classified images added to the label suggestion model"),
+    "thumbnail_render_seconds": ("histogram", "Time to decode, resize and write one thumbnail"),
+}
+
+
+class _Histogram:
+    __slots__ = ("bucket_counts", "total", "count")
+
+    def __init__(self, size: int):
+        self.bucket_counts = [0] * size
+        self.total = 0.0
+        self.count = 0
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{key}="{_escape_label_value(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class MetricsRegistry:
+    """Thread-safe counters and fixed-bucket histograms keyed by name and labels."""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._histograms: dict[str, dict[tuple, _Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """カウンタを加算する"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        """ヒストグラムに所要時間を記録する"""
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(len(self.buckets))
+            if index < len(self.buckets):
+                histogram.bucket_counts[index] += 1
+            histogram.total += seconds
+            histogram.count += 1
+
+    @contextmanager
+    def time(self, name: str, **labels: str) -> Iterator[None]:
+        """ブロックの所要時間をヒストグラムに記録する"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter_value(self, name: str, **labels: str) -> float:
+        """カウンタの現在値を返す（未記録は0）"""
+        with self._lock:
+            return self._counters.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def render(self, extra: Iterable[tuple[str, str, str, float]] = ()) -> str:
+        """
+        Prometheusのテキスト形式で出力する
+
+        Args:
+            extra: 呼び出し時点で値を読む追加の系列 (名前, 種類, 説明, 値)
+
+        Returns:
+            テキスト形式のメトリクス
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                full_name = METRIC_PREFIX + name
+                kind, help_text = METRIC_HELP.get(name, ("counter", name))
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{full_name}{_format_labels(labels)} {value:g}")
+
+            for name, series in sorted(self._histograms.items()):
+                full_name = METRIC_PREFIX + name
+                help_text = METRIC_HELP.get(name, ("histogram", name))[1]
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(self.buckets, histogram.bucket_counts):
+                        cumulative += count
+                        bucket_labels = _format_labels(labels, f'le="{bound:g}"')
+                        lines.append(f"{full_name}_bucket{bucket_labels} {cumulative}")
+                    inf_labels = _format_labels(labels, 'le="+Inf"')
+                    lines.append(f"{full_name}_bucket{inf_labels} {histogram.count}")
+                    lines.append(f"{full_name}_sum{_format_labels(labels)} {histogram.total:.6f}")
+                    lines.append(f"{full_name}_count{_format_labels(labels)} {histogram.count}")
+
+        for name, kind, help_text, value in extra:
+            full_name = METRIC_PREFIX + name
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            lines.append(f"{full_name} {value:g}")
+        lines.append("")
+        return "\n".join(lines)
+
+
+# プロセス全体で共有するレジストリ（utils内の処理からも直接記録する）
+METRICS = MetricsRegistry()
+
+
+class InstrumentationMiddleware:
+    """ASGI middleware that times every request and can profile single requests.
+
+    Requests sent with an ``X-Profile: 1`` header run under cProfile when
+    ``profile_dir`` is set; the stats are written to a ``.prof`` file whose
+    path is returned in the ``X-Profile-File`` response header. On Python
+    3.12+ cProfile also records the threadpool workers that sync handlers
+    run on. Profiled requests are serialised because only one profiler can
+    be active at a time.
+    """
+
+    def __init__(self, app, profile_dir: Path | None = None):
+        self.app = app
+        self.profile_dir = profile_dir
+        self._profile_lock = asyncio.Lock()
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+        profile_path: Path | None = None
+        if self.profile_dir is not None and dict(scope["headers"]).get(PROFILE_HEADER) == b"1":
+            route_name = scope["path"].strip("/").replace("/", "_") or "root"
+            profile_path = self.profile_dir / f"{time.time_ns()}-{route_name}.prof"
+
+        async def send_wrapper(message) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if profile_path is not None:
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"x-profile-file", str(profile_path).encode("utf-8", errors="replace")),
+                    ]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            if profile_path is None:
+                await self.app(scope, receive, send_wrapper)
+            else:
+                await self._profile(profile_path, scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            METRICS.observe(
+                "http_request_duration_seconds", time.perf_counter() - start,
+                method=scope["method"], route=route_path
+            )
+            METRICS.inc(
+                "http_requests_total",
+                method=scope["method"], route=route_path, status=str(status["code"])
+            )
+
+    async def _profile(self, profile_path: Path, scope, receive, send) -> None:
+        async with self._profile_lock:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                profiler.disable()
+                profile_path.parent.mkdir(parents=True, exist_ok=True)
+                profiler.dump_stats(profile_path)
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("profile written path=%s", profile_path)
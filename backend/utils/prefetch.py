@@ -0,0 +1,160 @@
+"""Background thumbnail pre-generation on a process pool."""
+
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from pathlib import Path
+
+from utils.thumbnails import ThumbnailCache, render_thumbnail
+
+
+class ThumbnailPrefetcher:
+    """Render thumbnails for upcoming pages across all cores in priority order.
+
+    Work is fed to the pool from a dispatcher thread with a bounded number
+    of in-flight tasks, so replacing or cancelling the queue takes effect
+    immediately instead of after the whole backlog has been decoded.
+    """
+
+    def __init__(self, cache: ThumbnailCache, max_workers: int | None = None):
+        self._cache = cache
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._max_in_flight = self._max_workers * 2
+        self._cond = threading.Condition()
+        self._pending: deque[tuple[Path, Path, int, str]] = deque()
+        self._in_flight: dict[Path, Future] = {}
+        self._executor: ProcessPoolExecutor | None = None
+        self._dispatcher: threading.Thread | None = None
+        self._closed = False
+        self.completed = 0
+        self.failed = 0
+
+    def _ensure_started(self) -> None:
+        if self._executor is None:
+            # spawnはWindows/PyInstaller環境と同じ挙動になり、スレッド併用下のforkも避けられる
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            self._dispatcher = threading.Thread(
+                target=self._dispatch_loop, name="thumbnail-prefetch", daemon=True
+            )
+            self._dispatcher.start()
+
+    def submit(self, image_paths: list[Path], size: int, fmt: str) -> int:
+        """
+        先読み対象を優先度順に登録する
+
+        未着手の先読みは新しいリストで置き換える（実行中のものは完了させる）
+
+        Args:
+            image_paths: 次に表示する順の画像パス
+            size: サムネイルの長辺ピクセル数
+            fmt: サムネイルフォーマット
+
+        Returns:
+            新たにキューに入った件数
+        """
+        jobs = []
+        for image_path in image_paths:
+            try:
+                cached_path = self._cache.path_for(image_path, size, fmt)
+            except OSError:
+                continue
+            if not self._cache.contains(cached_path):
+                jobs.append((image_path, cached_path, size, fmt))
+
+        with self._cond:
+            if self._closed:
+                return 0
+            self._pending.clear()
+            for job in jobs:
+                if job[1] not in self._in_flight:
+                    self._pending.append(job)
+            self._ensure_started()
+            self._cond.notify()
+            return len(self._pending)
+
+    def cancel(self) -> int:
+        """
+        未完了の先読みをすべて取り消す（フォルダ切り替え時に使用）
+
+        Returns:
+            取り消した件数
+        """
+        with self._cond:
+            cancelled = len(self._pending)
+            self._pending.clear()
+            for future in self._in_flight.values():
+                if future.cancel():
+                    cancelled += 1
+            return cancelled
+
+    def wait_for(self, cached_path: Path, timeout: float | None = None) -> None:
+        """指定サムネイルを生成中であれば完了まで待つ"""
+        with self._cond:
+            future = self._in_flight.get(cached_path)
+        if future is None:
+            return
+        try:
+            future.result(timeout=timeout)
+        except Exception:
+            # 呼び出し側が同期的に再生成してエラーを報告する
+            pass
+
+    def status(self) -> dict[str, int]:
+        """キューの状態を返す"""
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "in_flight": len(self._in_flight),
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+    def shutdown(self) -> None:
+        """ワーカープロセスを停止する"""
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            self._cond.notify_all()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed and (
+                    not self._pending or len(self._in_flight) >= self._max_in_flight
+                ):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                image_path, cached_path, size, fmt = self._pending.popleft()
+                future = self._executor.submit(render_thumbnail, image_path, cached_path, size, fmt)
+                self._in_flight[cached_path] = future
+            future.add_done_callback(
+                lambda f, cached_path=cached_path: self._on_done(cached_path, f)
+            )
+
+    def _on_done(self, cached_path: Path, future: Future) -> None:
+        failed = False
+        try:
+            nbytes = future.result()
+        except CancelledError:
+            nbytes = None
+        except Exception:
+            nbytes = None
+            failed = True
+        if nbytes is not None:
+            self._cache.register(cached_path, nbytes)
+
+        with self._cond:
+            if nbytes is not None:
+                self.completed += 1
+            elif failed:
+                self.failed += 1
+            self._in_flight.pop(cached_path, None)
+            self._cond.notify()
@@ -0,0 +1,240 @@
+"""Label suggestions from a Naive Bayes model trained on perceptual hashes.
+
+Every classified image is an example: its 64-bit dHash (usually already
+in the folder index) and the label it was given. The model is a Bernoulli
+Naive Bayes over the hash bits, updated incrementally with counts and
+stored as a small JSON file in the app data directory. Prediction uses
+per-label lookup tables indexed by hash byte, so scoring a page costs
+eight table lookups per image and label.
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+from utils.encoding import resolve_paths
+from utils.folder_index import FolderIndex
+from utils.image_hashing import HASH_BITS, compute_dhash
+from utils.metrics import METRICS
+
+SUGGESTION_MODEL_NAME = "suggestions.json"
+# 提案を始めるのに必要な学習例の数とラベルの種類
+MIN_TRAINING_EXAMPLES = 10
+MIN_TRAINING_LABELS = 2
+# ラプラススムージングの係数
+SMOOTHING = 1.0
+_HASH_BYTES = HASH_BITS // 8
+logger = logging.getLogger(__name__)
+
+
+class Suggestion(NamedTuple):
+    """Most likely label of an image and its posterior probability."""
+
+    label: str
+    confidence: float
+
+
+def _byte_tables(count: int, bits: list[int]) -> list[list[float]]:
+    # ハッシュの各バイト値に対する対数尤度の表（バイト位置ごとに256要素）
+    ones = [math.log((bits[i] + SMOOTHING) / (count + 2 * SMOOTHING)) for i in range(HASH_BITS)]
+    zeros = [math.log((count - bits[i] + SMOOTHING) / (count + 2 * SMOOTHING)) for i in range(HASH_BITS)]
+    tables = []
+    for byte in range(_HASH_BYTES):
+        offset = byte * 8
+        table = [sum(zeros[offset:offset + 8])] + [0.0] * 255
+        for value in range(1, 256):
+            # 最下位の1ビットを0から1に置き換えた差分を足す
+            low = (value & -value).bit_length() - 1
+            table[value] = table[value & (value - 1)] + ones[offset + low] - zeros[offset + low]
+        tables.append(table)
+    return tables
+
+
+class LabelSuggester:
+    """Incrementally trained label model shared by all requests.
+
+    Learning runs on a single background thread so classification
+    responses never wait for hashing or for the model file to be written.
+    """
+
+    def __init__(self, model_path: Path, index: FolderIndex):
+        self.model_path = model_path
+        self._index = index
+        self._lock = threading.Lock()
+        self._counts: dict[str, int] = {}
+        self._bits: dict[str, list[int]] = {}
+        self._tables: list[tuple[str, float, list[list[float]]]] | None = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="label-suggester")
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.model_path, "r", encoding="utf-8") as f:
+                labels = json.load(f)["labels"]
+            for label, data in labels.items():
+                if data["count"] > 0 and len(data["bits"]) == HASH_BITS:
+                    self._counts[label] = data["count"]
+                    self._bits[label] = data["bits"]
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("ignoring unreadable suggestion model %s: %s", self.model_path, e)
+            self._counts.clear()
+            self._bits.clear()
+
+    def _save_locked(self) -> None:
+        payload = {
+            "labels": {
+                label: {"count": count, "bits": self._bits[label]}
+                for label, count in self._counts.items()
+            }
+        }
+        temp_path = self.model_path.with_name(self.model_path.name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(temp_path, self.model_path)
+
+    @property
+    def examples(self) -> int:
+        with self._lock:
+            return sum(self._counts.values())
+
+    def learn(self, hashes: list[int], labels: list[str]) -> None:
+        """
+        ハッシュとラベルの組を学習例として加え、モデルを保存する
+
+        Args:
+            hashes: 画像のハッシュ値
+            labels: 各画像に付けられたラベル
+        """
+        if not hashes:
+            return
+        with self._lock:
+            for value, label in zip(hashes, labels):
+                bits = self._bits.get(label)
+                if bits is None:
+                    bits = self._bits[label] = [0] * HASH_BITS
+                    self._counts[label] = 0
+                self._counts[label] += 1
+                for i in range(HASH_BITS):
+                    bits[i] += (value >> i) & 1
+            self._tables = None
+            self._save_locked()
+        METRICS.inc("labels_learned_total", len(hashes))
+
+    def learn_batch(
+        self,
+        image_paths: list[str],
+        labels: list[str],
+        moved_files: list[dict[str, str]] | None,
+        errors: list[dict[str, str]]
+    ) -> None:
+        """
+        分類結果を学習例としてバックグラウンドで学習する
+
+        ハッシュはフォルダインデックスに記録済みの値を使い、ない場合のみ
+        移動後のファイルから計算する
+
+        Args:
+            image_paths: 分類リクエストの画像パス
+            labels: 各画像のラベル
+            moved_files: classify_batch の移動結果（マニフェストモードなど移動しない場合はNone）
+            errors: 失敗した画像
+        """
+        failed = {error["source"] for error in errors}
+        labelled = [(path, label) for path, label in zip(image_paths, labels) if path not in failed]
+        if moved_files is None:
+            examples = [(path, path, label) for path, label in labelled]
+        elif len(moved_files) == len(labelled):
+            examples = [
+                (moved["source"], moved["destination"], label)
+                for moved, (_, label) in zip(moved_files, labelled)
+            ]
+        else:
+            # 中止などで移動結果と入力の対応が取れない場合は学習しない
+            return
+        if examples:
+            self._executor.submit(self._learn_examples, examples)
+
+    def _learn_examples(self, examples: list[tuple[str, str, str]]) -> None:
+        try:
+            known: dict[str, dict] = {}
+            hashes = []
+            labels = []
+            for (source, current, label), resolved in zip(
+                examples, resolve_paths([source for source, _, _ in examples])
+            ):
+                folder = os.path.dirname(resolved.path)
+                if folder not in known:
+                    known[folder] = self._index.known_entries(Path(folder))
+                entry = known[folder].get(resolved.name)
+                value = entry.dhash if entry is not None and entry.dhash is not None else compute_dhash(current)
+                if value:
+                    hashes.append(int(value, 16))
+                    labels.append(label)
+            self.learn(hashes, labels)
+        except Exception:
+            logger.exception("failed to update the suggestion model")
+
+    def wait(self) -> None:
+        """受け付け済みの学習が終わるまで待つ"""
+        self._executor.submit(lambda: None).result()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def _get_tables(self) -> list[tuple[str, float, list[list[float]]]]:
+        with self._lock:
+            if self._tables is None:
+                total = sum(self._counts.values())
+                self._tables = [
+                    (label, math.log(count / total), _byte_tables(count, self._bits[label]))
+                    for label, count in self._counts.items()
+                ]
+            return self._tables
+
+    def predict(
+        self,
+        hashes: list[int | None],
+        candidates: list[str] | None = None
+    ) -> list[Suggestion | None]:
+        """
+        各画像の最も確からしいラベルと事後確率を求める
+
+        Args:
+            hashes: 画像のハッシュ値（計算できなかった画像はNone）
+            candidates: 提案するラベルの候補（省略時は学習済みのすべてのラベル）
+
+        Returns:
+            各画像の提案。学習例が足りない場合やハッシュのない画像はNone
+        """
+        tables = self._get_tables()
+        if candidates is not None:
+            allowed = set(candidates)
+            tables = [table for table in tables if table[0] in allowed]
+        examples = self.examples
+        if len(tables) < MIN_TRAINING_LABELS or examples < MIN_TRAINING_EXAMPLES:
+            return [None] * len(hashes)
+
+        shifts = range(0, HASH_BITS, 8)
+        suggestions: list[Suggestion | None] = []
+        for value in hashes:
+            if value is None:
+                suggestions.append(None)
+                continue
+            keys = [(value >> shift) & 0xFF for shift in shifts]
+            scores = [
+                prior + sum(table[key] for table, key in zip(byte_tables, keys))
+                for _, prior, byte_tables in tables
+            ]
+            best = max(range(len(scores)), key=scores.__getitem__)
+            # 事後確率（log-sum-exp で正規化）
+            top = scores[best]
+            confidence = 1.0 / sum(math.exp(score - top) for score in scores)
+            suggestions.append(Suggestion(tables[best][0], confidence))
+        return suggestions
@@ -0,0 +1,288 @@
+"""Thumbnail rendering and persistent content-addressed thumbnail cache."""
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from utils.imaging import allow_large_images
+from utils.memory import SIZE_SAMPLE, estimate_bytes
+from utils.metrics import METRICS
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+    from utils.memory import MemoryBudget
+
+# フォーマット名 -> (Pillowフォーマット, MIMEタイプ, 拡張子)
+THUMBNAIL_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+}
+DEFAULT_THUMBNAIL_SIZE = 150
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+THUMBNAIL_QUALITY = 85
+
+
+def thumbnail_cache_key(source_path: Path, stat: os.stat_result, size: int, fmt: str) -> str:
+    """
+    サムネイルのキャッシュキーを計算する
+
+    パス・更新時刻・ファイルサイズ・寸法・フォーマットから導出するため、
+    元画像が変更されると自動的に別キーになる
+    """
+    raw = f"{source_path}|{stat.st_mtime_ns}|{stat.st_size}|{size}|{fmt}"
+    return hashlib.sha256(raw.encode('utf-8', errors='surrogatepass')).hexdigest()
+
+
+def render_thumbnail(source_path: Path, dest_path: Path, size: int, fmt: str) -> int:
+    """
+    画像を縮小してサムネイルファイルを書き出す
+
+    プロセスプールからも呼び出せるようモジュールレベル関数としている
+
+    Args:
+        source_path: 元画像パス
+        dest_path: 書き出し先パス
+        size: 長辺の最大ピクセル数
+        fmt: THUMBNAIL_FORMATS のキー
+
+    Returns:
+        書き出したファイルのバイト数
+
+    Raises:
+        ValueError: 画像として読み込めない
+    """
+    # Pillowは起動時間を短くするため使用時に読み込む
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    allow_large_images()
+    try:
+        with Image.open(source_path) as img:
+            # JPEGはDCTスケーリングで縮小デコードし、全画素のデコードを避ける
+            img.draft('RGB', (size, size))
+            thumb = ImageOps.exif_transpose(img)
+            thumb.thumbnail((size, size), Image.Resampling.LANCZOS)
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise ValueError(f"画像を読み込めません: {source_path.name}") from e
+
+    return save_image_atomic(thumb, dest_path, fmt)
+
+
+def save_image_atomic(img: "Image.Image", dest_path: Path, fmt: str) -> int:
+    """
+    画像を一時ファイル経由で書き出す（途中で落ちても壊れたキャッシュを残さない）
+
+    Args:
+        img: 書き出す画像
+        dest_path: 書き出し先パス
+        fmt: THUMBNAIL_FORMATS のキー
+
+    Returns:
+        書き出したファイルのバイト数
+    """
+    from PIL import Image
+
+    pil_format = THUMBNAIL_FORMATS[fmt][0]
+    if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        else:
+            img = img.convert("RGB")
+
+    dest_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=dest_path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            img.save(f, format=pil_format, quality=THUMBNAIL_QUALITY)
+        os.replace(tmp_name, dest_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+    return dest_path.stat().st_size
+
+
+class ThumbnailCache:
+    """Disk-backed thumbnail cache with a byte cap and LRU eviction.
+
+    Recency is persisted through file mtimes so the LRU order survives
+    restarts. The existing files are indexed on a background thread so a
+    large cache does not delay startup; lookups wait for it to finish.
+    The in-memory index also counts against the shared memory budget: when
+    it is exceeded, the least recently used files are deleted with their
+    index entries.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+        budget: "MemoryBudget | None" = None
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._budget = budget
+        self._lock = threading.Lock()
+        # ファイル名 -> (バイト数, 最終使用時刻 time.monotonic())。先頭ほど長く使われていない
+        self._entries: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        self._total_bytes = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._loaded = threading.Event()
+        threading.Thread(target=self._load, name="thumbnail-cache-load", daemon=True).start()
+
+    @property
+    def total_bytes(self) -> int:
+        self._loaded.wait()
+        return self._total_bytes
+
+    def memory_usage(self) -> int:
+        """ファイルの索引がメモリ上で使うおおよそのバイト数（キャッシュ本体はディスク上）"""
+        with self._lock:
+            sample = list(islice(self._entries.items(), SIZE_SAMPLE))
+            # 辞書自体の大きさは削除しても縮まないため、追い出しで減るエントリ分だけを数える
+            return estimate_bytes(sample, len(self._entries))
+
+    def memory_entries(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def oldest_use(self) -> float | None:
+        with self._lock:
+            for _, last_used in self._entries.values():
+                return last_used
+            return None
+
+    def evict_oldest(self) -> int:
+        """最も長く使われていないキャッシュファイルを削除し、索引から外す"""
+        with self._lock:
+            if not self._entries:
+                return 0
+            sample = list(islice(self._entries.items(), 1))
+            self._remove_oldest_locked()
+        return estimate_bytes(sample, 1)
+
+    def _load(self) -> None:
+        """既存のキャッシュファイルを最終アクセス順に読み込む"""
+        try:
+            self._scan()
+        finally:
+            self._loaded.set()
+
+    def _scan(self) -> None:
+        found = []
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".tmp"):
+                    # 前回異常終了時の書きかけファイル
+                    try:
+                        os.unlink(entry.path)
+                    except OSError:
+                        pass
+                    continue
+                if entry.is_file():
+                    st = entry.stat()
+                    found.append((st.st_mtime_ns, entry.name, st.st_size))
+
+        found.sort()
+        # ファイルの更新時刻（最終アクセス）を time.monotonic() の時刻に換算する
+        now_ns = time.time_ns()
+        now = time.monotonic()
+        with self._lock:
+            for mtime_ns, name, nbytes in found:
+                self._entries[name] = (nbytes, now - max(0, now_ns - mtime_ns) / 1e9)
+                self._total_bytes += nbytes
+            self._evict_locked()
+
+    def path_for(self, source_path: Path, size: int, fmt: str) -> Path:
+        """元画像に対応するキャッシュファイルのパスを返す（存在は保証しない）"""
+        key = thumbnail_cache_key(source_path, source_path.stat(), size, fmt)
+        return self.cache_dir / key[:2] / f"{key}{THUMBNAIL_FORMATS[fmt][2]}"
+
+    def contains(self, cached_path: Path) -> bool:
+        """統計や使用順を変えずにキャッシュの有無を確認する"""
+        self._loaded.wait()
+        with self._lock:
+            return cached_path.name in self._entries
+
+    def get(self, cached_path: Path) -> bool:
+        """キャッシュに存在すれば最近使用として記録して True を返す"""
+        name = cached_path.name
+        self._loaded.wait()
+        with self._lock:
+            present = name in self._entries
+            if present:
+                self._entries[name] = (self._entries[name][0], time.monotonic())
+                self._entries.move_to_end(name)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not present:
+            return False
+        try:
+            os.utime(cached_path)
+        except FileNotFoundError:
+            # 外部から削除された
+            with self._lock:
+                self._total_bytes -= self._entries.pop(name, (0, 0.0))[0]
+            return False
+        return True
+
+    def register(self, cached_path: Path, nbytes: int) -> None:
+        """新しく書き出したキャッシュファイルを登録し、上限を超えた分を削除する"""
+        self._loaded.wait()
+        with self._lock:
+            self._total_bytes -= self._entries.pop(cached_path.name, (0, 0.0))[0]
+            self._entries[cached_path.name] = (nbytes, time.monotonic())
+            self._total_bytes += nbytes
+            self._evict_locked()
+        if self._budget is not None:
+            self._budget.enforce()
+
+    def _evict_locked(self) -> None:
+        while self._total_bytes > self.max_bytes and self._entries:
+            self._remove_oldest_locked()
+
+    def _remove_oldest_locked(self) -> None:
+        name, (nbytes, _) = self._entries.popitem(last=False)
+        self._total_bytes -= nbytes
+        try:
+            os.unlink(self.cache_dir / name[:2] / name)
+        except FileNotFoundError:
+            pass
+
+    def get_or_create(self, source_path: Path, size: int, fmt: str) -> Path:
+        """
+        サムネイルを取得する（なければ生成してキャッシュする）
+
+        Args:
+            source_path: 元画像パス
+            size: 長辺の最大ピクセル数
+            fmt: THUMBNAIL_FORMATS のキー
+
+        Returns:
+            キャッシュ済みサムネイルのパス
+        """
+        cached_path = self.path_for(source_path, size, fmt)
+        if self.get(cached_path):
+            return cached_path
+
+        with METRICS.time("thumbnail_render_seconds"):
+            nbytes = render_thumbnail(source_path, cached_path, size, fmt)
+        self.register(cached_path, nbytes)
+        return cached_path
@@ -0,0 +1,287 @@
+"""DeepZoom-style tile pyramid rendered lazily per level and cached on disk."""
+
+import hashlib
+import math
+import os
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+
+from utils.imaging import allow_large_images
+from utils.metadata import EXIF_ORIENTATION, ROTATED_ORIENTATIONS, read_image_metadata
+from utils.thumbnails import THUMBNAIL_FORMATS, ThumbnailCache, save_image_atomic
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+DEFAULT_TILE_SIZE = 254
+DEFAULT_TILE_OVERLAP = 1
+DEFAULT_TILE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_TILE_WORKERS = 4
+# ピラミッドの形状を覚えておく画像の数
+DEFAULT_INFO_CACHE_SIZE = 1024
+logger = logging.getLogger(__name__)
+
+
+class PyramidInfo(NamedTuple):
+    """Geometry of the tile pyramid of one image (DeepZoom level numbering)."""
+
+    width: int
+    height: int
+    tile_size: int
+    overlap: int
+    max_level: int
+
+    def level_size(self, level: int) -> tuple[int, int]:
+        """レベルの画像サイズ（最大レベルが原寸、1つ下がるごとに1/2）"""
+        scale = 2 ** (self.max_level - level)
+        return math.ceil(self.width / scale), math.ceil(self.height / scale)
+
+    def tile_grid(self, level: int) -> tuple[int, int]:
+        """レベルのタイルの列数と行数"""
+        width, height = self.level_size(level)
+        return math.ceil(width / self.tile_size), math.ceil(height / self.tile_size)
+
+    def tile_box(self, level: int, col: int, row: int) -> tuple[int, int, int, int]:
+        """レベル画像上のタイルの範囲（隣接タイルとの重なりを含む）"""
+        width, height = self.level_size(level)
+        left = col * self.tile_size - (self.overlap if col > 0 else 0)
+        top = row * self.tile_size - (self.overlap if row > 0 else 0)
+        right = min((col + 1) * self.tile_size + self.overlap, width)
+        bottom = min((row + 1) * self.tile_size + self.overlap, height)
+        return left, top, right, bottom
+
+
+def tile_cache_key(
+    source_path: Path,
+    stat: os.stat_result,
+    info: PyramidInfo,
+    level: int,
+    col: int,
+    row: int,
+    fmt: str
+) -> str:
+    """元画像の更新時刻・サイズとタイル位置から導出したキャッシュキーを返す"""
+    raw = (
+        f"{source_path}|{stat.st_mtime_ns}|{stat.st_size}|"
+        f"{info.tile_size}|{info.overlap}|{level}|{col}|{row}|{fmt}"
+    )
+    return hashlib.sha256(raw.encode('utf-8', errors='surrogatepass')).hexdigest()
+
+
+def render_level(source_path: Path, info: PyramidInfo, level: int) -> "Image.Image":
+    """
+    ピラミッドの1レベル分の画像をデコードする
+
+    JPEGは draft() でDCTスケーリングにより最大1/8で縮小デコードし、
+    残りは整数倍の reduce() と最後の端数のリサイズで合わせる
+
+    Args:
+        source_path: 元画像パス
+        info: ピラミッドの形状
+        level: レベル
+
+    Returns:
+        表示向きに回転済みのレベル画像
+
+    Raises:
+        ValueError: 画像として読み込めない
+    """
+    # Pillowは起動時間を短くするため使用時に読み込む
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    allow_large_images()
+    width, height = info.level_size(level)
+    try:
+        with Image.open(source_path) as img:
+            rotated = img.getexif().get(EXIF_ORIENTATION) in ROTATED_ORIENTATIONS
+            img.draft('RGB', (height, width) if rotated else (width, height))
+            level_image = ImageOps.exif_transpose(img)
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise ValueError(f"画像を読み込めません: {source_path.name}") from e
+
+    if level_image.size != (width, height):
+        factor = min(level_image.width // width, level_image.height // height)
+        if factor > 1:
+            level_image = level_image.reduce(factor)
+        if level_image.size != (width, height):
+            level_image = level_image.resize((width, height), Image.Resampling.LANCZOS)
+    return level_image
+
+
+class TileRenderer:
+    """Serves pyramid tiles from a disk cache, decoding a whole level on a miss.
+
+    Decoding is the expensive step and cannot be restricted to one tile,
+    so the first request for a level decodes it once, encodes and returns
+    just the requested tile, and hands the decoded level to background
+    writers that encode the remaining tiles nearest-first. Until they
+    finish, other tiles of that level are cut from the decoded level in
+    memory; afterwards they are plain file reads.
+    """
+
+    def __init__(
+        self,
+        cache: ThumbnailCache,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        overlap: int = DEFAULT_TILE_OVERLAP,
+        max_workers: int = DEFAULT_TILE_WORKERS,
+        info_cache_size: int = DEFAULT_INFO_CACHE_SIZE
+    ):
+        self.cache = cache
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.max_workers = max_workers
+        self.info_cache_size = info_cache_size
+        self._lock = threading.Lock()
+        self._level_locks: dict[tuple, threading.Lock] = {}
+        # (パス, 更新時刻, サイズ) -> PyramidInfo。タイルごとにヘッダとEXIFを読み直さない
+        self._infos: OrderedDict[tuple, PyramidInfo] = OrderedDict()
+        # 残りのタイルを書き出し中のレベル画像（書き出しが終わると破棄する）
+        self._levels: dict[tuple, "Image.Image"] = {}
+        self._levels_written = threading.Condition(self._lock)
+        self._writers = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tile-writer")
+
+    def info(self, source_path: Path, stat: os.stat_result | None = None) -> PyramidInfo:
+        """
+        画像ヘッダからピラミッドの形状を求める（更新時刻とサイズが同じ間は覚えた値を返す）
+
+        Args:
+            source_path: 元画像パス
+            stat: 取得済みの場合は元画像の stat 結果
+
+        Raises:
+            ValueError: 画像として読み込めない
+        """
+        if stat is None:
+            stat = source_path.stat()
+        key = (str(source_path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            info = self._infos.get(key)
+            if info is not None:
+                self._infos.move_to_end(key)
+                return info
+
+        metadata = read_image_metadata(str(source_path))
+        if not metadata.width:
+            raise ValueError(f"画像を読み込めません: {source_path.name}")
+        max_level = math.ceil(math.log2(max(metadata.width, metadata.height, 1)))
+        info = PyramidInfo(metadata.width, metadata.height, self.tile_size, self.overlap, max_level)
+        with self._lock:
+            self._infos[key] = info
+            while len(self._infos) > self.info_cache_size:
+                self._infos.popitem(last=False)
+        return info
+
+    def get_tile(self, source_path: Path, level: int, col: int, row: int, fmt: str) -> Path:
+        """
+        タイルを取得する（なければレベルをデコードしてこのタイルを書き出し、残りはバックグラウンドで書き出す）
+
+        Args:
+            source_path: 元画像パス
+            level: レベル（0が1x1、max_level が原寸）
+            col: タイルの列
+            row: タイルの行
+            fmt: THUMBNAIL_FORMATS のキー
+
+        Returns:
+            キャッシュ済みタイルのパス
+
+        Raises:
+            IndexError: 指定したタイルがピラミッドの範囲外
+            ValueError: 画像として読み込めない
+        """
+        stat = source_path.stat()
+        info = self.info(source_path, stat)
+        if not 0 <= level <= info.max_level:
+            raise IndexError(level)
+        cols, rows = info.tile_grid(level)
+        if not (0 <= col < cols and 0 <= row < rows):
+            raise IndexError((col, row))
+
+        tile_path = self._tile_path(source_path, stat, info, level, col, row, fmt)
+        if self.cache.get(tile_path):
+            return tile_path
+
+        level_key = (str(source_path), stat.st_mtime_ns, stat.st_size, level, fmt)
+        with self._lock:
+            level_lock = self._level_locks.setdefault(level_key, threading.Lock())
+        with level_lock:
+            # 待っている間に他のリクエストが同じタイルを書き出した
+            if not self.cache.contains(tile_path):
+                with self._lock:
+                    level_image = self._levels.get(level_key)
+                if level_image is not None:
+                    # レベルの残りを書き出し中: デコード済みの画像から切り出す
+                    self._write_tile(level_image, source_path, stat, info, level, col, row, fmt)
+                else:
+                    level_image = render_level(source_path, info, level)
+                    self._write_tile(level_image, source_path, stat, info, level, col, row, fmt)
+                    if cols * rows > 1:
+                        with self._lock:
+                            self._levels[level_key] = level_image
+                        self._writers.submit(
+                            self._write_level, level_key, level_image, source_path, stat, info, level, fmt, (col, row)
+                        )
+        with self._lock:
+            self._level_locks.pop(level_key, None)
+        return tile_path
+
+    def wait(self) -> None:
+        """書き出し中のレベルがすべて書き終わるまで待つ"""
+        with self._levels_written:
+            self._levels_written.wait_for(lambda: not self._levels)
+
+    def shutdown(self) -> None:
+        self._writers.shutdown(wait=False, cancel_futures=True)
+
+    def _tile_path(self, source_path, stat, info, level, col, row, fmt) -> Path:
+        key = tile_cache_key(source_path, stat, info, level, col, row, fmt)
+        return self.cache.cache_dir / key[:2] / f"{key}{THUMBNAIL_FORMATS[fmt][2]}"
+
+    def _write_tile(
+        self,
+        level_image: "Image.Image",
+        source_path: Path,
+        stat: os.stat_result,
+        info: PyramidInfo,
+        level: int,
+        col: int,
+        row: int,
+        fmt: str
+    ) -> None:
+        tile_path = self._tile_path(source_path, stat, info, level, col, row, fmt)
+        tile = level_image.crop(info.tile_box(level, col, row))
+        self.cache.register(tile_path, save_image_atomic(tile, tile_path, fmt))
+
+    def _write_level(
+        self,
+        level_key: tuple,
+        level_image: "Image.Image",
+        source_path: Path,
+        stat: os.stat_result,
+        info: PyramidInfo,
+        level: int,
+        fmt: str,
+        origin: tuple[int, int]
+    ) -> None:
+        """レベルの残りのタイルを、最初に要求されたタイルに近い順に書き出す"""
+        try:
+            cols, rows = info.tile_grid(level)
+            positions = sorted(
+                ((col, row) for row in range(rows) for col in range(cols)),
+                key=lambda position: max(abs(position[0] - origin[0]), abs(position[1] - origin[1])),
+            )
+            for col, row in positions:
+                tile_path = self._tile_path(source_path, stat, info, level, col, row, fmt)
+                if not self.cache.contains(tile_path):
+                    self._write_tile(level_image, source_path, stat, info, level, col, row, fmt)
+        except Exception:
+            logger.exception("failed to write tiles of %s level %d", source_path, level)
+        finally:
+            with self._levels_written:
+                self._levels.pop(level_key, None)
+                self._levels_written.notify_all()
@@ -0,0 +1,141 @@
+"""File transfer engine for moves across devices and non-destructive copies."""
+
+import errno
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+TRANSFER_MOVE = "move"
+TRANSFER_COPY = "copy"
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+# copy_file_range 1回あたりの最大バイト数（カーネル側でさらに分割される）
+COPY_RANGE_CHUNK = 1024 * 1024 * 1024
+PARTIAL_SUFFIX = ".partial"
+
+# copy_file_range が使えない組み合わせ（古いカーネル、対応していないファイルシステム）
+_COPY_RANGE_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM}
+
+
+def partial_path(dest_path: Path) -> Path:
+    """コピー中のデータを書き込む一時ファイルのパス（移動先と同じフォルダの隠しファイル）"""
+    return dest_path.with_name(f".{dest_path.name}{PARTIAL_SUFFIX}")
+
+
+def file_digest(path: Path) -> str:
+    """
+    ファイル内容のBLAKE2bダイジェストを求める
+
+    Args:
+        path: ファイルパス
+
+    Returns:
+        16進数のダイジェスト
+    """
+    digest = hashlib.blake2b()
+    buffer = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while size := f.readinto(buffer):
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+
+def _copy_range(src_fd: int, dst_fd: int) -> bool:
+    # カーネル内でコピーする（対応するファイルシステムではreflinkやサーバー側コピーになる）
+    if not hasattr(os, "copy_file_range"):
+        return False
+    copied = 0
+    while True:
+        try:
+            size = os.copy_file_range(src_fd, dst_fd, COPY_RANGE_CHUNK)
+        except OSError as e:
+            if copied == 0 and e.errno in _COPY_RANGE_UNSUPPORTED:
+                return False
+            raise
+        if size == 0:
+            return True
+        copied += size
+
+
+def _copy_hashed(src, dst) -> str:
+    # 読み込んだデータをそのまま書き込みとハッシュ計算に使い、元ファイルを2回読まない
+    digest = hashlib.blake2b()
+    buffer = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buffer)
+    while size := src.readinto(buffer):
+        digest.update(view[:size])
+        dst.write(view[:size])
+    return digest.hexdigest()
+
+
+def copy_file(source_path: Path, dest_path: Path, verify: bool = False, durable: bool = False) -> None:
+    """
+    ファイルの内容と属性をコピーする
+
+    一時ファイルに書き込んでから dest_path を置き換えるため、
+    dest_path は常に予約用の空ファイルか完成したコピーのどちらかになる
+
+    Args:
+        source_path: コピー元
+        dest_path: コピー先（予約用のプレースホルダがあれば置き換える）
+        verify: コピー先を読み直し、BLAKE2bダイジェストがコピー元と一致するか確かめる
+        durable: 置き換える前にコピー先をディスクに書き込む（この後コピー元を削除する場合）
+
+    Raises:
+        OSError: コピーに失敗した、または検証でダイジェストが一致しなかった
+    """
+    temp_path = partial_path(dest_path)
+    try:
+        with open(source_path, "rb", buffering=0) as src, open(temp_path, "wb") as dst:
+            source_digest = None
+            if verify:
+                source_digest = _copy_hashed(src, dst)
+            elif not _copy_range(src.fileno(), dst.fileno()):
+                shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+            if durable or verify:
+                dst.flush()
+                os.fsync(dst.fileno())
+                if verify and hasattr(os, "posix_fadvise"):
+                    # ページキャッシュを捨て、検証ではディスクに書かれた内容を読む
+                    os.posix_fadvise(dst.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        shutil.copystat(source_path, temp_path)
+        if verify and file_digest(temp_path) != source_digest:
+            raise OSError(errno.EIO, f"コピーしたファイルの検証に失敗しました: {source_path.name}")
+        os.replace(temp_path, dest_path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def transfer_file(
+    source_path: Path,
+    dest_path: Path,
+    mode: str = TRANSFER_MOVE,
+    verify: bool = False
+) -> None:
+    """
+    ファイルを移動またはコピーする
+
+    移動は同一デバイス内ではアトミックな rename のみで完了し、
+    デバイスをまたぐ場合はコピーをディスクに書き込んでから元ファイルを削除する
+
+    Args:
+        source_path: 移動元
+        dest_path: 移動先（予約用のプレースホルダがあれば置き換える）
+        mode: TRANSFER_MOVE または TRANSFER_COPY（元ファイルを残す）
+        verify: コピーする場合に内容を検証してから元ファイルを削除する
+    """
+    if mode == TRANSFER_COPY:
+        copy_file(source_path, dest_path, verify=verify)
+        return
+    try:
+        os.replace(source_path, dest_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        copy_file(source_path, dest_path, verify=verify, durable=True)
+        os.unlink(source_path)
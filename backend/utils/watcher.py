@@ -0,0 +1,207 @@
+"""Folder change detection producing add/remove/rename deltas."""
+
+import ctypes
+import os
+import select
+import sys
+import time
+from pathlib import Path
+
+from utils.file_operations import is_supported_image_name
+from utils.folder_index import RACY_WINDOW_NS
+
+# (識別キー, サイズ, 更新時刻)
+EntryState = tuple[object, int, int]
+
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+
+def snapshot_folder(folder_path: Path) -> dict[str, EntryState]:
+    """
+    フォルダ内の画像ファイルの状態を取得する
+
+    Args:
+        folder_path: フォルダパス
+
+    Returns:
+        ファイル名 -> (識別キー, サイズ, 更新時刻) の辞書
+    """
+    snapshot = {}
+    with os.scandir(folder_path) as scanner:
+        for entry in scanner:
+            if not is_supported_image_name(entry.name) or not entry.is_file():
+                continue
+            st = entry.stat()
+            # inodeが取れない環境（Windowsのscandir）ではサイズと更新時刻で同一性を判定する
+            identity = st.st_ino or (st.st_size, st.st_mtime_ns)
+            snapshot[entry.name] = (identity, st.st_size, st.st_mtime_ns)
+    return snapshot
+
+
+def diff_snapshots(
+    folder: str,
+    old: dict[str, EntryState],
+    new: dict[str, EntryState]
+) -> list[dict[str, str]]:
+    """
+    2つのスナップショットの差分を added/removed/renamed イベントに変換する
+
+    Args:
+        folder: イベントに含めるフォルダパス
+        old: 前回のスナップショット
+        new: 今回のスナップショット
+
+    Returns:
+        イベント辞書のリスト
+    """
+    removed = {name: state for name, state in old.items() if name not in new}
+    added = [name for name in new if name not in old]
+
+    removed_by_identity = {state[0]: name for name, state in removed.items()}
+    events = []
+    for name in added:
+        old_name = removed_by_identity.pop(new[name][0], None)
+        if old_name is not None:
+            del removed[old_name]
+            events.append({"type": "renamed", "folder": folder, "filename": name, "old_filename": old_name})
+        else:
+            events.append({"type": "added", "folder": folder, "filename": name})
+    for name in removed:
+        events.append({"type": "removed", "folder": folder, "filename": name})
+    return events
+
+
+class _InotifyWaker:
+    """Block until inotify reports activity in any watched directory.
+
+    Events are only used as a wake-up signal; the actual delta always comes
+    from a snapshot diff, so a missed or overflowed event queue is harmless.
+    """
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watched: set[Path] = set()
+
+    def add(self, folder_path: Path) -> None:
+        if folder_path in self._watched:
+            return
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder_path), _WATCH_MASK)
+        if wd >= 0:
+            self._watched.add(folder_path)
+
+    def wait(self, timeout: float) -> None:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if readable:
+            # 連続した変更をまとめて1回のスキャンで処理する
+            time.sleep(0.05)
+            try:
+                while os.read(self._fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class FolderWatcher:
+    """Watch image folders and the label folders below a target folder.
+
+    Uses inotify as a wake-up source on Linux and plain polling elsewhere
+    (and for network/WSL mounts where inotify stays silent). A folder is
+    only rescanned when its directory mtime moved.
+    """
+
+    def __init__(self, folders: list[Path], target_folder: Path | None = None):
+        self._target_folder = target_folder
+        self._states: dict[Path, tuple[int, int, dict[str, EntryState]]] = {}
+        self._waker = None
+        if sys.platform.startswith('linux'):
+            try:
+                self._waker = _InotifyWaker()
+            except (OSError, AttributeError):
+                self._waker = None
+
+        for folder_path in folders:
+            self._watch(folder_path)
+        if target_folder is not None:
+            self._watch(target_folder, track_images=False)
+            self._discover_label_folders()
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._waker is not None
+
+    def _watch(self, folder_path: Path, track_images: bool = True) -> None:
+        if folder_path in self._states:
+            return
+        dir_mtime_ns = os.stat(folder_path).st_mtime_ns
+        snapshot = snapshot_folder(folder_path) if track_images else {}
+        self._states[folder_path] = (dir_mtime_ns, time.time_ns(), snapshot)
+        if self._waker is not None:
+            self._waker.add(folder_path)
+
+    def _discover_label_folders(self) -> list[Path]:
+        added = []
+        with os.scandir(self._target_folder) as scanner:
+            for entry in scanner:
+                label_folder = Path(entry.path)
+                if entry.is_dir() and label_folder not in self._states:
+                    self._watch(label_folder)
+                    added.append(label_folder)
+        return added
+
+    def poll(self) -> list[dict[str, str]]:
+        """
+        前回からの変更を検出する
+
+        Returns:
+            イベント辞書のリスト
+        """
+        events = []
+        for folder_path, (dir_mtime_ns, scanned_at_ns, snapshot) in list(self._states.items()):
+            try:
+                current_mtime_ns = os.stat(folder_path).st_mtime_ns
+            except FileNotFoundError:
+                events.extend(diff_snapshots(str(folder_path), snapshot, {}))
+                del self._states[folder_path]
+                continue
+            if current_mtime_ns == dir_mtime_ns and current_mtime_ns < scanned_at_ns - RACY_WINDOW_NS:
+                continue
+
+            scanned_at_ns = time.time_ns()
+            if folder_path == self._target_folder:
+                self._states[folder_path] = (current_mtime_ns, scanned_at_ns, snapshot)
+                for label_folder in self._discover_label_folders():
+                    new_snapshot = self._states[label_folder][2]
+                    events.extend(diff_snapshots(str(label_folder), {}, new_snapshot))
+                continue
+
+            new_snapshot = snapshot_folder(folder_path)
+            self._states[folder_path] = (current_mtime_ns, scanned_at_ns, new_snapshot)
+            events.extend(diff_snapshots(str(folder_path), snapshot, new_snapshot))
+        return events
+
+    def wait_and_poll(self, timeout: float) -> list[dict[str, str]]:
+        """変更通知か timeout 秒経過を待ってから poll する"""
+        if self._waker is not None:
+            self._waker.wait(timeout)
+        else:
+            time.sleep(timeout)
+        return self.poll()
+
+    def close(self) -> None:
+        if self._waker is not None:
+            self._waker.close()
+            self._waker = None
@@ -0,0 +1,130 @@
+"""Compact JSON encoding of large image listings.
+
+Listings are built as plain dicts in the ColumnarImageList shape and
+encoded directly, skipping per-object Pydantic serialisation. Name-only
+listings are encoded chunk by chunk so the whole body never exists at once.
+"""
+
+import json
+import os
+from typing import Iterator
+
+from models import ImageInfo
+
+try:
+    # 任意の依存。インストールされていれば高速なエンコーダを使う
+    import orjson
+except ImportError:
+    orjson = None
+
+# 列として出力する ImageInfo の項目（path と filename は folder と filenames で表す）
+COLUMN_FIELDS = (
+    "subpath", "cluster_id", "cluster_size",
+    "size", "modified_at", "width", "height", "aspect_ratio", "taken_at",
+    "suggested_label", "suggestion_confidence",
+)
+
+
+def dumps(payload) -> bytes:
+    """
+    辞書・リスト・文字列・数値のみからなる値をJSONのバイト列にする
+
+    Args:
+        payload: JSONに変換する値
+
+    Returns:
+        UTF-8のJSON
+    """
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# 一覧をJSONに変換するときに一度にエンコードする件数
+LISTING_CHUNK_SIZE = 4096
+
+
+def _iter_array_items(items: list, chunk_size: int, encode) -> Iterator[bytes]:
+    # JSON配列の要素部分（括弧を除く）をチャンクごとにカンマ区切りで出力する
+    for start in range(0, len(items), chunk_size):
+        body = dumps(encode(items[start:start + chunk_size]))[1:-1]
+        yield body if start == 0 else b"," + body
+
+
+def iter_image_objects(
+    folder_path: str,
+    filenames: list[str],
+    chunk_size: int = LISTING_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    フォルダ直下のファイル名の一覧を ImageInfo の配列のJSONとして少しずつ出力する
+
+    Args:
+        folder_path: 共通のフォルダパス
+        filenames: ファイル名
+        chunk_size: 1回にエンコードする件数
+
+    Returns:
+        JSONのバイト列のイテレータ
+    """
+    # フォルダ部分は1回だけエンコードし、各ファイル名のJSON文字列と連結する
+    # （os.path.join(folder_path, name) と同じ文字列になる）
+    path_prefix = json.dumps(os.path.join(folder_path, ""), ensure_ascii=False)[:-1]
+    yield b"["
+    for start in range(0, len(filenames), chunk_size):
+        # エンコード後の文字列には生の改行が現れないため、改行区切りで1件ずつに分けられる
+        encoded = json.dumps(
+            filenames[start:start + chunk_size], ensure_ascii=False, separators=("\n", ":")
+        )[1:-1].split("\n")
+        body = ",".join([
+            f'{{"path":{path_prefix}{name[1:]},"filename":{name}}}' for name in encoded
+        ]).encode("utf-8")
+        yield body if start == 0 else b"," + body
+    yield b"]"
+
+
+def iter_columnar_names(
+    folder_path: str,
+    filenames: list[str],
+    chunk_size: int = LISTING_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    フォルダ直下のファイル名の一覧を ColumnarImageList のJSONとして少しずつ出力する
+
+    Args:
+        folder_path: 共通のフォルダパス
+        filenames: ファイル名
+        chunk_size: 1回にエンコードする件数
+
+    Returns:
+        JSONのバイト列のイテレータ
+    """
+    yield dumps({"folder": folder_path, "columns": {}})[:-1] + b',"filenames":['
+    yield from _iter_array_items(filenames, chunk_size, lambda names: names)
+    yield b"]}"
+
+
+def columnar_images(folder_path: str, images: list[ImageInfo]) -> dict:
+    """
+    ImageInfoのリストを列形式にする
+
+    いずれかの画像に値がある項目だけを列として出力し、値のない画像は null とする
+
+    Args:
+        folder_path: 共通のフォルダパス（再帰モードでは走査したルート）
+        images: 画像一覧
+
+    Returns:
+        ColumnarImageList 形式の辞書
+    """
+    columns = {}
+    for field in COLUMN_FIELDS:
+        values = [getattr(image, field) for image in images]
+        if any(value is not None for value in values):
+            columns[field] = values
+    return {
+        "folder": folder_path,
+        "filenames": [image.filename for image in images],
+        "columns": columns,
+    }
+
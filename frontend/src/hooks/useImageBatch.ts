@@ -4,6 +4,10 @@
 
 import { useState, useCallback } from 'react';
 import { ImageInfo, AppSettings } from '../types';
+import { prefetchThumbnails, suggestLabels } from '../services/api';
+
+// この確信度未満の提案では初期状態を変えない
+const SUGGESTION_MIN_CONFIDENCE = 0.6;
 
 export interface ImageStates {
   [imagePath: string]: number;
@@ -75,6 +79,38 @@ export const useImageBatch = (): UseImageBatchReturn => {
     setCurrentBatch(nextBatch);
     setRemainingImages(remaining);
     setImageStates(newImageStates);
+
+    // 提案ラベルで初期状態を色付けする（まだ操作されていない画像のみ。失敗しても表示には影響しない）
+    if (nextBatch.length > 0 && settings.classLabels.length > 1) {
+      suggestLabels(nextBatch.map(image => image.path), settings.classLabels, SUGGESTION_MIN_CONFIDENCE)
+        .then(suggestions => {
+          setImageStates(prev => {
+            const updated = { ...prev };
+            suggestions.forEach((suggestion, i) => {
+              const imagePath = nextBatch[i]?.path;
+              const classIndex = settings.classLabels.indexOf(suggestion.suggested_label ?? '');
+              if (imagePath !== undefined && updated[imagePath] === 0 && classIndex > 0) {
+                updated[imagePath] = classIndex;
+              }
+            });
+            return updated;
+          });
+        })
+        .catch(() => undefined);
+    }
+
+    // 次のバッチのサムネイルをバックグラウンドで先に生成させる（失敗しても表示には影響しない）
+    if (remaining.length > 0) {
+      const thumbnailSize = Math.max(settings.thumbnailHeight ?? 120, settings.thumbnailWidth ?? 120)
+        * (window.devicePixelRatio || 1);
+      prefetchThumbnails(remaining.slice(0, batchSize).map(image => image.path), thumbnailSize)
+        .catch(() => undefined);
+      // 次のバッチの提案も先に求め、バックエンドにハッシュを計算・保存させる
+      if (settings.classLabels.length > 1) {
+        suggestLabels(remaining.slice(0, batchSize).map(image => image.path), settings.classLabels)
+          .catch(() => undefined);
+      }
+    }
   }, [totalImagesCount]);
 
   const clearBatch = useCallback(() => {
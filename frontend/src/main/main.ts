@@ -17,8 +17,27 @@ const API_BASE_URL = "http://127.0.0.1:8000";
 const DEFAULT_WINDOW_WIDTH = 1200;
 const DEFAULT_WINDOW_HEIGHT = 800;
 const BACKEND_PORT = 8000;
+// バックエンドが待ち受け開始時に書く行の先頭（backend/main.py と一致させる）
+const BACKEND_READY_PREFIX = "IMAGE_SORTER_READY";
+// 準備完了の行を受け取るパイプ。コンソールのないパッケージ版でも書き込める
+const BACKEND_READY_FD = 3;
+const BACKEND_READY_FD_ENV = "IMAGE_SORTER_READY_FD";
+const BACKEND_READY_TIMEOUT_MS = 30000;
+// この時間内に準備完了の行が届かない場合（古いバックエンドなど）だけ応答の確認に切り替える
+const BACKEND_READY_SIGNAL_TIMEOUT_MS = 5000;
+const BACKEND_HEALTH_POLL_INTERVAL_MS = 500;
+const BACKEND_HEALTH_REQUEST_TIMEOUT_MS = 1000;
 
 // Utility functions
+const spawnBackend = (command: string, args: string[], cwd?: string): ChildProcess => {
+  // 標準入出力に加えて準備完了通知用のパイプを渡す
+  return spawn(command, args, {
+    cwd,
+    stdio: ['pipe', 'pipe', 'pipe', 'pipe'],
+    env: { ...process.env, [BACKEND_READY_FD_ENV]: String(BACKEND_READY_FD) }
+  });
+};
+
 const convertWSLPathToWindows = (path: string): string => {
   if (path.startsWith("/mnt/")) {
     return path.replace("/mnt/c/", "C:\\").replace(/\//g, "\\");
@@ -68,10 +87,7 @@ const startBackendServer = async (): Promise<boolean> => {
           
           console.log('Running WSL Python directly:', pythonCmd, 'main.py');
           // WSL環境では絶対パスで直接実行
-          backendProcess = spawn(pythonCmd, ['main.py'], {
-            cwd: backendPath,
-            stdio: ['pipe', 'pipe', 'pipe']
-          });
+          backendProcess = spawnBackend(pythonCmd, ['main.py'], backendPath);
         } else {
           // 通常のWindows環境での.venv検索
           const venvPythonPaths = [
@@ -98,10 +114,7 @@ const startBackendServer = async (): Promise<boolean> => {
             console.log('Venv not found, using system Python:', pythonCmd);
           }
           
-          backendProcess = spawn(pythonCmd, ['main.py'], {
-            cwd: backendPath,
-            stdio: ['pipe', 'pipe', 'pipe']
-          });
+          backendProcess = spawnBackend(pythonCmd, ['main.py'], backendPath);
         }
       } else {
         // 本番環境: スタンドアロン実行ファイルを使用
@@ -110,24 +123,44 @@ const startBackendServer = async (): Promise<boolean> => {
         
         if (fs.existsSync(executablePath)) {
           console.log('Using standalone backend executable:', executablePath);
-          backendProcess = spawn(executablePath, [], {
-            stdio: ['pipe', 'pipe', 'pipe']
-          });
+          backendProcess = spawnBackend(executablePath, []);
         } else {
           // フォールバック: Pythonスクリプトを直接実行
           console.log('Standalone executable not found, using Python script');
           const fallbackPython = process.platform === 'win32' ? 'python.exe' : 'python3';
           const mainPyPath = path.join(backendPath, 'main.py');
-          backendProcess = spawn(fallbackPython, [mainPyPath], {
-            cwd: backendPath,
-            stdio: ['pipe', 'pipe', 'pipe']
-          });
+          backendProcess = spawnBackend(fallbackPython, [mainPyPath], backendPath);
         }
       }
 
-      backendProcess.stdout?.on('data', (data) => {
-        console.log('Backend stdout:', data.toString());
-      });
+      let settled = false;
+      let healthTimer: NodeJS.Timeout | undefined;
+      const settle = (ready: boolean) => {
+        if (!settled) {
+          settled = true;
+          clearTimeout(readyTimer);
+          clearTimeout(fallbackTimer);
+          clearInterval(healthTimer);
+          resolve(ready);
+        }
+      };
+
+      // 準備完了の行が届いた時点で起動完了とする
+      const watchReadyLine = (stream: NodeJS.ReadableStream | null | undefined, name: string) => {
+        let buffer = '';
+        stream?.on('data', (data) => {
+          const text = data.toString();
+          console.log(`Backend ${name}:`, text);
+          buffer += text;
+          if (buffer.includes(BACKEND_READY_PREFIX)) {
+            console.log('Backend server is ready');
+            buffer = '';
+            settle(true);
+          }
+        });
+      };
+      watchReadyLine(backendProcess.stdout, 'stdout');
+      watchReadyLine(backendProcess.stdio[BACKEND_READY_FD] as NodeJS.ReadableStream | null, 'ready pipe');
 
       backendProcess.stderr?.on('data', (data) => {
         console.log('Backend stderr:', data.toString());
@@ -135,25 +168,40 @@ const startBackendServer = async (): Promise<boolean> => {
 
       backendProcess.on('error', (error) => {
         console.error('Backend process error:', error);
-        resolve(false);
+        settle(false);
       });
 
       backendProcess.on('exit', (code) => {
         console.log('Backend process exited with code:', code);
         backendProcess = null;
+        settle(false);
       });
 
-      // サーバーの起動を待つ
-      setTimeout(async () => {
-        try {
-          const response = await axios.get(`${API_BASE_URL}/`);
-          console.log('Backend server is ready:', response.status);
-          resolve(true);
-        } catch (error) {
-          console.error('Backend server not responding:', error);
-          resolve(false);
-        }
-      }, 3000); // 3秒待つ
+      // 準備完了の行が一定時間届かない場合に限り、応答の確認で起動完了を判定する
+      const fallbackTimer = setTimeout(() => {
+        console.warn('Backend ready line not received, falling back to health checks');
+        let healthCheckInFlight = false;
+        healthTimer = setInterval(async () => {
+          if (healthCheckInFlight || settled) {
+            return;
+          }
+          healthCheckInFlight = true;
+          try {
+            const response = await axios.get(`${API_BASE_URL}/`, { timeout: BACKEND_HEALTH_REQUEST_TIMEOUT_MS });
+            console.log('Backend server is ready:', response.status);
+            settle(true);
+          } catch {
+            // まだ待ち受けを開始していない
+          } finally {
+            healthCheckInFlight = false;
+          }
+        }, BACKEND_HEALTH_POLL_INTERVAL_MS);
+      }, BACKEND_READY_SIGNAL_TIMEOUT_MS);
+
+      const readyTimer = setTimeout(() => {
+        console.error('Backend server not responding');
+        settle(false);
+      }, BACKEND_READY_TIMEOUT_MS);
 
     } catch (error) {
       console.error('Failed to start backend server:', error);
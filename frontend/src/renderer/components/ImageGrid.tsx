@@ -4,7 +4,7 @@
 
 import React from 'react';
 import { ImageInfo, ImageState, ClassItem } from '../../types';
-import { convertPathForElectron } from '../../utils/pathUtils';
+import { getImageUrl, getThumbnailUrl } from '../../services/api';
 
 export interface ImageGridProps {
   images: ImageInfo[];
@@ -40,6 +40,9 @@ const ImageGrid: React.FC<ImageGridProps> = ({
     return classItem ? classItem.color : 'transparent';
   };
 
+  // 高DPI環境でもぼやけないよう表示サイズ×デバイスピクセル比で要求する
+  const thumbnailSize = Math.max(thumbnailHeight, thumbnailWidth) * (window.devicePixelRatio || 1);
+
   const getImageLabel = (imagePath: string): string => {
     const state = imageStates[imagePath] || 0; // デフォルトを0（最初のクラス）
     const classItem = classItems[state];
@@ -72,7 +75,7 @@ const ImageGrid: React.FC<ImageGridProps> = ({
             title={`${image.filename} - ${getImageLabel(image.path)}\n左クリック: 次のクラス / 右クリック: 前のクラス`}
           >
             <img 
-              src={convertPathForElectron(image.path)} 
+              src={getThumbnailUrl(image.path, thumbnailSize)} 
               alt={image.filename}
               draggable={false}
               style={{ 
@@ -83,9 +86,15 @@ const ImageGrid: React.FC<ImageGridProps> = ({
                 console.log(`画像読み込み成功: ${image.path}`);
               }}
               onError={(e) => {
-                console.error(`画像読み込みエラー: ${image.path}`);
-                console.error(`変換後パス: ${convertPathForElectron(image.path)}`);
                 const target = e.target as HTMLImageElement;
+                // サムネイル取得に失敗した場合は元画像を直接表示する
+                if (!target.dataset.fallback) {
+                  target.dataset.fallback = 'original';
+                  target.src = getImageUrl(image.path);
+                  return;
+                }
+                console.error(`画像読み込みエラー: ${image.path}`);
+                console.error(`画像URL: ${getImageUrl(image.path)}`);
                 target.style.backgroundColor = '#f0f0f0';
                 target.style.color = '#666';
                 target.style.fontSize = '12px';
@@ -7,6 +7,17 @@ const API_BASE_URL = 'http://127.0.0.1:8000';
 export interface ImageInfo {
   path: string;
   filename: string;
+  subpath?: string;
+  cluster_id?: number;
+  cluster_size?: number;
+  size?: number;
+  modified_at?: number;
+  width?: number;
+  height?: number;
+  aspect_ratio?: number;
+  taken_at?: string;
+  suggested_label?: string;
+  suggestion_confidence?: number;
 }
 
 export interface ClassifyRequest {
@@ -21,6 +32,11 @@ export interface ClassifyResponse {
     source: string;
     destination: string;
   }>;
+  errors?: Array<{
+    source: string;
+    label: string;
+    detail: string;
+  }>;
 }
 
 export interface UndoRequest {
@@ -36,6 +52,12 @@ export interface UndoResponse {
     from: string;
     to: string;
   }>;
+  // 元の場所に別のファイルがあるなどで戻さなかったファイル
+  errors?: Array<{
+    source: string;
+    destination: string;
+    detail: string;
+  }>;
 }
 
 class ApiError extends Error {
@@ -141,6 +163,71 @@ export async function undoClassification(request: UndoRequest): Promise<UndoResp
   }
 }
 
+/**
+ * Build the URL of a server-side cached thumbnail for an image
+ */
+export function getThumbnailUrl(imagePath: string, thumbnailSize: number): string {
+  const params = new URLSearchParams({
+    path: imagePath,
+    thumbnail_size: String(Math.round(thumbnailSize)),
+  });
+  return `${API_BASE_URL}/thumbnail?${params.toString()}`;
+}
+
+/**
+ * Build the URL of an original image served by the backend (HTTP-cacheable, Range-capable)
+ */
+export function getImageUrl(imagePath: string): string {
+  const params = new URLSearchParams({ path: imagePath });
+  return `${API_BASE_URL}/image?${params.toString()}`;
+}
+
+/**
+ * Build the URL of a DeepZoom pyramid tile (level 0 is 1x1, max_level is full size)
+ */
+export function getTileUrl(imagePath: string, level: number, col: number, row: number): string {
+  const params = new URLSearchParams({ path: imagePath });
+  return `${API_BASE_URL}/tiles/${level}/${col}/${row}?${params.toString()}`;
+}
+
+/**
+ * Ask the backend to pre-generate thumbnails for the images shown next
+ */
+export async function prefetchThumbnails(imagePaths: string[], thumbnailSize: number): Promise<void> {
+  await fetch(`${API_BASE_URL}/thumbnail/prefetch`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json; charset=utf-8',
+    },
+    body: JSON.stringify({
+      image_paths: imagePaths,
+      thumbnail_size: Math.round(thumbnailSize),
+    }),
+  });
+}
+
+/**
+ * Get suggested labels for images, in request order (images without a confident suggestion have none)
+ */
+export async function suggestLabels(
+  imagePaths: string[],
+  labels: string[],
+  minConfidence = 0
+): Promise<ImageInfo[]> {
+  const response = await fetch(`${API_BASE_URL}/suggestions`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json; charset=utf-8',
+    },
+    body: JSON.stringify({
+      image_paths: imagePaths,
+      labels,
+      min_confidence: minConfidence,
+    }),
+  });
+  return await handleResponse<ImageInfo[]>(response);
+}
+
 /**
  * Health check for API server
  */